@@ -0,0 +1,166 @@
+"""
+Кэш JSON-ответов для списков и карточек.
+
+Ключ строится из пути и нормализованной query string. Вместе с ответом
+сохраняются версии тегов, от которых он зависит ('ads', 'ad:5', 'user:3' ...).
+Сигналы post_save/post_delete меняют версию тегов изменённой модели, и
+записи с устаревшими версиями считаются промахом. Так правка одного
+объявления сбрасывает только списки и его карточку, а не весь кэш.
+ETag и Last-Modified ответа (см. ads/conditional.py) хранятся вместе с ним,
+и условный запрос получает 304 прямо из кэша.
+
+В кэш попадают и ответы, прочитанные с реплик, поэтому клиент, который недавно
+писал (см. ads/db_routers.py), читает мимо кэша и своих ответов в него не кладёт.
+"""
+import hashlib
+import uuid
+from urllib.parse import urlencode
+
+from django.core.cache import caches
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date
+
+from ads import settings
+from ads.db_routers import is_pinned
+from ads.metrics import registry
+
+
+# Заголовки ответа, которые сохраняются в кэше вместе с телом
+CACHED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+
+def _cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def _tag_key(tag):
+    return f'tag:{tag}'
+
+
+def response_cache_key(request):
+    query = urlencode(sorted((key, value) for key, values in request.GET.lists() for value in values))
+    digest = hashlib.md5(f'{request.path}?{query}'.encode()).hexdigest()
+    return f'response:{digest}'
+
+
+def tag_versions(tags):
+    """Текущие версии тегов; для тегов без версии она создаётся"""
+    cache = _cache()
+    keys = {_tag_key(tag): tag for tag in tags}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        cache.add(key, uuid.uuid4().hex, None)
+        versions[key] = cache.get(key)
+    return versions
+
+
+def invalidate(*tags):
+    _cache().set_many({_tag_key(tag): uuid.uuid4().hex for tag in tags}, None)
+
+
+class CachedResponseMixin:
+    """
+    Кэширует успешные GET-ответы view.
+    get_cache_tags() - теги, известные до построения ответа (по умолчанию cache_tags);
+    get_related_cache_tags() - теги связанных объектов, известные только после него
+    """
+    cache_tags = ()
+
+    def get_cache_tags(self):
+        return set(self.cache_tags)
+
+    def get_related_cache_tags(self):
+        return set()
+
+    def dispatch(self, request, *args, **kwargs):
+        # Закэшированный ответ мог быть прочитан с реплики, ещё не видящей записи клиента
+        if request.method != 'GET' or is_pinned():
+            return super().dispatch(request, *args, **kwargs)
+
+        cache = _cache()
+        view_name = type(self).__name__
+        key = response_cache_key(request)
+
+        entry = cache.get(key)
+        if entry is not None:
+            status, headers, content, versions = entry
+            if cache.get_many(versions.keys()) == versions:
+                registry.increment('response_cache_hits_total', view=view_name)
+                response = HttpResponse(content, status=status, headers=headers)
+                response['X-Cache'] = 'HIT'
+                if 'ETag' in headers or 'Last-Modified' in headers:
+                    last_modified = headers.get('Last-Modified')
+                    response = get_conditional_response(
+                        request, etag=headers.get('ETag'), response=response,
+                        last_modified=parse_http_date(last_modified) if last_modified else None)
+                return response
+
+        registry.increment('response_cache_misses_total', view=view_name)
+        # Версии основных тегов берём до построения ответа, чтобы запись,
+        # сделанная параллельно с ним, не осталась незамеченной
+        versions = tag_versions(self.get_cache_tags())
+        response = super().dispatch(request, *args, **kwargs)
+
+        # Запрос, который сам что-то записал, кэш не пополняет: версии тегов взяты до его записи
+        if response.status_code == 200 and not response.streaming and not is_pinned():
+            versions.update(tag_versions(self.get_related_cache_tags()))
+            headers = {name: response[name] for name in CACHED_HEADERS if response.has_header(name)}
+            cache.set(key, (response.status_code, headers, response.content, versions),
+                      settings.RESPONSE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+# Теги моделей: (тег всей коллекции, префикс тега отдельного объекта)
+MODEL_TAGS = {
+    'advertisements.advertisement': ('ads', 'ad'),
+    'categories.category': ('categories', 'category'),
+    'users.user': ('users', 'user'),
+    'users.location': ('locations', 'location'),
+}
+
+
+def invalidate_objects(label, pks):
+    """Сбрасывает кэш для объектов модели, изменённых в обход сигналов"""
+    collection_tag, item_prefix = MODEL_TAGS[label]
+    invalidate(collection_tag, *(f'{item_prefix}:{pk}' for pk in pks))
+
+
+def _model_invalidator(label):
+    def handler(sender, instance, **kwargs):
+        invalidate_objects(label, [instance.pk])
+    return handler
+
+
+invalidate_ad = _model_invalidator('advertisements.advertisement')
+invalidate_category = _model_invalidator('categories.category')
+invalidate_user = _model_invalidator('users.user')
+invalidate_location = _model_invalidator('users.location')
+
+
+def invalidate_user_locations(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        invalidate('users', f'user:{instance.pk}')
+    elif pk_set:
+        invalidate('users', *(f'user:{pk}' for pk in pk_set))
+    else:
+        invalidate('users')
+
+
+def connect_signals():
+    from advertisements.models import Advertisement
+    from categories.models import Category
+    from users.models import User, Location
+
+    for model, handler in ((Advertisement, invalidate_ad),
+                           (Category, invalidate_category),
+                           (User, invalidate_user),
+                           (Location, invalidate_location)):
+        post_save.connect(handler, sender=model, dispatch_uid=f'response_cache_{model.__name__}_save')
+        post_delete.connect(handler, sender=model, dispatch_uid=f'response_cache_{model.__name__}_delete')
+    m2m_changed.connect(invalidate_user_locations, sender=User.location.through,
+                        dispatch_uid='response_cache_user_location')
@@ -0,0 +1,124 @@
+"""
+Условные GET-запросы: ETag и Last-Modified без сборки ответа.
+
+Валидаторы считаются по индексированным отметкам updated и по счётчикам строк
+(RowCounter): max(updated) сдвигается при создании и изменении строк, а значение
+счётчика и его отметка - ещё и при удалении. Декораторы ниже ставятся на метод
+get view (в том числе async), поэтому на If-None-Match / If-Modified-Since без
+изменений тело ответа не строится и ответ - 304. ETag зависит и от пути с
+параметрами запроса, а сами параметры заранее проверяются теми же функциями,
+что и во view: на некорректные view отвечает 400, без валидаторов. У view с
+CachedResponseMixin валидаторы сохраняются вместе с ответом, и пока запись
+кэша действительна, запросов в БД нет вовсе.
+"""
+import hashlib
+from calendar import timegm
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.db.models import Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from ads.cache import response_cache_key
+from counters.models import RowCounter
+
+
+def tables_state(*models):
+    """
+    Состояние таблиц для списков: (значения для ETag, время последнего изменения).
+    На каждую модель - max(updated) по индексу и общий счётчик строк
+    """
+    labels = [model._meta.label_lower for model in models]
+    counters = {key: (value, updated) for key, value, updated in
+                RowCounter.objects.filter(key__in=labels).values_list('key', 'value', 'updated')}
+    values, times = [], []
+    for model, label in zip(models, labels):
+        # Счётчика нет, пока в таблице не было строк (см. counters.services.adjust_many)
+        count, counted = counters.get(label, (0, None))
+        latest = model._default_manager.aggregate(latest=Max('updated'))['latest']
+        values += [label, count, latest]
+        times += [counted, latest]
+    return values, max((time for time in times if time is not None), default=None)
+
+
+def row_state(model, pk, *paths):
+    """
+    Состояние объекта: его updated и отметки updated связанных объектов по путям
+    paths (например, 'author__updated'). None, если объекта нет
+    """
+    row = model._default_manager.filter(pk=pk).values_list('updated', *paths).first()
+    if row is None:
+        return None
+    return [model._meta.label_lower, pk, *row], max(time for time in row if time is not None)
+
+
+def conditional(state, parsers=()):
+    """
+    Декоратор метода get view (синхронного или async). state(request, *args, **kwargs)
+    возвращает (значения для ETag, время изменения) или None, если валидаторов нет.
+    parsers - функции разбора параметров запроса, которыми пользуется сам view: при
+    некорректных параметрах (ValueError) view отвечает 400, и 304 вместо него не отдаётся
+    """
+
+    def validators(request, args, kwargs):
+        for parse in parsers:
+            try:
+                parse(request.GET)
+            except ValueError:
+                return None
+        result = state(request, *args, **kwargs)
+        if result is None:
+            return None
+        # Слабый: тег описывает данные, а не байты ответа. От пути и параметров
+        # зависит, какая часть данных в ответе, поэтому они входят в тег
+        etag = 'W/"%s"' % hashlib.md5(repr([response_cache_key(request), *result[0]]).encode()).hexdigest()
+        return etag, result[1]
+
+    def not_modified(request, found):
+        etag, last_modified = found
+        return get_conditional_response(
+            request, etag=etag, last_modified=timegm(last_modified.utctimetuple()) if last_modified else None)
+
+    def with_validators(response, found):
+        # Ошибки и редиректы не кэшируются клиентом по этим валидаторам
+        if response.status_code in (200, 304):
+            etag, last_modified = found
+            response.headers.setdefault('ETag', etag)
+            if last_modified:
+                response.headers.setdefault('Last-Modified', http_date(timegm(last_modified.utctimetuple())))
+        return response
+
+    def decorator(method):
+        if iscoroutinefunction(method):
+            @wraps(method)
+            async def async_inner(view, request, *args, **kwargs):
+                found = await sync_to_async(validators)(request, args, kwargs)
+                if found is None:
+                    return await method(view, request, *args, **kwargs)
+                response = not_modified(request, found) or await method(view, request, *args, **kwargs)
+                return with_validators(response, found)
+
+            return async_inner
+
+        @wraps(method)
+        def inner(view, request, *args, **kwargs):
+            found = validators(request, args, kwargs)
+            if found is None:
+                return method(view, request, *args, **kwargs)
+            response = not_modified(request, found) or method(view, request, *args, **kwargs)
+            return with_validators(response, found)
+
+        return inner
+
+    return decorator
+
+
+def tables_condition(*models, parsers=()):
+    """Валидаторы списка, который зависит от таблиц models"""
+    return conditional(lambda request, *args, **kwargs: tables_state(*models), parsers)
+
+
+def row_condition(model, *paths, parsers=()):
+    """Валидаторы карточки объекта kwargs['pk'], см. row_state()"""
+    return conditional(lambda request, *args, **kwargs: row_state(model, kwargs['pk'], *paths), parsers)
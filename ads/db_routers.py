@@ -0,0 +1,145 @@
+"""
+Чтение с реплик базы данных.
+
+ReplicaRouter отправляет чтения GET- и HEAD-запросов (списки, карточки, выгрузки)
+на реплики из settings.DATABASE_REPLICAS по кругу. Реплика выбирается при первом
+чтении и до конца запроса не меняется, поэтому ETag и тело ответа считаются по
+одним данным. Запись всегда идёт в основную базу (default).
+
+Реплики отстают от основной базы, поэтому после записи запрос дочитывает с неё,
+а ответ ставит cookie: следующие settings.REPLICA_PIN_SECONDS секунд запросы
+клиента тоже читают с основной базы и видят его изменения. Запросы с записью
+(POST, PATCH, DELETE) и всё, что выполняется вне запроса (команды, пул картинок),
+работают только с default. Кэш ответов (ads/cache.py) один на все базы, и в нём
+может оказаться ответ, прочитанный с отстающей реплики, поэтому запросы с cookie
+и запросы, которые сами что-то записали, кэш не читают и не пополняют (см. is_pinned).
+"""
+import itertools
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+PRIMARY = 'default'
+PIN_COOKIE = 'db_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Состояние текущего запроса; None - вне ReplicaMiddleware
+_state = ContextVar('replica_state', default=None)
+# Номер очередного запроса для выбора реплики; next() у itertools.count атомарен
+_rotation = itertools.count()
+
+
+class _RequestState:
+    def __init__(self, use_replicas, pinned=False):
+        self.use_replicas = use_replicas
+        # Клиент недавно писал (cookie PIN_COOKIE)
+        self.pinned = pinned
+        self.replica = None
+        self.written = False
+
+
+def pin_primary():
+    """Дальше в этом запросе, а по cookie - и в следующих, читать с основной базы"""
+    state = _state.get()
+    if state is not None:
+        state.written = True
+
+
+def is_pinned():
+    """Читает ли текущий запрос с основной базы, чтобы видеть свои записи: по cookie или после записи в нём"""
+    state = _state.get()
+    return state is not None and (state.pinned or state.written)
+
+
+class ReplicaRouter:
+    """Вне ReplicaMiddleware и без реплик не вмешивается: база объекта или default, как без роутера"""
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or not state.use_replicas:
+            return None
+        if state.written:
+            return PRIMARY
+        if state.replica is None:
+            replicas = settings.DATABASE_REPLICAS
+            state.replica = replicas[next(_rotation) % len(replicas)]
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        pin_primary()
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db in settings.DATABASE_REPLICAS:
+            # Объект прочитан с реплики, а сохраняется в основную базу
+            return PRIMARY
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики - копии основной базы, объекты из них можно связывать между собой
+        aliases = {PRIMARY, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Как в MiddlewareMixin: в async-цепочке обработчиков переключаемся на __acall__
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        state, token = self._start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._finish(state, response)
+
+    async def __acall__(self, request):
+        # sync_to_async копирует контекст в поток ORM, поэтому состояние видно и там
+        state, token = self._start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _state.reset(token)
+        return self._finish(state, response)
+
+    @staticmethod
+    def _start(request):
+        pinned = PIN_COOKIE in request.COOKIES
+        state = _RequestState(bool(settings.DATABASE_REPLICAS) and request.method in SAFE_METHODS and not pinned,
+                              pinned)
+        return state, _state.set(state)
+
+    @staticmethod
+    def _finish(state, response):
+        if response.streaming:
+            # Тело потокового ответа (выгрузка) читается из БД уже после выхода из view
+            response.streaming_content = _routed(response.streaming_content, state)
+        if state.written and settings.DATABASE_REPLICAS:
+            response.set_cookie(PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                                httponly=True, samesite='Lax')
+        return response
+
+
+def _routed(content, state):
+    """Итерирует content с состоянием запроса state: каждый кусок читается с той же базы, что и view"""
+    iterator = iter(content)
+    while True:
+        token = _state.set(state)
+        try:
+            chunk = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            _state.reset(token)
+        yield chunk
@@ -0,0 +1,96 @@
+"""
+Выборочные поля ответа (?fields=id,name,price) и сборка ответа из строк values_list().
+
+Fieldset описывает поля ответа view: для каждого - колонки, которые нужны для его
+значения (пути для values_list(), через '__' - поля связанных моделей, JOIN Django
+добавит сам), и функцию, получающую значение из строки. Строки - именованные
+кортежи values_list(named=True), поэтому экземпляры моделей не создаются, а запрос
+читает только колонки запрошенных полей. Значения из других таблиц (например,
+M2M) загружаются функциями related одним запросом на страницу.
+Так же одним запросом отдаётся пачка объектов по ?ids= (Fieldset.batch).
+"""
+from collections import defaultdict
+from operator import attrgetter
+
+from asgiref.sync import sync_to_async
+
+from ads import settings
+
+
+def parse_ids(params):
+    """Id из ?ids=1,2,3 без повторов, в порядке запроса. При некорректном значении бросает ValueError"""
+    values = [value.strip() for value in (params.get('ids') or '').split(',') if value.strip()]
+    if not values:
+        raise ValueError('ids is required')
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except ValueError:
+        raise ValueError('ids must be comma-separated integers')
+    if len(ids) > settings.BATCH_MAX_IDS:
+        raise ValueError(f'at most {settings.BATCH_MAX_IDS} ids allowed')
+    return ids
+
+
+class Fieldset:
+    def __init__(self, fields, related=None):
+        # {поле ответа: колонка} - значение колонки как есть,
+        # или {поле ответа: (колонки, функция значения от строки)}
+        self.fields = {name: ((spec,), attrgetter(spec)) if isinstance(spec, str) else spec
+                       for name, spec in fields.items()}
+        # {поле ответа: функция (ids, using) -> {id строки: значение}}; строки без значения получают []
+        self.related = related or {}
+
+    @property
+    def names(self):
+        return [*self.fields, *self.related]
+
+    def parse(self, params):
+        """Поля из ?fields= в порядке запроса; без параметра - все. При неизвестном поле бросает ValueError"""
+        names = [name.strip() for name in (params.get('fields') or '').split(',') if name.strip()]
+        if not names:
+            return self.names
+        unknown = [name for name in names if name not in self.fields and name not in self.related]
+        if unknown:
+            raise ValueError(f'unknown fields: {", ".join(unknown)}; available: {", ".join(self.names)}')
+        return list(dict.fromkeys(names))
+
+    def apply(self, queryset, names, required=()):
+        """
+        Выборка строк values_list() с колонками полей names; required - колонки,
+        нужные самому view (например, для курсора или тегов кэша)
+        """
+        columns = dict.fromkeys(required)
+        for name in names:
+            columns.update(dict.fromkeys(self.fields[name][0] if name in self.fields else ('id',)))
+        return queryset.values_list(*columns, named=True)
+
+    def serialize(self, rows, names, using=None):
+        """Словари ответа для строк из apply() в порядке rows"""
+        rows = list(rows)
+        getters = []
+        for name in names:
+            if name in self.fields:
+                getters.append((name, self.fields[name][1]))
+            else:
+                values = defaultdict(list, self.related[name]([row.id for row in rows], using))
+                getters.append((name, lambda row, values=values: values[row.id]))
+        return [{name: getter(row) for name, getter in getters} for row in rows]
+
+    async def aserialize(self, rows, names, using=None):
+        if any(name in self.related for name in names):
+            return await sync_to_async(self.serialize)(rows, names, using)
+        return self.serialize(rows, names, using)
+
+    def batch(self, queryset, ids, names, required=()):
+        """
+        Объекты с id из ids одним запросом (и запросом на каждое поле из related).
+        Возвращает (словари ответа в порядке ids, id, которых не нашлось)
+        """
+        rows = {row.id: row for row in self.apply(queryset.filter(pk__in=ids), names, ('id', *required))}
+        found = [rows[pk] for pk in ids if pk in rows]
+        return self.serialize(found, names, queryset.db), [pk for pk in ids if pk not in rows]
+
+    def serialize_pk(self, queryset, pk):
+        """Все поля объекта по первичному ключу: ответ на создание или изменение"""
+        row = self.apply(queryset, self.names).get(pk=pk)
+        return self.serialize([row], self.names, queryset.db)[0]
@@ -0,0 +1,208 @@
+"""
+Метрики запросов в формате Prometheus.
+
+MetricsMiddleware считает для каждого маршрута число запросов, гистограмму
+времени ответа, число SQL-запросов и суммарное время в БД (через
+connection.execute_wrapper) - и для синхронных, и для async view. У потоковых
+ответов (выгрузки) в метрики входят и запросы, выполненные при чтении тела, а
+время считается до его конца. Другие подсистемы могут заводить свои счётчики
+через registry.increment(). Значения отдаются по /metrics.
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections
+from django.http import HttpResponse
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Метод приходит от клиента, поэтому ограничиваем набор значений метки
+KNOWN_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class RouteStats:
+    __slots__ = ('requests', 'buckets', 'duration', 'queries', 'sql_duration')
+
+    def __init__(self):
+        self.requests = {}
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.duration = 0.0
+        self.queries = 0
+        self.sql_duration = 0.0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+        self._counters = {}
+
+    def increment(self, name, **labels):
+        key = (name, ','.join(f'{label}="{value}"' for label, value in sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+
+    def observe(self, method, route, status, duration, queries, sql_duration):
+        key = f'method="{method}",route="{route}"'
+        with self._lock:
+            stats = self._routes.get(key)
+            if stats is None:
+                stats = self._routes[key] = RouteStats()
+            stats.requests[status] = stats.requests.get(status, 0) + 1
+            stats.buckets[bisect_left(LATENCY_BUCKETS, duration)] += 1
+            stats.duration += duration
+            stats.queries += queries
+            stats.sql_duration += sql_duration
+
+    def reset(self):
+        with self._lock:
+            self._routes = {}
+            self._counters = {}
+
+    def render(self):
+        with self._lock:
+            routes = sorted(self._routes.items())
+            lines = ['# HELP http_requests_total Total HTTP requests by route and status.',
+                     '# TYPE http_requests_total counter']
+            for labels, stats in routes:
+                for status, count in sorted(stats.requests.items()):
+                    lines.append(f'http_requests_total{{{labels},status="{status}"}} {count}')
+
+            lines += ['# HELP http_request_duration_seconds Request latency by route.',
+                      '# TYPE http_request_duration_seconds histogram']
+            for labels, stats in routes:
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                    cumulative += count
+                    lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                total = cumulative + stats.buckets[-1]
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {total}')
+                lines.append(f'http_request_duration_seconds_sum{{{labels}}} {stats.duration:.6f}')
+                lines.append(f'http_request_duration_seconds_count{{{labels}}} {total}')
+
+            lines += ['# HELP db_queries_total SQL queries executed by route.',
+                      '# TYPE db_queries_total counter']
+            for labels, stats in routes:
+                lines.append(f'db_queries_total{{{labels}}} {stats.queries}')
+
+            lines += ['# HELP db_query_duration_seconds_total Time spent in SQL by route.',
+                      '# TYPE db_query_duration_seconds_total counter']
+            for labels, stats in routes:
+                lines.append(f'db_query_duration_seconds_total{{{labels}}} {stats.sql_duration:.6f}')
+
+            declared = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in declared:
+                    lines.append(f'# TYPE {name} counter')
+                    declared.add(name)
+                lines.append(f'{name}{{{labels}}} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class QueryTimer:
+    """execute_wrapper, который считает запросы и время их выполнения"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+
+
+def _route_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return f'/{match.route}'.replace('"', '\\"')
+
+
+def _wrap_connections(timer):
+    stack = ExitStack()
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(timer))
+    return stack
+
+
+def _observe(request, response, start, timer):
+    method = request.method if request.method in KNOWN_METHODS else 'OTHER'
+    registry.observe(method, _route_label(request), response.status_code,
+                     time.perf_counter() - start, timer.count, timer.duration)
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Как в MiddlewareMixin: в async-цепочке обработчиков переключаемся на __acall__
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+
+        timer = QueryTimer()
+        start = time.perf_counter()
+
+        with _wrap_connections(timer):
+            response = self.get_response(request)
+
+        return self._finish(request, response, start, timer)
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+
+        # Соединения привязаны к потоку, в котором async ORM выполняет запросы,
+        # поэтому обёртки ставим и снимаем в нём же
+        stack = await sync_to_async(_wrap_connections)(timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+
+        return self._finish(request, response, start, timer)
+
+    @staticmethod
+    def _finish(request, response, start, timer):
+        if response.streaming:
+            # Тело читается из БД уже после выхода из view - учитываем, когда оно будет отдано
+            response.streaming_content = _measured(response.streaming_content, request, response, start, timer)
+        else:
+            _observe(request, response, start, timer)
+        return response
+
+
+def _measured(content, request, response, start, timer):
+    """Итерирует content, считая SQL каждого куска; запрос учитывается после последнего куска или обрыва"""
+    iterator = iter(content)
+    try:
+        while True:
+            # Обёртки ставятся на каждый кусок: поток, в котором читают тело, заранее не известен
+            with _wrap_connections(timer):
+                try:
+                    chunk = next(iterator)
+                except StopIteration:
+                    return
+            yield chunk
+    finally:
+        _observe(request, response, start, timer)
+
+
+def metrics_view(request):
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
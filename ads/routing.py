@@ -0,0 +1,7 @@
+from ads import settings
+
+
+def select_view(name, sync_view, async_view):
+    """View для маршрута name: async-вариант, если маршрут указан в settings.ASYNC_VIEWS"""
+    view = async_view if name in settings.ASYNC_VIEWS else sync_view
+    return view.as_view()
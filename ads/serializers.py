@@ -0,0 +1,59 @@
+"""
+Кодирование ответов API в JSON.
+
+Бэкенд задаётся settings.JSON_BACKEND: json (стандартная библиотека) или orjson,
+который кодирует в разы быстрее; пустое значение - orjson, если он установлен,
+иначе json. Оба бэкенда дают компактный UTF-8 и одинаково представляют Decimal,
+даты и ленивые строки (как DjangoJSONEncoder). Другой бэкенд подключается
+добавлением функции data -> bytes в JSON_BACKENDS.
+"""
+import json
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+from ads import settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = DjangoJSONEncoder()
+
+
+def _json_dumps(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def _orjson_dumps(data):
+    # Даты отдаём DjangoJSONEncoder, чтобы их формат не зависел от бэкенда
+    return orjson.dumps(data, default=_encoder.default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+JSON_BACKENDS = {'json': _json_dumps}
+if orjson is not None:
+    JSON_BACKENDS['orjson'] = _orjson_dumps
+
+
+def get_json_backend(name=None):
+    name = name or settings.JSON_BACKEND or ('orjson' if 'orjson' in JSON_BACKENDS else 'json')
+    try:
+        return JSON_BACKENDS[name]
+    except KeyError:
+        raise ImproperlyConfigured(f'JSON backend {name!r} is not available; available: {", ".join(JSON_BACKENDS)}')
+
+
+def dumps(data):
+    return get_json_backend()(data)
+
+
+class JsonResponse(HttpResponse):
+    """Замена django.http.JsonResponse, которая кодирует данные бэкендом из JSON_BACKEND"""
+
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError('In order to allow non-dict objects to be serialized set the safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        super().__init__(content=dumps(data), **kwargs)
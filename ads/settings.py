@@ -39,10 +39,13 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'advertisements.apps.AdvertisementConfig',
     'users',
-    'categories'
+    'categories',
+    'counters',
+    'datasync',
 ]
 
 MIDDLEWARE = [
+    'ads.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -50,6 +53,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'ads.db_routers.ReplicaMiddleware',
 ]
 
 ROOT_URLCONF = 'ads.urls'
@@ -88,6 +92,25 @@ DATABASES = {
     }
 }
 
+# Локальный запуск без PostgreSQL: DATABASE_SQLITE=db.sqlite3 - основная база в файле SQLite
+if os.environ.get('DATABASE_SQLITE'):
+    DATABASES['default'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.environ['DATABASE_SQLITE']}
+
+# Реплики только для чтения (ads/db_routers.py) - копии default с другим HOST или NAME:
+# DATABASE_REPLICA_HOSTS=host1,host2 (PostgreSQL) или DATABASE_REPLICA_NAMES=replica.sqlite3
+# (например, копия файла основной базы при локальной проверке). Алиасы - replica1, replica2...
+# GET-запросы читают с реплик по кругу; после записи клиент REPLICA_PIN_SECONDS секунд
+# читает с основной базы
+DATABASE_REPLICAS = []
+for _setting in ('HOST', 'NAME'):
+    for _value in filter(None, (value.strip() for value in
+                                os.environ.get(f'DATABASE_REPLICA_{_setting}S', '').split(','))):
+        _alias = f'replica{len(DATABASE_REPLICAS) + 1}'
+        DATABASES[_alias] = {**DATABASES['default'], _setting: _value, 'TEST': {'MIRROR': 'default'}}
+        DATABASE_REPLICAS.append(_alias)
+DATABASE_ROUTERS = ['ads.db_routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -135,4 +158,55 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 AUTH_USER_MODEL = "users.User"
 
-TOTAL_ON_PAGE = 10
\ No newline at end of file
+# Кэш ответов API. По умолчанию в памяти процесса; при нескольких воркерах
+# задайте RESPONSE_CACHE=file, чтобы они делили кэш и его инвалидацию на диске
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+if os.environ.get('RESPONSE_CACHE') == 'file':
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
+    }
+
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = 60
+
+TOTAL_ON_PAGE = 10
+
+# Кодировщик JSON-ответов (ads/serializers.py): json или orjson; пусто - orjson, если установлен
+JSON_BACKEND = os.environ.get('JSON_BACKEND', '')
+
+# Маршруты (имена из urls.py), которые обслуживают async view: ads, ad, categories,
+# category, users, user. Имеет смысл только при запуске под ASGI (ads.asgi)
+ASYNC_VIEWS = {name.strip() for name in os.environ.get('ASYNC_VIEWS', '').split(',') if name.strip()}
+
+# Ограничения /ad/bulk_create/
+BULK_CREATE_MAX_ITEMS = 10000
+BULK_CREATE_BATCH_SIZE = 500
+
+# Наибольшее число id в ?ids= для /ad/batch/ и /user/batch/
+BATCH_MAX_IDS = 100
+
+# Уменьшенные копии изображений объявлений (advertisements/images.py): имя -> (ширина, высота).
+# IMAGE_WORKERS - число процессов пула; 0 - строить копии прямо в запросе
+IMAGE_VARIANTS = {
+    'thumbnail': (200, 200),
+    'medium': (800, 800),
+}
+IMAGE_QUALITY = 85
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+
+# Ограничения загружаемых картинок (advertisements/storage.py)
+IMAGE_MAX_SIZE = 10 * 1024 * 1024
+IMAGE_MAX_DIMENSIONS = (8000, 8000)
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+# Поиск по радиусу (users/geo.py): размер ячейки сетки в градусах, максимум ячеек
+# в одном запросе (при большем радиусе отбор идёт только по координатам) и радиус в км
+GEO_CELL_SIZE = 0.1
+GEO_MAX_CELLS = 400
+GEO_MAX_RADIUS_KM = 500
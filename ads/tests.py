@@ -0,0 +1,277 @@
+import re
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncRequestFactory, RequestFactory, TestCase, override_settings
+from django.views import View
+
+from ads.cache import CachedResponseMixin
+from ads.db_routers import PIN_COOKIE, ReplicaMiddleware
+from ads.metrics import MetricsMiddleware, registry
+from advertisements.models import Advertisement
+from advertisements.views import AsyncAdEntityView
+from categories.models import Category
+from categories.views import AsyncCategoryListView
+from users.models import Location, User
+
+
+class ConditionalGetTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author', first_name='Автор')
+        self.category = Category.objects.create(name='Категория')
+        self.ads = [Advertisement.objects.create(name=f'Объявление {i}', author=self.author, price=i,
+                                                 category=self.category) for i in range(3)]
+
+    def test_unchanged_list_is_not_modified(self):
+        etag = self.client.get('/ad/')['ETag']
+        cache.clear()
+
+        response = self.client.get('/ad/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.content), (304, b''))
+        self.assertEqual(response['ETag'], etag)
+
+        Advertisement.objects.filter(pk=self.ads[0].pk).update(price=10)
+        self.assertEqual(self.client.get('/ad/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_depends_on_query(self):
+        urls = ['/ad/', '/ad/?page=2', '/ad/?price_from=1', '/ad/?fields=name', '/ad/?cursor=']
+        etags = {self.client.get(url)['ETag'] for url in urls}
+        self.assertEqual(len(etags), len(urls))
+
+        cache.clear()
+        etag = self.client.get('/ad/')['ETag']
+        self.assertEqual(self.client.get('/ad/?price_from=1', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_invalid_params_are_not_answered_with_304(self):
+        for url in ('/ad/?price_from=abc', '/ad/?cursor=bad', '/ad/?count=all', '/ad/?fields=unknown',
+                    '/ad/search/', f'/ad/{self.ads[0].id}/?fields=unknown', '/ad/batch/', '/cat/?count=all'):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.has_header('ETag'))
+                self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_missing_object_has_no_validators(self):
+        response = self.client.get('/ad/999/', HTTP_IF_NONE_MATCH='*')
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+    async def test_async_views(self):
+        factory = AsyncRequestFactory()
+        views = [(AsyncAdEntityView.as_view(), f'/ad/{self.ads[0].id}/', {'pk': self.ads[0].id}),
+                 (AsyncCategoryListView.as_view(), '/cat/', {})]
+        for view, url, kwargs in views:
+            with self.subTest(url=url):
+                response = await view(factory.get(url), **kwargs)
+                self.assertEqual(response.status_code, 200)
+
+                # AsyncRequestFactory передаёт extra как есть в заголовки ASGI-запроса
+                request = factory.get(url, **{'If-None-Match': response['ETag']})
+                response = await view(request, **kwargs)
+                self.assertEqual(response.status_code, 304)
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.authors = [User.objects.create(username=f'author_{i}', first_name='Автор') for i in range(2)]
+        self.category = Category.objects.create(name='Категория')
+        self.ads = [Advertisement.objects.create(name=f'Объявление {i}', author=author, price=i,
+                                                 category=self.category) for i, author in enumerate(self.authors)]
+
+    def get(self, url, **extra):
+        response = self.client.get(url, **extra)
+        return response['X-Cache'], response
+
+    def test_repeated_get_is_served_from_cache(self):
+        self.assertEqual(self.get('/ad/?price_from=0&category=%d' % self.category.id)[0], 'MISS')
+        # Порядок параметров не влияет на ключ
+        state, response = self.get('/ad/?category=%d&price_from=0' % self.category.id)
+
+        self.assertEqual(state, 'HIT')
+        self.assertEqual(response.json()['total'], 2)
+
+    def test_saving_object_invalidates_its_tags_only(self):
+        first, second = (f'/ad/{ad.id}/' for ad in self.ads)
+        for url in ('/ad/', first, second, '/cat/'):
+            self.get(url)
+
+        self.ads[0].price = 100
+        self.ads[0].save()
+
+        self.assertEqual([self.get(url)[0] for url in ('/ad/', first, second, '/cat/')],
+                         ['MISS', 'MISS', 'HIT', 'HIT'])
+        self.assertEqual(self.get(first)[1].json()['price'], 100)
+
+    def test_related_objects_invalidate_detail(self):
+        url = f'/ad/{self.ads[0].id}/'
+        self.get(url)
+        self.authors[1].first_name = 'Другой'
+        self.authors[1].save()
+        self.assertEqual(self.get(url)[0], 'HIT')
+
+        self.authors[0].first_name = 'Новое имя'
+        self.authors[0].save()
+        self.assertEqual(self.get(url)[0], 'MISS')
+
+        self.category.name = 'Новая категория'
+        self.category.save()
+        state, response = self.get(url)
+        self.assertEqual((state, response.json()['category_name']), ('MISS', 'Новая категория'))
+
+    def test_queryset_changes_and_locations_invalidate(self):
+        self.get('/ad/')
+        Advertisement.objects.filter(pk=self.ads[1].pk).update(price=50)
+        self.assertEqual(self.get('/ad/')[0], 'MISS')
+
+        self.get('/user/')
+        Advertisement.objects.filter(pk=self.ads[1].pk).delete()
+        self.assertEqual(self.get('/user/')[0], 'MISS')
+
+        self.get('/user/')
+        self.authors[0].location.add(Location.objects.create(name='Москва'))
+        self.assertEqual(self.get('/user/')[0], 'MISS')
+
+    def test_cached_response_answers_conditional_get(self):
+        etag = self.get('/ad/')[1]['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/ad/', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual((response.status_code, response['ETag']), (304, etag))
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+        author = User.objects.create(username='author', first_name='Автор')
+        category = Category.objects.create(name='Категория')
+        Advertisement.objects.bulk_create([Advertisement(name=f'Объявление {i}', author=author, price=i,
+                                                         category=category) for i in range(3)])
+
+    def test_streaming_queries_are_counted_after_body(self):
+        response = self.client.get('/ad/export/')
+        self.assertNotIn('route="/ad/export/"', registry.render())
+
+        lines = b''.join(response.streaming_content).splitlines()
+
+        self.assertEqual(len(lines), 3)
+        body = registry.render()
+        self.assertIn('http_requests_total{method="GET",route="/ad/export/",status="200"} 1', body)
+        queries = re.search(r'^db_queries_total\{method="GET",route="/ad/export/"\} (\d+)$', body, re.M)
+        self.assertGreater(int(queries[1]), 0)
+
+    def test_async_chain(self):
+        async def get_response(request):
+            return HttpResponse()
+
+        self.assertTrue(iscoroutinefunction(MetricsMiddleware(get_response)))
+        self.assertFalse(iscoroutinefunction(MetricsMiddleware(lambda request: HttpResponse())))
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTest(TestCase):
+    @staticmethod
+    def read_twice(request, reads):
+        reads.extend([router.db_for_read(Category), router.db_for_read(Category)])
+        return HttpResponse()
+
+    def call(self, method='get', cookies=None, view=None):
+        """Запрос через ReplicaMiddleware к view(request, reads). Возвращает (ответ, базы чтений во view)"""
+        reads = []
+        view = view or self.read_twice
+        request = getattr(RequestFactory(), method)('/')
+        request.COOKIES.update(cookies or {})
+        return ReplicaMiddleware(lambda request: view(request, reads))(request), reads
+
+    def test_get_reads_from_replicas_round_robin(self):
+        replicas = [self.call()[1] for _ in range(4)]
+
+        # Внутри запроса реплика одна, между запросами - по кругу
+        self.assertTrue(all(first == second for first, second in replicas))
+        self.assertEqual({first for first, _ in replicas}, {'replica1', 'replica2'})
+        self.assertNotEqual(replicas[0], replicas[1])
+
+    def test_post_reads_and_writes_primary(self):
+        def view(request, reads):
+            reads.append(router.db_for_read(Category))
+            Category.objects.create(name='Новая')
+            return HttpResponse()
+
+        response, reads = self.call('post', view=view)
+
+        self.assertEqual(reads, ['default'])
+        self.assertTrue(Category.objects.using('default').filter(name='Новая').exists())
+        self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+
+    def test_post_without_write_does_not_pin(self):
+        response, _ = self.call('post')
+
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_pin_cookie_reads_primary(self):
+        response, reads = self.call(cookies={PIN_COOKIE: '1'})
+
+        self.assertEqual(reads, ['default', 'default'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_write_during_get_pins_rest_of_request(self):
+        def view(request, reads):
+            reads.append(router.db_for_read(Category))
+            Category.objects.create(name='Новая')
+            reads.append(router.db_for_read(Category))
+            return HttpResponse()
+
+        response, reads = self.call(view=view)
+
+        self.assertIn(reads[0], settings.DATABASE_REPLICAS)
+        self.assertEqual(reads[1], 'default')
+        self.assertIn(PIN_COOKIE, response.cookies)
+
+    def test_streaming_response_reads_replica(self):
+        def view(request, reads):
+            reads.append(router.db_for_read(Category))
+            return StreamingHttpResponse(router.db_for_read(Category) for _ in range(2))
+
+        response, reads = self.call(view=view)
+
+        # Тело читается после выхода из middleware, но с той же реплики
+        self.assertEqual(b''.join(response.streaming_content).decode(), reads[0] * 2)
+
+    def test_pinned_requests_bypass_response_cache(self):
+        class CachedView(CachedResponseMixin, View):
+            def get(self, request):
+                if 'write' in request.GET:
+                    Category.objects.create(name='Новая')
+                return HttpResponse(router.db_for_read(Category))
+
+        def call(path, cookies=None):
+            request = RequestFactory().get(path)
+            request.COOKIES.update(cookies or {})
+            response = ReplicaMiddleware(CachedView.as_view())(request)
+            return response.content.decode(), response.get('X-Cache')
+
+        cache.clear()
+        replica, _ = call('/')
+        self.assertEqual(call('/'), (replica, 'HIT'))
+
+        # Клиент после записи не получает ответ реплики из кэша и не кладёт в него свой
+        self.assertEqual(call('/', {PIN_COOKIE: '1'}), ('default', None))
+        self.assertEqual(call('/'), (replica, 'HIT'))
+        self.assertEqual(call('/?write=1'), ('default', 'MISS'))
+        self.assertEqual(call('/?write=1')[1], 'MISS')
+
+    def test_outside_request_uses_primary(self):
+        self.assertEqual(router.db_for_read(Category), 'default')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_uses_primary(self):
+        response, reads = self.call()
+
+        self.assertEqual(reads, ['default', 'default'])
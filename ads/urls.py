@@ -18,6 +18,7 @@ from django.contrib import admin
 from django.urls import path, include
 
 from ads import settings
+from ads.metrics import metrics_view
 from advertisements import views
 
 urlpatterns = [
@@ -26,6 +27,7 @@ urlpatterns = [
     path('ad/', include('advertisements.urls')),
     path('cat/', include('categories.urls')),
     path('user/', include('users.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 if settings.DEBUG:
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
-from advertisements.models import Advertisement
+from advertisements.models import Advertisement, StoredImage
 
 admin.site.register(Advertisement)
+admin.site.register(StoredImage)
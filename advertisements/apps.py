@@ -1,8 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class AdvertisementConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'advertisements'
 
+    def ready(self):
+        from ads.cache import connect_signals as connect_cache_signals
+        from advertisements.search import ensure_sqlite_triggers
+        from advertisements.signals import connect_signals
+        connect_cache_signals()
+        connect_signals()
+        post_migrate.connect(ensure_sqlite_triggers, sender=self, dispatch_uid='ad_search_triggers')
+
 
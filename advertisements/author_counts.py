@@ -0,0 +1,73 @@
+"""
+Поддержка денормализованного User.ads_count - числа объявлений автора.
+
+Одиночные create/delete/смена автора обрабатываются сигналами
+(advertisements/signals.py), массовые bulk_create и update() - в
+AdvertisementQuerySet. Пересчёт и проверка - команда recount_ads_count.
+apply_row_changes() заодно обновляет счётчики строк и статистику категорий.
+"""
+from collections import Counter
+
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from categories.stats import STATS_FIELDS, apply_category_stats
+from counters.services import adjust_many, row_keys, tracked_fields
+from users.models import User
+
+AD_LABEL = 'advertisements.advertisement'
+
+
+def adjust_ads_count(deltas, using='default'):
+    """deltas - {author_id: изменение числа объявлений}"""
+    by_delta = {}
+    for author_id, delta in deltas.items():
+        if delta:
+            by_delta.setdefault(delta, []).append(author_id)
+    for delta, author_ids in by_delta.items():
+        User.objects.using(using).filter(pk__in=author_ids).update(ads_count=F('ads_count') + delta)
+
+
+def denormalized_fields():
+    """Поля объявления, от которых зависят ads_count, счётчики строк и статистика категорий"""
+    return list(dict.fromkeys(['author_id', *tracked_fields(AD_LABEL), *STATS_FIELDS]))
+
+
+def apply_row_changes(removed, added, using='default'):
+    """
+    Обновляет ads_count и счётчики строк по снимкам строк объявлений
+    (словари со значениями denormalized_fields()) до и после изменения
+    """
+    authors = Counter()
+    keys = Counter()
+    for rows, sign in ((removed, -1), (added, 1)):
+        for row in rows:
+            authors[row['author_id']] += sign
+            for key in row_keys(AD_LABEL, row):
+                keys[key] += sign
+    adjust_ads_count(authors, using)
+    adjust_many(keys, using)
+    apply_category_stats(removed, added, using)
+
+
+def actual_ads_count():
+    from advertisements.models import Advertisement
+
+    return Coalesce(Subquery(
+        Advertisement.objects.filter(author=OuterRef('pk')).order_by()
+        .values('author').annotate(total=Count('pk')).values('total')), Value(0))
+
+
+def recount_ads_count(user_ids=None, using='default'):
+    """Пересчитывает ads_count для указанных пользователей (или всех). Возвращает число строк"""
+    users = User.objects.using(using)
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+    return users.update(ads_count=actual_ads_count())
+
+
+def find_ads_count_mismatches(using='default'):
+    """Список (id, username, ads_count, фактическое число) для расходящихся пользователей"""
+    return list(User.objects.using(using).annotate(actual=actual_ads_count())
+                .exclude(ads_count=F('actual'))
+                .values_list('id', 'username', 'ads_count', 'actual'))
@@ -0,0 +1,50 @@
+import csv
+
+from ads.serializers import dumps
+from advertisements.serializers import AD_EXPORT_FIELDSET
+
+EXPORT_FIELDS = AD_EXPORT_FIELDSET.names
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    """Псевдо-файл для csv.writer: возвращает записанную строку, а не буферизует её"""
+
+    def write(self, value):
+        return value
+
+
+def export_queryset(queryset):
+    """Все объявления одним проходом по таблице, без загрузки выборки в память"""
+    return (AD_EXPORT_FIELDSET.apply(queryset, EXPORT_FIELDS)
+            .order_by('id')
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE))
+
+
+def export_rows(ads):
+    # Строки сериализуются пачками, чтобы не копить всю выгрузку в памяти
+    chunk = []
+    for ad in ads:
+        chunk.append(ad)
+        if len(chunk) == EXPORT_CHUNK_SIZE:
+            yield from AD_EXPORT_FIELDSET.serialize(chunk, EXPORT_FIELDS)
+            chunk = []
+    yield from AD_EXPORT_FIELDSET.serialize(chunk, EXPORT_FIELDS)
+
+
+def ndjson_lines(ads):
+    for row in export_rows(ads):
+        yield dumps(row) + b'\n'
+
+
+def csv_lines(ads):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in export_rows(ads):
+        yield writer.writerow([row[field] for field in EXPORT_FIELDS])
+
+
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson; charset=utf-8'),
+    'csv': (csv_lines, 'text/csv; charset=utf-8'),
+}
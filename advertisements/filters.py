@@ -0,0 +1,41 @@
+def _int_param(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+
+def _bool_param(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    value = value.lower()
+    if value in ('true', '1'):
+        return True
+    if value in ('false', '0'):
+        return False
+    raise ValueError(f'{name} must be true or false')
+
+
+def parse_ad_filters(params):
+    """
+    Разбирает фильтры списка объявлений из query string:
+    ?category=, ?author=, ?price_from=, ?price_to=, ?is_published=.
+    Возвращает аргументы для QuerySet.filter(); при некорректном значении бросает ValueError
+    """
+    values = {
+        'category_id': _int_param(params, 'category'),
+        'author_id': _int_param(params, 'author'),
+        'price__gte': _int_param(params, 'price_from'),
+        'price__lte': _int_param(params, 'price_to'),
+        'is_published': _bool_param(params, 'is_published'),
+    }
+    return {lookup: value for lookup, value in values.items() if value is not None}
+
+
+def filter_ads(queryset, params):
+    """Применяет к queryset фильтры из parse_ad_filters"""
+    return queryset.filter(**parse_ad_filters(params))
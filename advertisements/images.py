@@ -0,0 +1,195 @@
+"""
+Файлы картинок объявлений: уменьшенные копии и учёт ссылок.
+
+После загрузки картинки render_variants() в пуле процессов строит для каждого
+размера из settings.IMAGE_VARIANTS копию в JPEG и в WebP, а имена файлов
+записываются в Advertisement.image_variants всех объявлений с этой картинкой.
+Пока копии не готовы, API отдаёт вместо них оригинал.
+
+Картинки в ContentAddressedStorage общие для объявлений, поэтому сигналы
+ведут StoredImage.refs через acquire_image()/release_image(), а файл без
+ссылок удаляется после коммита вместе с копиями.
+"""
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+
+from ads import settings
+from ads.cache import invalidate
+from advertisements.storage import is_content_name
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'images/variants'
+# Формат Pillow и расширение файла для каждой копии
+VARIANT_FORMATS = {'': ('JPEG', 'jpg'), '_webp': ('WEBP', 'webp')}
+
+_executor = None
+_executor_lock = threading.Lock()
+# Готовые копии (image_name, future) для записи в БД потоком _store_rendered
+_rendered = queue.Queue()
+
+
+def variant_names(image_name):
+    """Имена всех копий картинки: {'thumbnail': 'images/variants/..._thumbnail.jpg', ...}"""
+    stem = os.path.splitext(os.path.basename(image_name))[0]
+    return {variant + suffix: f'{VARIANTS_DIR}/{stem}_{variant}.{extension}'
+            for variant in settings.IMAGE_VARIANTS
+            for suffix, (_, extension) in VARIANT_FORMATS.items()}
+
+
+def render_variants(media_root, image_name):
+    """
+    Строит копии изображения image_name (путь относительно media_root).
+    Выполняется в отдельном процессе, поэтому не обращается к ORM.
+    Возвращает результат variant_names()
+    """
+    from PIL import Image, ImageOps
+
+    os.makedirs(os.path.join(media_root, VARIANTS_DIR), exist_ok=True)
+    names = variant_names(image_name)
+
+    with Image.open(os.path.join(media_root, image_name)) as source:
+        image = ImageOps.exif_transpose(source).convert('RGB')
+    for variant, size in settings.IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        for suffix, (image_format, _) in VARIANT_FORMATS.items():
+            resized.save(os.path.join(media_root, names[variant + suffix]), image_format,
+                         quality=settings.IMAGE_QUALITY)
+    return names
+
+
+def image_storage():
+    from advertisements.models import Advertisement
+
+    return Advertisement._meta.get_field('image').storage
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=settings.IMAGE_WORKERS)
+            threading.Thread(target=_store_rendered, name='image-variants', daemon=True).start()
+        return _executor
+
+
+def store_variants(image_name, variants):
+    """Записывает копии всем объявлениям с этой картинкой; если таких уже нет, удаляет копии"""
+    from advertisements.models import Advertisement
+
+    ads = Advertisement.objects.filter(image=image_name)
+    pks = list(ads.values_list('pk', flat=True))
+    # update() по одному полю: сигналы и счётчики здесь не нужны
+    updated = ads.update(image_variants=variants)
+    if updated:
+        invalidate('ads', *(f'ad:{pk}' for pk in pks))
+    else:
+        delete_variants(variants)
+    return updated
+
+
+def _store_rendered():
+    """
+    Записывает в БД копии, построенные пулом. Колбэки future выполняются в служебном
+    потоке пула, поэтому ORM там не трогаем, а передаём результат сюда через очередь
+    """
+    while True:
+        _store_rendered_one(*_rendered.get())
+
+
+def _store_rendered_one(image_name, future):
+    # Соединения закрываются, как до и после запроса, с учётом CONN_MAX_AGE
+    close_old_connections()
+    try:
+        store_variants(image_name, future.result())
+    except Exception:
+        logger.exception('Не удалось подготовить копии изображения %s', image_name)
+    finally:
+        close_old_connections()
+
+
+def schedule_variants(ad):
+    """
+    Ставит построение копий картинки объявления в очередь после коммита транзакции.
+    Если у другого объявления с той же картинкой копии уже есть, берёт их.
+    При IMAGE_WORKERS = 0 копии строятся сразу, в текущем процессе
+    """
+    from advertisements.models import Advertisement
+
+    image_name = ad.image.name
+    ready = (Advertisement.objects.filter(image=image_name).exclude(image_variants={})
+             .values_list('image_variants', flat=True).first())
+    if ready:
+        store_variants(image_name, ready)
+        return
+
+    def submit():
+        if not settings.IMAGE_WORKERS:
+            store_variants(image_name, render_variants(image_storage().location, image_name))
+            return
+        future = _get_executor().submit(render_variants, image_storage().location, image_name)
+        future.add_done_callback(lambda done: _rendered.put((image_name, done)))
+
+    transaction.on_commit(submit)
+
+
+def acquire_image(name, using='default'):
+    """Учитывает ещё одну ссылку на файл из ContentAddressedStorage"""
+    from advertisements.models import StoredImage
+
+    if not is_content_name(name):
+        return
+    images = StoredImage.objects.using(using)
+    if images.filter(name=name).update(refs=F('refs') + 1):
+        return
+    try:
+        with transaction.atomic(using=using):
+            images.create(name=name, refs=1)
+    except IntegrityError:
+        # Строку успел создать параллельный запрос
+        images.filter(name=name).update(refs=F('refs') + 1)
+
+
+def release_image(name, using='default'):
+    """Снимает ссылку на файл; файл без ссылок удаляется после коммита"""
+    from advertisements.models import StoredImage
+
+    if not is_content_name(name):
+        return
+    StoredImage.objects.using(using).filter(name=name, refs__gt=0).update(refs=F('refs') - 1)
+    transaction.on_commit(lambda: delete_orphaned_image(name, using), using=using)
+
+
+def delete_orphaned_image(name, using='default'):
+    """Удаляет файл и его копии, если на него не осталось ссылок. Возвращает, был ли он удалён"""
+    from advertisements.models import StoredImage
+
+    # Файл удаляется, пока строка заблокирована: ContentAddressedStorage берёт ссылку
+    # в своей транзакции и проверяет наличие файла уже после нашего коммита
+    with transaction.atomic(using=using):
+        deleted, _ = StoredImage.objects.using(using).filter(name=name, refs=0).delete()
+        if deleted:
+            image_storage().delete(name)
+            delete_variants(variant_names(name))
+    return bool(deleted)
+
+
+def delete_variants(variants):
+    for name in variants.values():
+        image_storage().delete(name)
+
+
+def image_url(name):
+    return image_storage().url(name) if name else None
+
+
+def variant_url(image_name, variants, variant):
+    """URL копии из image_variants, а пока её нет - URL оригинала"""
+    return image_url(variants.get(variant) or image_name)
@@ -0,0 +1,91 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.http import JsonResponse as DjangoJsonResponse
+
+from ads.serializers import JSON_BACKENDS
+from advertisements.images import variant_url
+from advertisements.models import Advertisement
+from advertisements.serializers import AD_LIST_FIELDSET
+from categories.models import Category
+from users.models import User
+
+
+def model_page(queryset):
+    """Прежний путь: экземпляры моделей, словарь на каждое объявление и django.http.JsonResponse"""
+    items = [{'id': ad.id,
+              'name': ad.name,
+              'author_id': ad.author_id,
+              'author': ad.author.first_name,
+              'price': ad.price,
+              'description': ad.description,
+              'is_published': ad.is_published,
+              'category_id': ad.category_id,
+              'image': ad.image.url if ad.image else None,
+              'thumbnail': variant_url(ad.image.name, ad.image_variants, 'thumbnail')}
+             for ad in queryset.select_related('category', 'author')]
+    return DjangoJsonResponse({'items': items}).content
+
+
+def values_page(queryset, dumps):
+    """Путь через Fieldset: строки values_list() и выбранный JSON-бэкенд"""
+    names = AD_LIST_FIELDSET.names
+    rows = AD_LIST_FIELDSET.apply(queryset, names)
+    return dumps({'items': AD_LIST_FIELDSET.serialize(rows, names)})
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает сборку JSON страницы объявлений через модели и через values_list() с разными бэкендами'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='Объявлений на странице')
+        parser.add_argument('--repeat', type=int, default=5, help='Число замеров каждого варианта')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        using, rows = options['database'], options['rows']
+
+        # Недостающие объявления создаются во временной транзакции и откатываются в конце
+        with transaction.atomic(using=using):
+            self._fill(using, rows)
+            queryset = Advertisement.objects.using(using).order_by('-price', '-id')[:rows]
+
+            cases = {'модели + json': lambda: model_page(queryset)}
+            for name, dumps in JSON_BACKENDS.items():
+                cases[f'values_list + {name}'] = lambda dumps=dumps: values_page(queryset, dumps)
+
+            expected = json.loads(model_page(queryset))
+            results = {}
+            for name, build in cases.items():
+                if json.loads(build()) != expected:
+                    self.stderr.write(f'{name}: ответ отличается от прежнего')
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    build()
+                    timings.append(time.perf_counter() - started)
+                results[name] = statistics.median(timings)
+
+            transaction.set_rollback(True, using=using)
+
+        baseline = results['модели + json']
+        self.stdout.write(f'Страница из {rows} объявлений, медиана из {options["repeat"]} замеров:')
+        for name, duration in results.items():
+            self.stdout.write(f'  {name:<24} {duration * 1000:9.1f} мс  x{baseline / duration:.2f}')
+        self.stdout.write(self.style.SUCCESS('Готово'))
+
+    @staticmethod
+    def _fill(using, rows):
+        missing = rows - Advertisement.objects.using(using).count()
+        if missing <= 0:
+            return
+        author = User.objects.db_manager(using).create(username='benchmark_serializers', first_name='Бенчмарк')
+        category = Category.objects.db_manager(using).create(name='benchmark_serializers')
+        Advertisement.objects.using(using).bulk_create(
+            [Advertisement(name=f'Объявление {index}', author=author, category=category, price=index % 5000,
+                           description='Описание объявления. ' * 25, is_published=index % 2 == 0)
+             for index in range(missing)],
+            batch_size=1000)
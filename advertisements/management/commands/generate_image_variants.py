@@ -0,0 +1,39 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+
+from advertisements.images import image_storage, render_variants, store_variants
+from advertisements.models import Advertisement
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии картинок объявлений, у которых их ещё нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Перестроить копии для всех объявлений')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Число процессов (по умолчанию - по числу CPU)')
+
+    def handle(self, *args, **options):
+        ads = Advertisement.objects.exclude(image='')
+        if not options['all']:
+            ads = ads.filter(image_variants={})
+
+        # Одна картинка может быть у нескольких объявлений, копии строятся один раз
+        images = ads.order_by('image').values_list('image', flat=True).distinct()
+        location = image_storage().location
+
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(render_variants, location, image): image for image in images.iterator()}
+            for future in as_completed(futures):
+                image = futures[future]
+                try:
+                    store_variants(image, future.result())
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{image}: {error}')
+                else:
+                    done += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Обработано картинок: {done}, с ошибками: {failed}'))
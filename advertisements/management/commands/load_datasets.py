@@ -0,0 +1,221 @@
+import csv
+import io
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+
+from ads import settings
+from ads.cache import invalidate
+from advertisements.author_counts import recount_ads_count
+from advertisements.models import Advertisement
+from categories.models import Category
+from categories.stats import rebuild_category_stats
+from counters.services import recount
+from users.geo import cell_id
+from users.models import Location, User
+
+BATCH_SIZE = 5000
+NULL = '\\N'
+
+
+def _int(value):
+    value = value.strip()
+    return int(value) if value else None
+
+
+def _bool(value):
+    return value.strip().lower() == 'true'
+
+
+def _category(row, now):
+    return {'id': _int(row['id']), 'name': row['name'], 'created': now, 'updated': now}
+
+
+def _location(row):
+    lat, lng = row['lat'] or None, row['lng'] or None
+    return {'id': _int(row['id']), 'name': row['name'], 'lat': lat, 'lng': lng, 'cell': cell_id(lat, lng)}
+
+
+def _user(row, now):
+    return {'id': _int(row['id']), 'username': row['username'], 'password': row['password'],
+            'first_name': row['first_name'], 'last_name': row['last_name'], 'role': row['role'],
+            'age': _int(row['age']), 'is_superuser': _bool(row.get('is_superuser', '')),
+            'is_staff': False, 'is_active': True, 'email': '', 'date_joined': now, 'ads_count': 0,
+            'created': now, 'updated': now}
+
+
+def _user_location(row):
+    return {'user_id': _int(row['id']), 'location_id': _int(row['location_id'])}
+
+
+def _ad(row, now):
+    return {'id': _int(row['id']), 'name': row['name'], 'author_id': _int(row['author_id']),
+            'price': _int(row['price']), 'description': row['description'],
+            'is_published': _bool(row['is_published']), 'image': row['image'], 'image_variants': '{}',
+            'category_id': _int(row['category_id']), 'created': now, 'updated': now}
+
+
+class IteratorFile(io.TextIOBase):
+    """Файловый объект поверх генератора строк - для COPY FROM STDIN без буферизации всего файла"""
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._buffer = ''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._lines)
+            except StopIteration:
+                break
+        if size < 0:
+            chunk, self._buffer = self._buffer, ''
+        else:
+            chunk, self._buffer = self._buffer[:size], self._buffer[size:]
+        return chunk
+
+
+class Command(BaseCommand):
+    help = ('Загружает datasets/*.csv напрямую в таблицы: COPY FROM STDIN на PostgreSQL, '
+            'пакетный executemany на SQLite')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=os.path.join(settings.BASE_DIR, 'datasets'),
+                            help='папка с ad.csv, category.csv, location.csv и user.csv')
+        parser.add_argument('--clear', action='store_true', help='удалить существующие строки перед загрузкой')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        connection = connections[options['database']]
+        now = timezone.now()
+
+        # Порядок загрузки соответствует зависимостям внешних ключей
+        plan = [
+            (Category, 'category.csv', lambda row: _category(row, now)),
+            (Location, 'location.csv', _location),
+            (User, 'user.csv', lambda row: _user(row, now)),
+            (User.location.through, 'user.csv', _user_location),
+            (Advertisement, 'ad.csv', lambda row: _ad(row, now)),
+        ]
+        for _, filename, _ in plan:
+            if not os.path.exists(os.path.join(path, filename)):
+                raise CommandError(f'Нет файла {os.path.join(path, filename)}')
+
+        start = time.perf_counter()
+        total = 0
+        with transaction.atomic(using=connection.alias):
+            self.defer_constraints(connection)
+            if options['clear']:
+                for model, _, _ in reversed(plan):
+                    model._base_manager.using(connection.alias).all()._raw_delete(connection.alias)
+
+            for model, filename, convert in plan:
+                table_start = time.perf_counter()
+                rows = self.load(connection, model, os.path.join(path, filename), convert)
+                seconds = time.perf_counter() - table_start
+                total += rows
+                self.stdout.write(f'{model._meta.db_table}: {rows} строк за {seconds:.3f} с '
+                                  f'({rows / max(seconds, 1e-9):.0f} строк/с)')
+
+            try:
+                connection.check_constraints(table_names=[model._meta.db_table for model, _, _ in plan])
+            except IntegrityError as error:
+                raise CommandError(f'Данные не согласованы, загрузка отменена: {error}')
+            self.reset_sequences(connection, [model for model, _, _ in plan])
+
+        # Прямая загрузка обходит сигналы, поэтому денормализованные данные пересчитываем
+        recount_ads_count(using=connection.alias)
+        recount(using=connection.alias)
+        rebuild_category_stats(using=connection.alias)
+        invalidate('ads', 'users', 'categories', 'locations')
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено {total} строк за {elapsed:.3f} с ({total / max(elapsed, 1e-9):.0f} строк/с)'))
+
+    def defer_constraints(self, connection):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET CONSTRAINTS ALL DEFERRED')
+            elif connection.vendor == 'sqlite':
+                cursor.execute('PRAGMA defer_foreign_keys = ON')
+
+    def read_rows(self, file_path, convert):
+        with open(file_path, encoding='utf-8', newline='') as csv_file:
+            reader = csv.DictReader(csv_file)
+            reader.fieldnames = [name.strip() for name in reader.fieldnames]
+            for row in reader:
+                yield convert(row)
+
+    def load(self, connection, model, file_path, convert):
+        rows = self.read_rows(file_path, convert)
+        first = next(rows, None)
+        if first is None:
+            return 0
+
+        fields = list(first)
+        columns = [model._meta.get_field(field).column for field in fields]
+        table = connection.ops.quote_name(model._meta.db_table)
+        quoted_columns = ', '.join(connection.ops.quote_name(column) for column in columns)
+
+        def values():
+            yield [first[field] for field in fields]
+            for row in rows:
+                yield [row[field] for field in fields]
+
+        if connection.vendor == 'postgresql':
+            return self.copy(connection, table, quoted_columns, values())
+        return self.insert(connection, table, quoted_columns, len(columns), values())
+
+    def copy(self, connection, table, columns, values):
+        count = 0
+
+        def lines():
+            nonlocal count
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            for row in values:
+                writer.writerow([NULL if value is None else value for value in row])
+                count += 1
+                if buffer.tell() > 1 << 16:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+
+        with connection.cursor() as cursor:
+            # Курсор Django оборачивает курсор psycopg2, у которого есть copy_expert
+            cursor.cursor.copy_expert(
+                f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{NULL}')",
+                IteratorFile(lines()))
+        return count
+
+    def insert(self, connection, table, columns, width, values):
+        sql = f"INSERT INTO {table} ({columns}) VALUES ({', '.join(['%s'] * width)})"
+        count = 0
+        batch = []
+        with connection.cursor() as cursor:
+            for row in values:
+                batch.append(row)
+                if len(batch) >= BATCH_SIZE:
+                    cursor.executemany(sql, batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                cursor.executemany(sql, batch)
+                count += len(batch)
+        return count
+
+    def reset_sequences(self, connection, models):
+        statements = connection.ops.sequence_reset_sql(no_style(), models)
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
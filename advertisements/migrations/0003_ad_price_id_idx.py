@@ -0,0 +1,17 @@
+# Generated by Django 4.1.13 on 2026-10-18 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisements', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='advertisement',
+            index=models.Index(fields=['-price', '-id'], name='ad_price_id_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.1.13 on 2026-10-18 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisements', '0003_ad_price_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='advertisement',
+            index=models.Index(fields=['category', '-price', '-id'], name='ad_category_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='advertisement',
+            index=models.Index(fields=['is_published'], name='ad_is_published_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='advertisement',
+            index=models.Index(condition=models.Q(('is_published', True)), fields=['-price', '-id'], name='ad_published_price_idx'),
+        ),
+    ]
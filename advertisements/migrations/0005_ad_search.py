@@ -0,0 +1,22 @@
+# Generated by Django 4.1.13 on 2026-10-18 17:59
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+from advertisements.search import create_search_schema, drop_search_schema
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisements', '0004_ad_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='advertisement',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_schema, drop_search_schema),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.1.13 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+from advertisements.search import restore_sqlite_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisements', '0005_ad_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='advertisement',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(restore_sqlite_triggers, migrations.RunPython.noop),
+    ]
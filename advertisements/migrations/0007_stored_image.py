@@ -0,0 +1,34 @@
+# Generated by Django 4.1.13 on 2026-10-18 18:17
+
+import advertisements.storage
+from django.db import migrations, models
+
+from advertisements.search import restore_sqlite_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisements', '0006_ad_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredImage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('refs', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Файл изображения',
+                'verbose_name_plural': 'Файлы изображений',
+            },
+        ),
+        migrations.AlterField(
+            model_name='advertisement',
+            name='image',
+            field=models.ImageField(storage=advertisements.storage.ContentAddressedStorage(), upload_to='images/'),
+        ),
+        migrations.RunPython(restore_sqlite_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.1.13 on 2026-10-18 18:32
+
+from django.db import migrations, models
+import django.utils.timezone
+
+from advertisements.search import restore_sqlite_triggers
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisements', '0007_stored_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='advertisement',
+            name='created',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='advertisement',
+            name='updated',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(restore_sqlite_triggers, migrations.RunPython.noop),
+    ]
@@ -1,24 +1,118 @@
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.utils import timezone
 
 from ads import settings
+from ads.cache import invalidate
+from advertisements.storage import ContentAddressedStorage
 from categories.models import Category
+from categories.stats import STATS_FIELDS
+from counters.models import CountedModelMixin
 from users.models import User
 
 
-class Advertisement(models.Model):
+class AdvertisementQuerySet(models.QuerySet):
+    """
+    Массовые операции, которые обходят сигналы, сами поддерживают
+    User.ads_count, счётчики строк (см. advertisements/author_counts.py),
+    отметку updated и сбрасывают кэш ответов
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        from advertisements.author_counts import apply_row_changes, denormalized_fields, recount_ads_count
+        from counters.services import recount
+
+        objs = list(objs)
+        with transaction.atomic(using=self.db, savepoint=False):
+            created = super().bulk_create(objs, *args, **kwargs)
+            if kwargs.get('ignore_conflicts') or kwargs.get('update_conflicts'):
+                # Неизвестно, какие строки вставлены на самом деле
+                recount_ads_count({obj.author_id for obj in objs}, using=self.db)
+                recount(using=self.db)
+            else:
+                fields = denormalized_fields()
+                apply_row_changes([], [{field: getattr(obj, field) for field in fields} for obj in created],
+                                  using=self.db)
+        invalidate('ads')
+        return created
+
+    def update(self, **kwargs):
+        from advertisements.author_counts import apply_row_changes, denormalized_fields
+
+        # auto_now срабатывает только в save(), а updated нужен для ETag/Last-Modified
+        kwargs.setdefault('updated', timezone.now())
+        fields = denormalized_fields()
+        changed = {self.model._meta.get_field(name).attname for name in kwargs} & set(fields)
+        if not changed:
+            return super().update(**kwargs)
+
+        with transaction.atomic(using=self.db, savepoint=False):
+            before = list(self.values('pk', *fields))
+            rows = super().update(**kwargs)
+            after = list(self.model._default_manager.using(self.db)
+                         .filter(pk__in=[row['pk'] for row in before]).values(*fields))
+            apply_row_changes(before, after, using=self.db)
+        invalidate('ads', *(f"ad:{row['pk']}" for row in before))
+        return rows
+
+
+class Advertisement(CountedModelMixin, models.Model):
     name = models.CharField(max_length=150, null=True, blank=False)
     author = models.ForeignKey(to=settings.AUTH_USER_MODEL, to_field='id', on_delete=models.CASCADE, name='author')
     price = models.IntegerField(null=True, blank=False)
     description = models.CharField(max_length=3000, null=True, blank=True)
     is_published = models.BooleanField(default=False)
-    image = models.ImageField(upload_to='images/')
+    # Файлы именуются по sha256 содержимого, одинаковые картинки хранятся один раз
+    image = models.ImageField(upload_to='images/', storage=ContentAddressedStorage())
+    # Уменьшенные копии image: {'thumbnail': путь, 'thumbnail_webp': путь, ...}, см. advertisements/images.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     category = models.ForeignKey(Category, on_delete=models.DO_NOTHING, null=True)
+    # Заполняется триггером в PostgreSQL, см. advertisements/search.py
+    search_vector = SearchVectorField(null=True, editable=False)
+    created = models.DateTimeField(auto_now_add=True)
+    # Индекс отдаёт max(updated) для ETag/Last-Modified без обхода таблицы, см. ads/conditional.py
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = AdvertisementQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Нужен сигналам, чтобы заметить смену автора без лишнего запроса
+        instance._loaded_author_id = instance.__dict__.get('author_id')
+        # А это - чтобы при замене картинки освободить старый файл
+        instance._loaded_image = instance.__dict__.get('image')
+        # Снимок полей для статистики категорий; если часть полей отложена, его запросит сигнал
+        if all(field in instance.__dict__ for field in STATS_FIELDS):
+            instance._loaded_stats_row = {field: instance.__dict__[field] for field in STATS_FIELDS}
+        return instance
+
     class Meta:
         verbose_name = 'Объявление'
         verbose_name_plural = 'Объявления'
+        indexes = [
+            # Поддерживает keyset-пагинацию списка объявлений (?cursor=)
+            models.Index(fields=['-price', '-id'], name='ad_price_id_idx'),
+            # Фильтры списка: ?category= и ?is_published= с сохранением сортировки по цене.
+            # author и category уже проиндексированы как ForeignKey
+            models.Index(fields=['category', '-price', '-id'], name='ad_category_price_idx'),
+            models.Index(fields=['is_published'], name='ad_is_published_idx'),
+            models.Index(fields=['-price', '-id'], condition=models.Q(is_published=True),
+                         name='ad_published_price_idx'),
+        ]
 
 
+class StoredImage(models.Model):
+    """Файл картинки в ContentAddressedStorage и число объявлений, которые на него ссылаются"""
+    name = models.CharField(max_length=100, unique=True)
+    refs = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = 'Файл изображения'
+        verbose_name_plural = 'Файлы изображений'
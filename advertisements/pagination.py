@@ -0,0 +1,111 @@
+import base64
+import binascii
+import json
+
+from django.db import connections
+from django.db.models import Q
+
+from counters.pagination import parse_count_mode
+
+# Порядок выдачи объявлений в режиме курсора. Совпадает с индексом ad_price_id_idx,
+# поэтому каждая страница читается range scan'ом по индексу без OFFSET и COUNT(*).
+# NULL в price идут в том порядке, который принят в СУБД (см. nulls_order_largest).
+FORWARD_ORDERING = ('-price', '-id')
+BACKWARD_ORDERING = ('price', 'id')
+
+
+def encode_cursor(price, pk, backward=False):
+    """Упаковывает позицию (price, id) в непрозрачный токен для ?cursor="""
+    payload = json.dumps([price, pk, 'p' if backward else 'n'], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает (price, id, backward). При битом токене бросает ValueError"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        price, pk, direction = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError('invalid cursor')
+
+    if not isinstance(pk, int) or not (price is None or isinstance(price, int)) or direction not in ('n', 'p'):
+        raise ValueError('invalid cursor')
+    return price, pk, direction == 'p'
+
+
+def parse_page_params(params):
+    """Проверяет параметры страницы списка объявлений: ?cursor= или ?count=. При некорректных бросает ValueError"""
+    if 'cursor' in params:
+        if params['cursor']:
+            decode_cursor(params['cursor'])
+    else:
+        parse_count_mode(params)
+
+
+def _less(price, pk, nulls_largest):
+    # Строки меньше (price, pk) при сравнении кортежей, где NULL наибольший или наименьший
+    if price is None:
+        q = Q(price__isnull=True, id__lt=pk)
+        return q | Q(price__isnull=False) if nulls_largest else q
+    q = Q(price__lt=price) | Q(price=price, id__lt=pk)
+    return q if nulls_largest else q | Q(price__isnull=True)
+
+
+def _greater(price, pk, nulls_largest):
+    # Строки больше (price, pk), зеркально _less
+    if price is None:
+        q = Q(price__isnull=True, id__gt=pk)
+        return q if nulls_largest else q | Q(price__isnull=False)
+    q = Q(price__gt=price) | Q(price=price, id__gt=pk)
+    return q | Q(price__isnull=True) if nulls_largest else q
+
+
+def _cursor_queryset(queryset, token, per_page):
+    """Срез выборки для страницы по курсору и направление обхода"""
+    backward = False
+    if token:
+        price, pk, backward = decode_cursor(token)
+        nulls_largest = connections[queryset.db].features.nulls_order_largest
+        if backward:
+            queryset = queryset.filter(_greater(price, pk, nulls_largest)).order_by(*BACKWARD_ORDERING)
+        else:
+            queryset = queryset.filter(_less(price, pk, nulls_largest)).order_by(*FORWARD_ORDERING)
+    else:
+        queryset = queryset.order_by(*FORWARD_ORDERING)
+
+    # Берём на одну строку больше, чтобы узнать, есть ли следующая страница
+    return queryset[:per_page + 1], backward
+
+
+def _cursor_page(objects, token, backward, per_page):
+    has_more = len(objects) > per_page
+    objects = objects[:per_page]
+
+    if backward:
+        objects.reverse()
+        has_next, has_prev = True, has_more
+    else:
+        has_next, has_prev = has_more, bool(token)
+
+    next_cursor = prev_cursor = None
+    if objects:
+        if has_next:
+            next_cursor = encode_cursor(objects[-1].price, objects[-1].id)
+        if has_prev:
+            prev_cursor = encode_cursor(objects[0].price, objects[0].id, backward=True)
+    return objects, next_cursor, prev_cursor
+
+
+def paginate_by_cursor(queryset, token, per_page):
+    """
+    Keyset-пагинация по (price, id).
+    Возвращает (objects, next_cursor, prev_cursor); пустой token означает первую страницу.
+    """
+    queryset, backward = _cursor_queryset(queryset, token, per_page)
+    return _cursor_page(list(queryset), token, backward, per_page)
+
+
+async def apaginate_by_cursor(queryset, token, per_page):
+    """Асинхронный вариант paginate_by_cursor"""
+    queryset, backward = _cursor_queryset(queryset, token, per_page)
+    return _cursor_page([obj async for obj in queryset], token, backward, per_page)
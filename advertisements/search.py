@@ -0,0 +1,182 @@
+"""
+Полнотекстовый поиск по name и description объявлений.
+
+На PostgreSQL используется колонка search_vector (tsvector), которую поддерживает
+триггер, и GIN-индекс по ней. На SQLite (локальные запуски и тесты) - FTS5-таблица
+advertisements_ad_fts, синхронизируемая триггерами. Обе схемы создаются в миграции
+0005_ad_search; после пересоздания таблицы на SQLite триггеры восстанавливает
+restore_sqlite_triggers(), а если какая-то миграция этого не сделала - обработчик
+post_migrate ensure_sqlite_triggers().
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.db.models.expressions import RawSQL
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'advertisements_ad_fts'
+
+POSTGRES_FORWARD_SQL = [
+    f"""
+    CREATE FUNCTION advertisements_ad_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER advertisements_ad_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, description ON advertisements_advertisement
+    FOR EACH ROW EXECUTE FUNCTION advertisements_ad_search_vector_update()
+    """,
+    # Заполняем вектор для уже существующих строк
+    "UPDATE advertisements_advertisement SET name = name",
+    """
+    CREATE INDEX ad_search_vector_idx ON advertisements_advertisement
+    USING gin (search_vector)
+    """,
+]
+
+POSTGRES_REVERSE_SQL = [
+    "DROP INDEX IF EXISTS ad_search_vector_idx",
+    "DROP TRIGGER IF EXISTS advertisements_ad_search_vector_trigger ON advertisements_advertisement",
+    "DROP FUNCTION IF EXISTS advertisements_ad_search_vector_update()",
+]
+
+SQLITE_FORWARD_SQL = [
+    f"""
+    CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        name, description,
+        content='advertisements_advertisement', content_rowid='id',
+        tokenize='unicode61'
+    )
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON advertisements_advertisement BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON advertisements_advertisement BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF name, description ON advertisements_advertisement BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE_SQL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+
+def _run(schema_editor, statements):
+    for sql in statements:
+        schema_editor.execute(sql)
+
+
+def create_search_schema(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_FORWARD_SQL)
+    elif vendor == 'sqlite':
+        _run(schema_editor, SQLITE_FORWARD_SQL)
+
+
+def drop_search_schema(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_REVERSE_SQL)
+    elif vendor == 'sqlite':
+        _run(schema_editor, SQLITE_REVERSE_SQL)
+
+
+def restore_sqlite_triggers(apps, schema_editor):
+    """
+    SQLite выполняет часть изменений схемы (например, AddField с default) через
+    пересоздание таблицы, и триггеры FTS5 теряются. Миграции, которые меняют
+    таблицу объявлений, вызывают эту функцию после изменения
+    """
+    if schema_editor.connection.vendor == 'sqlite':
+        _run(schema_editor, SQLITE_REVERSE_SQL[:3] + SQLITE_FORWARD_SQL[1:])
+
+
+def missing_sqlite_triggers(connection):
+    """Имена триггеров FTS5, которых нет в базе; пустой список, если FTS-таблицы нет вовсе"""
+    triggers = [f'{FTS_TABLE}_ai', f'{FTS_TABLE}_ad', f'{FTS_TABLE}_au']
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT type, name FROM sqlite_master WHERE name IN (%s, %s, %s, %s)",
+                       [FTS_TABLE, *triggers])
+        found = set(cursor.fetchall())
+    if ('table', FTS_TABLE) not in found:
+        return []
+    return [name for name in triggers if ('trigger', name) not in found]
+
+
+def ensure_sqlite_triggers(using, **kwargs):
+    """
+    Обработчик post_migrate: восстанавливает потерянные триггеры FTS5 и перестраивает
+    индекс, ведь строки, изменённые без триггеров, в нём устарели
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite' or not missing_sqlite_triggers(connection):
+        return
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for sql in SQLITE_REVERSE_SQL[:3] + SQLITE_FORWARD_SQL[1:]:
+            cursor.execute(sql)
+
+
+def parse_search_query(params):
+    """Поисковая строка из ?q=. Без неё бросает ValueError"""
+    text = params.get('q', '').strip()
+    if not text:
+        raise ValueError('q is required')
+    return text
+
+
+def _fts5_query(text):
+    # Каждое слово берём в кавычки, чтобы пользовательский ввод не ломал синтаксис MATCH
+    terms = ['"%s"' % term.replace('"', '""') for term in text.split()]
+    return ' '.join(terms)
+
+
+def search_ads(queryset, text):
+    """
+    Фильтрует queryset объявлений по поисковой строке и сортирует по релевантности.
+    Поле rank в результате: чем больше, тем релевантнее
+    """
+    vendor = connections[queryset.db].vendor
+
+    if vendor == 'postgresql':
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+        return (queryset.filter(search_vector=query)
+                .annotate(rank=SearchRank(F('search_vector'), query))
+                .order_by('-rank', '-id'))
+
+    if vendor == 'sqlite':
+        match = _fts5_query(text)
+        if not match:
+            return queryset.none()
+        # bm25() возвращает меньшие значения для более релевантных строк
+        rank = RawSQL(
+            f"SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH %s AND rowid = advertisements_advertisement.id",
+            (match,))
+        ids = RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", (match,))
+        return queryset.filter(id__in=ids).annotate(rank=rank).order_by('-rank', '-id')
+
+    return (queryset.filter(Q(name__icontains=text) | Q(description__icontains=text))
+            .order_by('-id'))
@@ -0,0 +1,37 @@
+from ads.fieldsets import Fieldset
+from advertisements.images import image_url, variant_url
+
+AD_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'author_id': 'author_id',
+    'author': 'author__first_name',
+    'price': 'price',
+    'description': 'description',
+    'is_published': 'is_published',
+    'category_id': 'category_id',
+    'category_name': 'category__name',
+    'image': (('image',), lambda row: image_url(row.image)),
+    'thumbnail': (('image', 'image_variants'), lambda row: variant_url(row.image, row.image_variants, 'thumbnail')),
+    'image_variants': (('image', 'image_variants'),
+                       lambda row: {variant: variant_url(row.image, row.image_variants, variant)
+                                    for variant in row.image_variants}),
+}
+
+
+def _ad_fieldset(*names):
+    return Fieldset({name: AD_FIELDS[name] for name in names})
+
+
+# Поля списков объявлений; (price, id) нужны курсору при любом ?fields=
+AD_LIST_FIELDSET = _ad_fieldset('id', 'name', 'author_id', 'author', 'price', 'description',
+                                'is_published', 'category_id', 'image', 'thumbnail')
+AD_LIST_REQUIRED = ('id', 'price')
+
+AD_DETAIL_FIELDSET = _ad_fieldset('id', 'name', 'author_id', 'author', 'price', 'description',
+                                  'is_published', 'category_id', 'category_name', 'image', 'image_variants')
+# Автор и категория нужны для тегов кэша карточки
+AD_DETAIL_REQUIRED = ('id', 'author_id', 'category_id')
+
+AD_EXPORT_FIELDSET = _ad_fieldset('id', 'name', 'author_id', 'author', 'price', 'description',
+                                  'is_published', 'category_id', 'category_name', 'image')
@@ -0,0 +1,96 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from advertisements.author_counts import adjust_ads_count
+from advertisements.images import acquire_image, release_image
+from categories.stats import STATS_FIELDS, apply_category_stats
+
+
+def remember_old_author(sender, instance, raw, using, **kwargs):
+    # Обычно автор запомнен в Advertisement.from_db; запрашиваем его, только если поле было отложено
+    if instance._state.adding or raw or instance.__dict__.get('_loaded_author_id') is not None:
+        return
+    instance._loaded_author_id = (sender._default_manager.using(using).filter(pk=instance.pk)
+                                  .values_list('author_id', flat=True).first())
+
+
+def update_ads_count_on_save(sender, instance, created, raw, using, **kwargs):
+    if raw:
+        return
+    old_author_id = None if created else instance.__dict__.get('_loaded_author_id')
+    if created:
+        adjust_ads_count({instance.author_id: 1}, using)
+    elif old_author_id is not None and old_author_id != instance.author_id:
+        adjust_ads_count({old_author_id: -1, instance.author_id: 1}, using)
+    instance._loaded_author_id = instance.author_id
+
+
+def update_ads_count_on_delete(sender, instance, using, **kwargs):
+    adjust_ads_count({instance.author_id: -1}, using)
+
+
+def remember_old_image(sender, instance, raw, using, **kwargs):
+    if instance._state.adding or raw or instance.__dict__.get('_loaded_image') is not None:
+        return
+    instance._loaded_image = (sender._default_manager.using(using).filter(pk=instance.pk)
+                              .values_list('image', flat=True).first())
+
+
+def update_image_refs_on_save(sender, instance, created, raw, using, **kwargs):
+    if raw:
+        return
+    old_image = None if created else instance.__dict__.get('_loaded_image')
+    new_image = instance.image.name or None
+    if old_image != new_image:
+        if new_image:
+            acquire_image(new_image, using)
+        if old_image:
+            release_image(old_image, using)
+    instance._loaded_image = new_image
+
+
+def release_image_on_delete(sender, instance, using, **kwargs):
+    if instance.image:
+        release_image(instance.image.name, using)
+
+
+def _stats_row(instance):
+    # Значения могли быть присвоены строками из JSON, приводим их к типам полей
+    return {field: instance._meta.get_field(field).to_python(getattr(instance, field)) for field in STATS_FIELDS}
+
+
+def remember_old_stats_row(sender, instance, raw, using, **kwargs):
+    if instance._state.adding or raw or '_loaded_stats_row' in instance.__dict__:
+        return
+    instance._loaded_stats_row = (sender._default_manager.using(using).filter(pk=instance.pk)
+                                  .values(*STATS_FIELDS).first())
+
+
+def update_category_stats_on_save(sender, instance, created, raw, using, **kwargs):
+    if raw:
+        return
+    new_row = _stats_row(instance)
+    if created:
+        apply_category_stats([], [new_row], using)
+    else:
+        old_row = instance.__dict__.get('_loaded_stats_row')
+        if old_row is not None and old_row != new_row:
+            apply_category_stats([old_row], [new_row], using)
+    instance._loaded_stats_row = new_row
+
+
+def update_category_stats_on_delete(sender, instance, using, **kwargs):
+    apply_category_stats([_stats_row(instance)], [], using)
+
+
+def connect_signals():
+    from advertisements.models import Advertisement
+
+    pre_save.connect(remember_old_author, sender=Advertisement, dispatch_uid='ads_count_pre_save')
+    post_save.connect(update_ads_count_on_save, sender=Advertisement, dispatch_uid='ads_count_save')
+    post_delete.connect(update_ads_count_on_delete, sender=Advertisement, dispatch_uid='ads_count_delete')
+    pre_save.connect(remember_old_image, sender=Advertisement, dispatch_uid='image_refs_pre_save')
+    post_save.connect(update_image_refs_on_save, sender=Advertisement, dispatch_uid='image_refs_save')
+    post_delete.connect(release_image_on_delete, sender=Advertisement, dispatch_uid='image_refs_delete')
+    pre_save.connect(remember_old_stats_row, sender=Advertisement, dispatch_uid='category_stats_pre_save')
+    post_save.connect(update_category_stats_on_save, sender=Advertisement, dispatch_uid='category_stats_save')
+    post_delete.connect(update_category_stats_on_delete, sender=Advertisement, dispatch_uid='category_stats_delete')
@@ -0,0 +1,166 @@
+"""
+Хранилище картинок объявлений с адресацией по содержимому.
+
+Загрузка пишется на диск кусками во временный файл и одновременно хэшируется;
+готовый файл получает имя images/<xx>/<sha256>.<ext>, поэтому одинаковые
+картинки разных объявлений хранятся одним файлом. Расширение берётся из имени
+загрузки, если оно соответствует формату картинки, иначе - по формату. Сколько
+объявлений ссылается на файл, учитывает StoredImage (см. advertisements/images.py),
+а файл без ссылок удаляется вместе с его уменьшенными копиями.
+
+Ссылку на файл хранилище берёт в той же транзакции, что и проверяет, есть ли уже
+такой файл: параллельное удаление файла без ссылок (delete_orphaned_image) либо
+закончится до проверки, либо увидит ссылку. Эта ссылка снимается после коммита
+внешней транзакции, поэтому сохранять файл можно только внутри transaction.atomic()
+вместе с объявлением: вне транзакции её некому сменить, и _save бросает
+TransactionManagementError, ничего не сохраняя.
+"""
+import hashlib
+import io
+import os
+import re
+import tempfile
+
+from django.core.exceptions import ValidationError
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.db import router, transaction
+from django.db.transaction import TransactionManagementError
+from django.utils.deconstruct import deconstructible
+from PIL import Image, ImageFile
+
+from ads import settings
+
+CONTENT_NAME_RE = re.compile(r'^images/[0-9a-f]{2}/[0-9a-f]{64}\.\w+$')
+# Дальше этой границы заголовок картинки не ищем: файл без него - не картинка
+HEADER_LIMIT = 1024 * 1024
+
+
+def is_content_name(name):
+    return bool(name) and CONTENT_NAME_RE.match(name) is not None
+
+
+def check_dimensions(size):
+    max_width, max_height = settings.IMAGE_MAX_DIMENSIONS
+    width, height = size
+    if width > max_width or height > max_height:
+        raise ValidationError(f'image must be at most {max_width}x{max_height} pixels, got {width}x{height}')
+
+
+def image_extension(image_format, name=''):
+    """Расширение файла для формата Pillow: из name, если оно этого формата, иначе стандартное"""
+    extensions = [extension for extension, registered in Image.registered_extensions().items()
+                  if registered == image_format]
+    extension = os.path.splitext(name)[1].lower()
+    if extension in extensions:
+        return extension
+    default = '.' + image_format.lower()
+    return default if default in extensions or not extensions else extensions[0]
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Окончательное имя определяется содержимым в _save
+        return name
+
+    def _save(self, name, content):
+        from advertisements.images import acquire_image, release_image
+        from advertisements.models import StoredImage
+
+        using = router.db_for_write(StoredImage)
+        if not transaction.get_connection(using).in_atomic_block:
+            # Временная ссылка снялась бы сразу, и файл удалился бы до сохранения объявления
+            raise TransactionManagementError('image files can only be saved inside a transaction')
+
+        directory = os.path.dirname(name)
+        os.makedirs(self.path(directory), exist_ok=True)
+
+        digest = hashlib.sha256()
+        parser = ImageFile.Parser()
+        size = 0
+        descriptor, temp_path = tempfile.mkstemp(suffix='.part', dir=self.path(directory))
+        try:
+            with os.fdopen(descriptor, 'wb') as temp:
+                for chunk in content.chunks(settings.IMAGE_CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > settings.IMAGE_MAX_SIZE:
+                        raise ValidationError(f'image must be at most {settings.IMAGE_MAX_SIZE} bytes')
+                    # Размеры проверяем по заголовку, не дожидаясь конца файла
+                    if parser.image is None and size - len(chunk) < HEADER_LIMIT:
+                        parser.feed(chunk)
+                        if parser.image is not None:
+                            check_dimensions(parser.image.size)
+                    digest.update(chunk)
+                    temp.write(chunk)
+            if parser.image is None:
+                raise ValidationError('uploaded file is not an image')
+
+            hexdigest = digest.hexdigest()
+            name = f'{directory}/{hexdigest[:2]}/{hexdigest}{image_extension(parser.image.format, name)}'
+            path = self.path(name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with transaction.atomic(using=using):
+                # Ссылка до проверки: пока она есть, delete_orphaned_image файл не удалит
+                acquire_image(name, using)
+                # Такой же файл уже есть - новый не нужен
+                if os.path.exists(path):
+                    os.remove(temp_path)
+                else:
+                    os.replace(temp_path, path)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(path, self.file_permissions_mode)
+                # Ссылку объявления возьмёт сигнал при сохранении, эта снимается после коммита
+                transaction.on_commit(lambda: release_image(name, using), using=using)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return name
+
+
+class ImageSizeLimitHandler(FileUploadHandler):
+    """
+    Обработчик загрузки, который прекращает приём файла, как только тот превысил
+    IMAGE_MAX_SIZE или в его заголовке оказались размеры больше IMAGE_MAX_DIMENSIONS,
+    не читая остаток тела запроса. error - сообщение об ошибке или None
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.error = None
+        self.header = None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        # Начало файла, пока по нему не удалось прочитать размеры
+        self.header = bytearray()
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.IMAGE_MAX_SIZE:
+            self.error = f'image must be at most {settings.IMAGE_MAX_SIZE} bytes'
+            raise StopUpload(connection_reset=False)
+        if self.header is not None and start < HEADER_LIMIT:
+            self.header += raw_data
+            try:
+                self._check_header()
+            except ValidationError as error:
+                self.error = error.messages[0]
+                raise StopUpload(connection_reset=False)
+        return raw_data
+
+    def _check_header(self):
+        try:
+            # Image.open читает только заголовок и пиксели не декодирует
+            with Image.open(io.BytesIO(self.header)) as image:
+                size = image.size
+        except Image.DecompressionBombError as error:
+            raise ValidationError(str(error))
+        except Exception:
+            # Заголовок ещё не дочитан или это не картинка - последнее проверит хранилище
+            return
+        self.header = None
+        check_dimensions(size)
+
+    def file_complete(self, file_size):
+        return None
@@ -1,3 +1,346 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import Future
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
+from django.db import connection, connections
+from django.db.transaction import TransactionManagementError
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+
+from ads import settings
+from advertisements import images
+from advertisements.images import delete_orphaned_image, image_storage, variant_names
+from advertisements.models import Advertisement, StoredImage
+from advertisements.pagination import decode_cursor, encode_cursor, paginate_by_cursor
+from advertisements.search import FTS_TABLE, ensure_sqlite_triggers, missing_sqlite_triggers
+from advertisements.storage import ImageSizeLimitHandler, is_content_name
+from categories.models import Category
+from users.models import User
+
+
+class CursorPaginationTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author', first_name='Автор')
+        self.category = Category.objects.create(name='Категория')
+        # Одинаковые цены и NULL: порядок держится на id
+        for price in (5, 3, 3, None, 7, 3, None, 1, 5, 9):
+            self.create_ad(price)
+
+    def create_ad(self, price):
+        return Advertisement.objects.create(name='Объявление', author=self.author, price=price, category=self.category)
+
+    def walk(self, per_page=3):
+        pages, token = [], ''
+        while token is not None:
+            objects, token, _ = paginate_by_cursor(Advertisement.objects.all(), token, per_page)
+            pages.append([ad.id for ad in objects])
+        return pages
+
+    def test_pages_cover_ordering_once(self):
+        expected = list(Advertisement.objects.order_by('-price', '-id').values_list('id', flat=True))
+
+        pages = self.walk()
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+    def test_pages_are_stable_under_inserts(self):
+        first, token, _ = paginate_by_cursor(Advertisement.objects.all(), '', 3)
+        rest = list(Advertisement.objects.order_by('-price', '-id').values_list('id', flat=True))[3:]
+        # Новые строки до и после позиции курсора не сдвигают следующие страницы
+        self.create_ad(100)
+        added = self.create_ad(4)
+
+        seen = []
+        while token is not None:
+            objects, token, _ = paginate_by_cursor(Advertisement.objects.all(), token, 3)
+            seen += [ad.id for ad in objects]
+        self.assertEqual([pk for pk in seen if pk != added.id], rest)
+        self.assertIn(added.id, seen)
+
+    def test_backward_pages_mirror_forward(self):
+        objects, next_cursor, prev_cursor = paginate_by_cursor(Advertisement.objects.all(), '', 3)
+        forward = [([ad.id for ad in objects], prev_cursor)]
+        while next_cursor is not None:
+            objects, next_cursor, prev_cursor = paginate_by_cursor(Advertisement.objects.all(), next_cursor, 3)
+            forward.append(([ad.id for ad in objects], prev_cursor))
+
+        self.assertIsNone(forward[0][1])
+        for (previous, _), (_, prev_cursor) in zip(forward, forward[1:]):
+            objects, _, _ = paginate_by_cursor(Advertisement.objects.all(), prev_cursor, 3)
+            self.assertEqual([ad.id for ad in objects], previous)
+
+    def test_invalid_cursor(self):
+        for token in ('bad', encode_cursor('5', 1), encode_cursor(5, 1)[:-2] + '!!'):
+            with self.subTest(token=token):
+                with self.assertRaisesMessage(ValueError, 'invalid cursor'):
+                    decode_cursor(token)
+                self.assertEqual(self.client.get('/ad/', {'cursor': token}).status_code, 400)
+
+
+class AdBatchTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create(username='author', first_name='Автор')
+        self.category = Category.objects.create(name='Категория')
+        self.ads = [Advertisement.objects.create(name=f'Объявление {i}', author=self.author, price=i,
+                                                 category=self.category) for i in range(5)]
+
+    def get(self, ids, **params):
+        return self.client.get('/ad/batch/', {'ids': ids, **params})
+
+    def test_items_follow_requested_order(self):
+        ids = [self.ads[3].id, 999, self.ads[0].id, self.ads[3].id]
+
+        body = self.get(','.join(map(str, ids)), fields='id,price').json()
+
+        self.assertEqual(body, {'items': [{'id': self.ads[3].id, 'price': 3}, {'id': self.ads[0].id, 'price': 0}],
+                                'missing': [999]})
+
+    def test_queries_do_not_depend_on_ids(self):
+        counts = []
+        for ads in (self.ads[:1], self.ads):
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.get(','.join(str(ad.id) for ad in ads))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_limits(self):
+        too_many = ','.join(str(pk) for pk in range(1, settings.BATCH_MAX_IDS + 2))
+        for ids in ('', 'a,b', too_many):
+            with self.subTest(ids=ids[:10]):
+                self.assertEqual(self.get(ids).status_code, 400)
+        self.assertEqual(self.get(','.join(['1'] * (settings.BATCH_MAX_IDS + 1))).status_code, 200)
+
+
+class AdBulkCreateTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author', first_name='Автор')
+        self.category = Category.objects.create(name='Категория')
+
+    def post(self, items):
+        return self.client.post('/ad/bulk_create/', json.dumps(items), content_type='application/json')
+
+    def item(self, **kwargs):
+        return {'name': 'Объявление', 'author_id': self.author.id, 'category_id': self.category.id,
+                'price': 100, **kwargs}
+
+    def test_creates_valid_items_and_reports_invalid(self):
+        response = self.post([self.item(), self.item(author_id=999), 'строка', self.item(price='дорого')])
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['created'], body['failed']), (1, 3))
+        self.assertEqual(body['items'][0], {'index': 0, 'id': Advertisement.objects.get().id})
+        self.assertEqual(body['items'][1]['errors'], {'author_id': ['author not found']})
+        self.assertIn('__all__', body['items'][2]['errors'])
+        self.assertIn('price', body['items'][3]['errors'])
+
+    def test_is_published_is_parsed_like_create(self):
+        values = [True, False, 'True', '1', 'f', 'False', '0']
+        response = self.post([self.item(name=str(value), is_published=value) for value in values] + [self.item()])
+
+        self.assertEqual(response.json()['created'], len(values) + 1)
+        published = dict(Advertisement.objects.values_list('name', 'is_published'))
+        self.assertEqual(published, {'True': True, 'False': False, '1': True, 'f': False, '0': False,
+                                     'Объявление': False})
+
+    def test_invalid_is_published_is_an_item_error(self):
+        response = self.post([self.item(is_published='false'), self.item(is_published=None)])
+
+        self.assertEqual(response.json()['created'], 0)
+        self.assertTrue(all('is_published' in item['errors'] for item in response.json()['items']))
+        self.assertFalse(Advertisement.objects.exists())
+
+    def test_numeric_string_ids(self):
+        response = self.post([self.item(author_id=str(self.author.id), category_id=f' {self.category.id}'),
+                              self.item(author_id='abc'), self.item(category_id=True)])
+
+        self.assertEqual([sorted(item) for item in response.json()['items']],
+                         [['id', 'index'], ['errors', 'index'], ['errors', 'index']])
+        self.assertEqual(Advertisement.objects.get().author_id, self.author.id)
+
+    def test_limits(self):
+        self.assertEqual(self.post([{}] * (settings.BULK_CREATE_MAX_ITEMS + 1)).status_code, 400)
+        self.assertEqual(self.post({'items': []}).status_code, 400)
+        self.assertEqual(self.client.post('/ad/bulk_create/', '[', content_type='application/json').status_code, 400)
+        self.assertFalse(Advertisement.objects.exists())
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        # Копии строятся сразу, без пула процессов
+        workers = mock.patch.object(settings, 'IMAGE_WORKERS', 0)
+        workers.start()
+        self.addCleanup(workers.stop)
+
+        self.author = User.objects.create(username='author', first_name='Автор')
+        self.category = Category.objects.create(name='Категория')
+        self.ads = [Advertisement.objects.create(name=f'Объявление {i}', author=self.author, price=i,
+                                                 category=self.category) for i in range(2)]
+
+    @staticmethod
+    def image(size=(20, 10), image_format='PNG'):
+        buffer = io.BytesIO()
+        Image.new('RGB', size, 'red').save(buffer, image_format)
+        return buffer.getvalue()
+
+    def upload(self, ad, content, name='photo.png'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/ad/{ad.id}/upload_image/', {'image': SimpleUploadedFile(name, content)})
+        ad.refresh_from_db()
+        return response
+
+    def refs(self, name):
+        return StoredImage.objects.filter(name=name).values_list('refs', flat=True).first()
+
+    def test_same_content_is_stored_once(self):
+        content = self.image()
+        for ad in self.ads:
+            self.assertEqual(self.upload(ad, content).status_code, 200)
+        name = self.ads[0].image.name
+        storage = image_storage()
+
+        self.assertEqual(self.ads[1].image.name, name)
+        self.assertEqual(self.refs(name), 2)
+        self.assertEqual(set(self.ads[1].image_variants.values()), set(variant_names(name).values()))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ads[0].delete()
+        self.assertEqual(self.refs(name), 1)
+        self.assertTrue(storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ads[1].delete()
+        self.assertIsNone(self.refs(name))
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(any(storage.exists(variant) for variant in variant_names(name).values()))
+
+    def test_extension_follows_image_format(self):
+        cases = [('photo', self.image(), '.png'), ('photo.JPG', self.image(image_format='JPEG'), '.jpg'),
+                 ('photo.png', self.image(image_format='JPEG'), '.jpeg')]
+        for name, content, extension in cases:
+            with self.subTest(name=name):
+                self.assertEqual(self.upload(self.ads[0], content, name).status_code, 200)
+                self.assertTrue(is_content_name(self.ads[0].image.name))
+                self.assertEqual(os.path.splitext(self.ads[0].image.name)[1], extension)
+                self.assertEqual(self.refs(self.ads[0].image.name), 1)
+
+    def test_reference_is_taken_before_existing_file_check(self):
+        storage = image_storage()
+        with self.captureOnCommitCallbacks(execute=True):
+            name = storage.save('images/photo.png', ContentFile(self.image()))
+            # Удаление файла без ссылок, дошедшее до строки после проверки, файл не трогает
+            self.assertEqual(self.refs(name), 1)
+            self.assertFalse(delete_orphaned_image(name))
+            self.assertTrue(storage.exists(name))
+
+        # Файл так и не достался объявлению - после коммита он удаляется
+        self.assertIsNone(self.refs(name))
+        self.assertFalse(storage.exists(name))
+
+    def test_field_save_requires_transaction(self):
+        ad = self.ads[0]
+        # Вне транзакции временная ссылка снялась бы до сохранения объявления вместе с файлом
+        with mock.patch.object(connections['default'], 'in_atomic_block', False):
+            with self.assertRaises(TransactionManagementError):
+                ad.image.save('photo.png', ContentFile(self.image()))
+        self.assertFalse(StoredImage.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ad.image.save('photo.png', ContentFile(self.image()))
+        ad.refresh_from_db()
+        self.assertEqual(self.refs(ad.image.name), 1)
+        self.assertTrue(image_storage().exists(ad.image.name))
+
+    def test_not_an_image(self):
+        response = self.upload(self.ads[0], b'not an image')
+
+        self.assertEqual(response.json(), {'error': 'uploaded file is not an image'})
+        self.assertFalse(StoredImage.objects.exists())
+
+    def test_dimensions_are_checked_at_header(self):
+        content = self.image(size=(200, 200))
+        handler = ImageSizeLimitHandler()
+        handler.new_file('image', 'big.png', 'image/png', len(content))
+        with mock.patch.object(settings, 'IMAGE_MAX_DIMENSIONS', (100, 100)):
+            # Заголовок PNG с размерами - в первых 33 байтах
+            self.assertEqual(handler.receive_data_chunk(content[:16], 0), content[:16])
+            with self.assertRaises(StopUpload):
+                handler.receive_data_chunk(content[16:64], 16)
+            self.assertEqual(handler.error, 'image must be at most 100x100 pixels, got 200x200')
+
+            response = self.upload(self.ads[0], content)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(self.ads[0].image)
+
+
+class RenderedVariantsTest(TestCase):
+    def future(self, result=None, error=None):
+        future = Future()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+        return future
+
+    @mock.patch.object(images, 'close_old_connections')
+    def test_result_is_stored_and_connections_closed(self, close_old_connections):
+        with mock.patch.object(images, 'store_variants') as store_variants:
+            images._store_rendered_one('images/ab/ab.png', self.future({'thumbnail': 'images/variants/ab.jpg'}))
+
+        store_variants.assert_called_once_with('images/ab/ab.png', {'thumbnail': 'images/variants/ab.jpg'})
+        self.assertEqual(close_old_connections.call_count, 2)
+
+    @mock.patch.object(images, 'close_old_connections')
+    def test_failures_are_logged(self, close_old_connections):
+        with self.assertLogs(images.logger, 'ERROR') as logs:
+            images._store_rendered_one('images/ab/ab.png', self.future(error=OSError('broken image')))
+            with mock.patch.object(images, 'store_variants', side_effect=RuntimeError):
+                images._store_rendered_one('images/ab/ab.png', self.future({}))
+
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(close_old_connections.call_count, 4)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'FTS5-триггеры есть только на SQLite')
+class SqliteSearchTriggersTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author', first_name='Автор')
+        self.category = Category.objects.create(name='Категория')
+
+    def search(self, text):
+        return [ad['name'] for ad in self.client.get('/ad/search/', {'q': text}).json()['items']]
+
+    def test_migrations_leave_triggers_in_place(self):
+        self.assertEqual(missing_sqlite_triggers(connection), [])
+
+    def test_post_migrate_restores_triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DROP TRIGGER {FTS_TABLE}_ai')
+            cursor.execute(f'DROP TRIGGER {FTS_TABLE}_au')
+        self.assertEqual(missing_sqlite_triggers(connection), [f'{FTS_TABLE}_ai', f'{FTS_TABLE}_au'])
+        # Строка, вставленная без триггера, попадает в индекс при его перестройке
+        Advertisement.objects.create(name='Велосипед горный', author=self.author, price=1, category=self.category)
+
+        ensure_sqlite_triggers(using='default')
+
+        self.assertEqual(missing_sqlite_triggers(connection), [])
+        self.assertEqual(self.search('велосипед'), ['Велосипед горный'])
+        Advertisement.objects.create(name='Велосипед детский', author=self.author, price=2, category=self.category)
+        self.assertEqual(sorted(self.search('велосипед')), ['Велосипед горный', 'Велосипед детский'])
@@ -1,11 +1,17 @@
 from django.urls import path
 
+from ads.routing import select_view
 from advertisements.views import *
 
 urlpatterns = [
-    path('', AdsListView.as_view(), name='ads'),
-    path('<int:pk>/', AdEntityView.as_view(), name='ad'),
+    path('', select_view('ads', AdsListView, AsyncAdsListView), name='ads'),
+    path('search/', AdSearchView.as_view(), name='search ads'),
+    path('nearby/', AdNearbyView.as_view(), name='nearby ads'),
+    path('export/', AdExportView.as_view(), name='export ads'),
+    path('batch/', AdBatchView.as_view(), name='batch ads'),
+    path('<int:pk>/', select_view('ad', AdEntityView, AsyncAdEntityView), name='ad'),
     path('create/', AdCreateView.as_view(), name='create ad'),
+    path('bulk_create/', AdBulkCreateView.as_view(), name='bulk create ads'),
     path('<int:pk>/update/', AdUpdateView.as_view(), name='update ad'),
     path('<int:pk>/delete/', AdDeleteView.as_view(), name='delete ad'),
     path('<int:pk>/upload_image/', AdImageUploadView.as_view(), name='image import')
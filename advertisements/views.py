@@ -2,7 +2,8 @@ import json
 
 from django.contrib.auth import get_user_model
 from django.core.paginator import Paginator
-from django.http import JsonResponse
+from django.db import transaction
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
 from django.utils.decorators import method_decorator
 from django.views import View
@@ -11,8 +12,22 @@ from django.views.generic import ListView, DetailView, CreateView, DeleteView, U
 from django.core.exceptions import ValidationError
 
 from ads import settings
+from ads.cache import CachedResponseMixin
+from ads.conditional import row_condition, tables_condition
+from ads.fieldsets import parse_ids
+from ads.serializers import JsonResponse
+from advertisements.export import EXPORT_FORMATS, export_queryset
+from advertisements.filters import filter_ads, parse_ad_filters
+from advertisements.images import schedule_variants
 from advertisements.models import Advertisement
+from advertisements.pagination import apaginate_by_cursor, paginate_by_cursor, parse_page_params
+from advertisements.search import parse_search_query, search_ads
+from advertisements.serializers import (AD_DETAIL_FIELDSET, AD_DETAIL_REQUIRED, AD_LIST_FIELDSET,
+                                        AD_LIST_REQUIRED)
+from advertisements.storage import ImageSizeLimitHandler
 from categories.models import Category
+from counters.pagination import apaginate, paginate
+from users.geo import nearest_users, parse_point
 from users.models import User
 
 
@@ -22,55 +37,241 @@ class IndexView(View):
         return JsonResponse({'status': 'ok'}, status=200)
 
 
+# Параметры списка объявлений, которые проверяются до ответа 304
+AD_LIST_PARSERS = (AD_LIST_FIELDSET.parse, parse_ad_filters, parse_page_params)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
-class AdsListView(ListView):
+class AdsListView(CachedResponseMixin, ListView):
     model = Advertisement
+    cache_tags = ('ads', 'users')
 
+    # В списке есть имя автора, поэтому ответ зависит и от пользователей
+    @tables_condition(Advertisement, User, parsers=AD_LIST_PARSERS)
     def get(self, request, *args, **kwargs):
         super().get(request, *args, **kwargs)
-        self.object_list = self.object_list.select_related('category').select_related('author').order_by('-price')
+
+        try:
+            fields = AD_LIST_FIELDSET.parse(request.GET)
+            filters = parse_ad_filters(request.GET)
+            # ?cursor= и ?count= проверяются здесь: ValueError из пагинации - уже не ошибка клиента
+            parse_page_params(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        self.object_list = AD_LIST_FIELDSET.apply(self.object_list, fields, AD_LIST_REQUIRED).filter(**filters)
+
+        # Режим курсора: ?cursor= (пустой для первой страницы). Без COUNT(*) и OFFSET
+        if 'cursor' in request.GET:
+            page, next_cursor, prev_cursor = paginate_by_cursor(
+                self.object_list, request.GET.get('cursor'), settings.TOTAL_ON_PAGE)
+            response = {"items": self._serialize(page, fields),
+                        "next": next_cursor,
+                        "prev": prev_cursor}
+            return JsonResponse(response, safe=False, status=200)
+
+        page, total, num_pages = paginate(self.object_list.order_by('-price'), request.GET,
+                                          settings.TOTAL_ON_PAGE, model=Advertisement, filters=filters)
+
+        response = {"items": self._serialize(page, fields),
+                    "total": total,
+                    "num_pages": num_pages}
+        return JsonResponse(response, safe=False, status=200)
+
+    @staticmethod
+    def _serialize(ads, fields=None):
+        return AD_LIST_FIELDSET.serialize(ads, fields or AD_LIST_FIELDSET.names)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AdNearbyView(View):
+    """
+    Объявления авторов, у которых есть локация в радиусе ?radius_km= от точки ?lat=&lng=.
+    Фильтры, ?fields=, сортировка и пагинация (в том числе ?cursor=) - как у AdsListView
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            lat, lng, radius_km = parse_point(request.GET)
+            fields = AD_LIST_FIELDSET.parse(request.GET)
+            filters = parse_ad_filters(request.GET)
+            parse_page_params(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+
+        # Авторы в радиусе - подзапрос по индексу ячеек локаций, объявления - по индексу author_id.
+        # Расстояния считаются потом только для авторов страницы
+        authors = nearest_users(lat, lng, radius_km)
+        # author_id нужен для distance_km
+        ads = (AD_LIST_FIELDSET.apply(Advertisement.objects, fields, AD_LIST_REQUIRED + ('author_id',))
+               .filter(author_id__in=authors.values('user_id'), **filters))
+
+        if 'cursor' in request.GET:
+            page, next_cursor, prev_cursor = paginate_by_cursor(
+                ads, request.GET.get('cursor'), settings.TOTAL_ON_PAGE)
+            response = {"items": self._serialize(page, authors, fields),
+                        "next": next_cursor,
+                        "prev": prev_cursor}
+            return JsonResponse(response, safe=False, status=200)
+
+        page, total, num_pages = paginate(ads.order_by('-price', '-id'), request.GET, settings.TOTAL_ON_PAGE)
+
+        response = {"items": self._serialize(page, authors, fields),
+                    "total": total,
+                    "num_pages": num_pages}
+        return JsonResponse(response, safe=False, status=200)
+
+    @staticmethod
+    def _serialize(ads, authors, fields=None):
+        ads = list(ads)
+        distances = dict(authors.filter(user_id__in={ad.author_id for ad in ads})
+                         .values_list('user_id', 'distance_km'))
+        return [dict(item, distance_km=round(distances[ad.author_id], 3))
+                for ad, item in zip(ads, AdsListView._serialize(ads, fields))]
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AdSearchView(ListView):
+    model = Advertisement
+
+    @tables_condition(Advertisement, User, parsers=(parse_search_query, AD_LIST_FIELDSET.parse, parse_ad_filters))
+    def get(self, request, *args, **kwargs):
+        super().get(request, *args, **kwargs)
+
+        try:
+            text = parse_search_query(request.GET)
+            fields = AD_LIST_FIELDSET.parse(request.GET)
+            self.object_list = filter_ads(self.object_list, request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        self.object_list = AD_LIST_FIELDSET.apply(search_ads(self.object_list, text), fields)
 
         paginator = Paginator(self.object_list, settings.TOTAL_ON_PAGE)
         page_num = request.GET.get("page")
         page = paginator.get_page(page_num)
 
-        result = [{
-            'id': ad.id,
-            'name': ad.name,
-            'author_id': ad.author_id,
-            'author': ad.author.first_name,
-            'price': ad.price,
-            'description': ad.description,
-            'is_published': ad.is_published,
-            'category_id': ad.category_id,
-            'image': ad.image.url if ad.image else None}
-            for ad in page]
-        response = {"items": result,
+        response = {"items": AdsListView._serialize(page, fields),
                     "total": paginator.count,
                     "num_pages": paginator.num_pages}
         return JsonResponse(response, safe=False, status=200)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
-class AdEntityView(DetailView):
+class AdExportView(View):
+    """Потоковая выгрузка всех объявлений: ?format=ndjson (по умолчанию) или csv, с фильтрами списка"""
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.GET.get('format') or 'ndjson'
+        if export_format not in EXPORT_FORMATS:
+            return JsonResponse({'error': f'format must be one of: {", ".join(EXPORT_FORMATS)}'}, status=400)
+        try:
+            filters = parse_ad_filters(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+
+        render_lines, content_type = EXPORT_FORMATS[export_format]
+        ads = export_queryset(Advertisement.objects.filter(**filters))
+        response = StreamingHttpResponse(render_lines(ads), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="ads.{export_format}"'
+        return response
+
+
+# Карточка объявления меняется и вместе с автором и категорией
+AD_DETAIL_CONDITION = row_condition(Advertisement, 'author__updated', 'category__updated',
+                                    parsers=(AD_DETAIL_FIELDSET.parse,))
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AdEntityView(CachedResponseMixin, DetailView):
     model = Advertisement
 
+    def get_cache_tags(self):
+        return {f"ad:{self.kwargs['pk']}"}
+
+    def get_related_cache_tags(self):
+        return {f'user:{self.object.author_id}', f'category:{self.object.category_id}'}
+
+    @AD_DETAIL_CONDITION
     def get(self, request, *args, **kwargs):
-        super().get(request, *args, **kwargs)
+        try:
+            fields = AD_DETAIL_FIELDSET.parse(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        self.object = self.get_object(AD_DETAIL_FIELDSET.apply(self.get_queryset(), fields, AD_DETAIL_REQUIRED))
 
-        self.object = self.get_object()
+        return JsonResponse(self._serialize(self.object, fields))
+
+    @staticmethod
+    def _serialize(ad, fields=None):
+        return AD_DETAIL_FIELDSET.serialize([ad], fields or AD_DETAIL_FIELDSET.names)[0]
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AdBatchView(CachedResponseMixin, View):
+    """
+    Несколько карточек объявлений одним запросом: ?ids=1,2,3, ?fields= - как у AdEntityView.
+    Объявления идут в порядке ids, ненайденные id перечислены в missing
+    """
+    cache_tags = ('ads', 'users', 'categories')
+
+    @tables_condition(Advertisement, User, Category, parsers=(parse_ids, AD_DETAIL_FIELDSET.parse))
+    def get(self, request, *args, **kwargs):
+        try:
+            ids = parse_ids(request.GET)
+            fields = AD_DETAIL_FIELDSET.parse(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
 
-        return JsonResponse({'id': self.object.id,
-                             'name': self.object.name,
-                             'author_id': self.object.author_id,
-                             'author': self.object.author.first_name,
-                             'price': self.object.price,
-                             'description': self.object.description,
-                             'is_published': self.object.is_published,
-                             'category_id': self.object.category_id,
-                             "category_name": self.object.category.name,
-                             'image': self.object.image.url if self.object.image else None
-                             })
+        items, missing = AD_DETAIL_FIELDSET.batch(Advertisement.objects, ids, fields)
+        return JsonResponse({'items': items, 'missing': missing}, status=200)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAdsListView(View):
+    """Async-вариант AdsListView для ASGI: те же параметры и ответ, без кэша ответов"""
+
+    @tables_condition(Advertisement, User, parsers=AD_LIST_PARSERS)
+    async def get(self, request, *args, **kwargs):
+        try:
+            fields = AD_LIST_FIELDSET.parse(request.GET)
+            filters = parse_ad_filters(request.GET)
+            parse_page_params(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        ads = AD_LIST_FIELDSET.apply(Advertisement.objects, fields, AD_LIST_REQUIRED).filter(**filters)
+
+        if 'cursor' in request.GET:
+            page, next_cursor, prev_cursor = await apaginate_by_cursor(
+                ads, request.GET.get('cursor'), settings.TOTAL_ON_PAGE)
+            response = {"items": AdsListView._serialize(page, fields),
+                        "next": next_cursor,
+                        "prev": prev_cursor}
+            return JsonResponse(response, safe=False, status=200)
+
+        page, total, num_pages = await apaginate(ads.order_by('-price'), request.GET,
+                                                 settings.TOTAL_ON_PAGE, model=Advertisement, filters=filters)
+
+        response = {"items": AdsListView._serialize(page, fields),
+                    "total": total,
+                    "num_pages": num_pages}
+        return JsonResponse(response, safe=False, status=200)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAdEntityView(View):
+    """Async-вариант AdEntityView для ASGI"""
+
+    @AD_DETAIL_CONDITION
+    async def get(self, request, pk, *args, **kwargs):
+        try:
+            fields = AD_DETAIL_FIELDSET.parse(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        try:
+            ad = await AD_DETAIL_FIELDSET.apply(Advertisement.objects, fields, AD_DETAIL_REQUIRED).aget(pk=pk)
+        except Advertisement.DoesNotExist:
+            raise Http404('No advertisement found matching the query')
+
+        return JsonResponse(AdEntityView._serialize(ad, fields))
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -95,19 +296,90 @@ class AdCreateView(CreateView):
 
         ad.save()
 
-        response = {'id': ad.id,
-                    'name': ad.name,
-                    'author_id': ad.author.id,
-                    'author': ad.author.first_name,
-                    'price': ad.price,
-                    'description': ad.description,
-                    'is_published': ad.is_published,
-                    'category_id': ad.category_id,
-                    'image': ad.image.url if ad.image else None
-                    }
+        return JsonResponse(AD_DETAIL_FIELDSET.serialize_pk(Advertisement.objects, ad.pk), status=200)
 
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AdBulkCreateView(View):
+    """
+    Создание пачки объявлений: тело - JSON-массив объектов того же вида, что и для create/.
+    Авторы и категории загружаются одним запросом на каждую модель, вставка идёт
+    bulk_create пакетами в одной транзакции. В ответе - результат по каждому элементу
+    """
+
+    def post(self, request, *args, **kwargs):
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'error': 'invalid JSON'}, status=400)
+        if not isinstance(data, list):
+            return JsonResponse({'error': 'expected a JSON array'}, status=400)
+        if len(data) > settings.BULK_CREATE_MAX_ITEMS:
+            return JsonResponse({'error': f'at most {settings.BULK_CREATE_MAX_ITEMS} items allowed'}, status=400)
+
+        items = [item if isinstance(item, dict) else {} for item in data]
+        authors = get_user_model().objects.in_bulk({self._id(item, 'author_id') for item in items} - {None})
+        categories = Category.objects.in_bulk({self._id(item, 'category_id') for item in items} - {None})
+
+        results = [None] * len(data)
+        ads, positions = [], []
+        for index, item in enumerate(data):
+            if not isinstance(item, dict):
+                results[index] = {'index': index, 'errors': {'__all__': ['expected an object']}}
+                continue
+
+            errors = {}
+            author = authors.get(self._id(item, 'author_id'))
+            category = categories.get(self._id(item, 'category_id'))
+            if author is None:
+                errors['author_id'] = ['author not found']
+            if category is None:
+                errors['category_id'] = ['category not found']
+
+            ad = Advertisement(
+                name=item.get('name'),
+                author=author,
+                price=item.get('price'),
+                description=item.get('description'),
+                category=category,
+                # Как в create/: значение приводит BooleanField ("True", "1", "f" ...), но
+                # некорректное не роняет запрос, а попадает в ошибки элемента
+                is_published=item.get('is_published', False)
+            )
+            try:
+                # Связи уже проверены по загруженным словарям, поэтому исключаем их из проверки
+                ad.full_clean(exclude=['author', 'category', 'image'], validate_unique=False)
+            except ValidationError as error:
+                errors.update(error.message_dict)
+
+            if errors:
+                results[index] = {'index': index, 'errors': errors}
+            else:
+                ads.append(ad)
+                positions.append(index)
+
+        with transaction.atomic():
+            created = Advertisement.objects.bulk_create(ads, batch_size=settings.BULK_CREATE_BATCH_SIZE)
+
+        for index, ad in zip(positions, created):
+            results[index] = {'index': index, 'id': ad.id}
+
+        response = {'items': results,
+                    'created': len(created),
+                    'failed': len(data) - len(created)}
         return JsonResponse(response, status=200)
 
+    @staticmethod
+    def _id(item, key):
+        """Первичный ключ из item[key]; строки с числом приводятся, как при поиске по pk в create/"""
+        value = item.get(key)
+        if isinstance(value, bool):
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
 
 @method_decorator(csrf_exempt, name='dispatch')
 class AdUpdateView(UpdateView):
@@ -127,18 +399,7 @@ class AdUpdateView(UpdateView):
 
         self.object.save()
 
-        response = {'id': self.object.id,
-                    'name': self.object.name,
-                    'author_id': self.object.author.id,
-                    'author': self.object.author.first_name,
-                    'price': self.object.price,
-                    'description': self.object.description,
-                    'is_published': self.object.is_published,
-                    'category_id': self.object.category.id,
-                    "category_name": self.object.category.name,
-                    'image': self.object.image.url if self.object.image else None
-                    }
-        return JsonResponse(response, status=200)
+        return JsonResponse(AD_DETAIL_FIELDSET.serialize_pk(Advertisement.objects, self.object.pk), status=200)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -158,26 +419,34 @@ class AdImageUploadView(UpdateView):
     fields = ["name", "author", "price", "description", "category"]
 
     def patch(self, request, *args, **kwargs):
-        super().post(request, *args, **kwargs)
         self.object = self.get_object()
 
-        image = request.FILE['image']
-        self.object.image = image
-
-        #self.object.author = get_object_or_404(get_user_model(), pk=self.object.author.id)
-        #self.object.category = get_object_or_404(Category, pk=self.object.category.id)
-
-        self.object.save()
-
-        response = {'id': self.object.id,
-                    'name': self.object.name,
-                    'author_id': self.object.author.id,
-                    'author': self.object.author.first_name,
-                    'price': self.object.price,
-                    'description': self.object.description,
-                    'is_published': self.object.is_published,
-                    'category_id': self.object.category.id,
-                    "category_name": self.object.category.name,
-                    'aimage': self.object.image.url if self.object.image else None
-                    }
-        return JsonResponse(response, status=200)
+        # Слишком большой файл отбрасываем ещё при разборе тела запроса
+        size_limit = ImageSizeLimitHandler(request)
+        request.upload_handlers.insert(0, size_limit)
+        # Django разбирает multipart только для POST, тело PATCH разбираем сами
+        if request.method != 'POST' and request.content_type == 'multipart/form-data':
+            request._post, request._files = request.parse_file_upload(request.META, request)
+        image = request.FILES.get('image')
+        if size_limit.error:
+            return JsonResponse({'error': size_limit.error}, status=400)
+        if image is None:
+            return JsonResponse({'error': 'image is required'}, status=400)
+
+        try:
+            # Файл и объявление - в одной транзакции: ссылку, которую хранилище взяло на
+            # файл, сменяет ссылка объявления, и удалить файл между ними нельзя
+            with transaction.atomic():
+                self.object.image.save(image.name, image, save=False)
+                self.object.image_variants = {}
+                self.object.save()
+        except ValidationError as error:
+            return JsonResponse({'error': error.messages[0]}, status=400)
+
+        # Копии строятся в пуле процессов, а до их готовности API отдаёт оригинал.
+        # Старая картинка и её копии удаляются сигналом, когда на них не останется ссылок
+        schedule_variants(self.object)
+
+        return JsonResponse(AD_DETAIL_FIELDSET.serialize_pk(Advertisement.objects, self.object.pk), status=200)
+
+    post = patch
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
-from categories.models import Category
+from categories.models import Category, CategoryStats
 
 admin.site.register(Category)
+admin.site.register(CategoryStats)
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from ads.cache import invalidate
+from categories.stats import rebuild_category_stats
+
+
+class Command(BaseCommand):
+    help = 'Пересоздаёт статистику объявлений по категориям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        rows = rebuild_category_stats(using=options['database'])
+        invalidate('ads')
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано категорий: {rows}'))
@@ -0,0 +1,46 @@
+# Generated by Django 4.1.13 on 2026-10-18 18:22
+
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, Q, Sum
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def fill_stats(apps, schema_editor):
+    Advertisement = apps.get_model('advertisements', 'Advertisement')
+    CategoryStats = apps.get_model('categories', 'CategoryStats')
+    db = schema_editor.connection.alias
+
+    rows = (Advertisement.objects.using(db).exclude(category_id=None).order_by().values('category_id')
+            .annotate(ads_count=Count('id'), published_count=Count('id', filter=Q(is_published=True)),
+                      priced_count=Count('price'), price_sum=Coalesce(Sum('price'), 0),
+                      min_price=Min('price'), max_price=Max('price')))
+    CategoryStats.objects.using(db).bulk_create([CategoryStats(**row) for row in rows])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categories', '0001_initial'),
+        ('advertisements', '0007_stored_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryStats',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='categories.category')),
+                ('ads_count', models.PositiveIntegerField(default=0)),
+                ('published_count', models.PositiveIntegerField(default=0)),
+                ('priced_count', models.PositiveIntegerField(default=0)),
+                ('price_sum', models.BigIntegerField(default=0)),
+                ('min_price', models.IntegerField(null=True)),
+                ('max_price', models.IntegerField(null=True)),
+            ],
+            options={
+                'verbose_name': 'Статистика категории',
+                'verbose_name_plural': 'Статистика категорий',
+            },
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,13 @@
 from django.db import models
 
+from counters.models import CountedModelMixin
 
-class Category(models.Model):
+
+class Category(CountedModelMixin, models.Model):
     id = models.AutoField(editable=False, unique=True, primary_key=True, auto_created=True)
     name = models.CharField(max_length=50, null=True, blank=False)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -11,3 +15,29 @@ class Category(models.Model):
     class Meta:
         verbose_name = "Категория"
         verbose_name_plural = "Категории"
+
+
+class CategoryStats(models.Model):
+    """
+    Сводка по объявлениям категории. Обновляется при изменении объявлений
+    (см. categories/stats.py), пересоздаётся командой rebuild_category_stats
+    """
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    ads_count = models.PositiveIntegerField(default=0)
+    published_count = models.PositiveIntegerField(default=0)
+    # Объявления с указанной ценой и сумма их цен - для средней цены
+    priced_count = models.PositiveIntegerField(default=0)
+    price_sum = models.BigIntegerField(default=0)
+    min_price = models.IntegerField(null=True)
+    max_price = models.IntegerField(null=True)
+
+    @property
+    def avg_price(self):
+        return self.price_sum / self.priced_count if self.priced_count else None
+
+    def __str__(self):
+        return f'{self.category_id}: {self.ads_count}'
+
+    class Meta:
+        verbose_name = 'Статистика категории'
+        verbose_name_plural = 'Статистика категорий'
@@ -0,0 +1,19 @@
+from ads.fieldsets import Fieldset
+
+CATEGORY_FIELDSET = Fieldset({
+    'id': 'id',
+    'name': 'name',
+})
+
+# Колонки CategoryStats приходят через LEFT JOIN; у категории без строки сводки они NULL
+CATEGORY_STATS_FIELDSET = Fieldset({
+    'id': 'id',
+    'name': 'name',
+    'ads_count': (('stats__ads_count',), lambda row: row.stats__ads_count or 0),
+    'published_count': (('stats__published_count',), lambda row: row.stats__published_count or 0),
+    'min_price': 'stats__min_price',
+    'avg_price': (('stats__priced_count', 'stats__price_sum'),
+                  lambda row: round(row.stats__price_sum / row.stats__priced_count, 2)
+                  if row.stats__priced_count else None),
+    'max_price': 'stats__max_price',
+})
@@ -0,0 +1,116 @@
+"""
+Статистика объявлений по категориям (CategoryStats).
+
+Число объявлений, опубликованных, сумма цен и число объявлений с ценой
+меняются на разницу прямо в UPDATE. Минимум и максимум при добавлении
+сдвигаются через LEAST/GREATEST, а при удалении или изменении цены
+пересчитываются по индексу (category, -price, -id). Изменения приходят из
+сигналов объявлений и из AdvertisementQuerySet через apply_row_changes()
+в advertisements/author_counts.py. Строка статистики появляется с первым
+объявлением категории (вставка с ignore_conflicts), без удаления и пересоздания.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from categories.models import CategoryStats
+
+STATS_FIELDS = ['category_id', 'is_published', 'price']
+
+
+def apply_category_stats(removed, added, using='default'):
+    """Обновляет статистику по снимкам строк объявлений (словари со значениями STATS_FIELDS) до и после изменения"""
+    deltas = {}
+    lowest, highest = {}, {}
+    stale = set()
+    for rows, sign in ((removed, -1), (added, 1)):
+        for row in rows:
+            category_id, price = row['category_id'], row['price']
+            if category_id is None:
+                continue
+            delta = deltas.setdefault(category_id, Counter())
+            delta['ads_count'] += sign
+            delta['published_count'] += sign * bool(row['is_published'])
+            if price is None:
+                continue
+            delta['priced_count'] += sign
+            delta['price_sum'] += sign * price
+            if sign < 0:
+                stale.add(category_id)
+            else:
+                lowest[category_id] = min(price, lowest.get(category_id, price))
+                highest[category_id] = max(price, highest.get(category_id, price))
+
+    stats = CategoryStats.objects.using(using)
+    updates = {}
+    for category_id, delta in sorted(deltas.items()):
+        values = {field: F(field) + value for field, value in delta.items() if value}
+        if category_id in lowest and category_id not in stale:
+            # На SQLite LEAST/GREATEST с NULL дают NULL, поэтому Coalesce
+            values['min_price'] = Coalesce(Least('min_price', Value(lowest[category_id])), Value(lowest[category_id]))
+            values['max_price'] = Coalesce(Greatest('max_price', Value(highest[category_id])),
+                                           Value(highest[category_id]))
+        if values:
+            updates[category_id] = values
+
+    missing = [category_id for category_id, values in updates.items()
+               if not stats.filter(category_id=category_id).update(**values)]
+    if missing:
+        # Строки нет, пока в категории не было объявлений: заводим нулевую и применяем то же изменение.
+        # Нулевую строку могла уже завести параллельная транзакция, поэтому ignore_conflicts
+        stats.bulk_create([CategoryStats(category_id=category_id) for category_id in missing], ignore_conflicts=True)
+        for category_id in missing:
+            if any(value < 0 for value in deltas[category_id].values()):
+                # Удаление из категории без статистики: она разошлась с таблицей, считаем заново
+                _recompute_category_stats(category_id, using)
+                stale.discard(category_id)
+            else:
+                stats.filter(category_id=category_id).update(**updates[category_id])
+
+    for category_id in stale:
+        _refresh_price_range(category_id, using)
+
+
+def _refresh_price_range(category_id, using):
+    from advertisements.models import Advertisement
+
+    price_range = Advertisement.objects.using(using).filter(category_id=category_id).aggregate(
+        min_price=Min('price'), max_price=Max('price'))
+    CategoryStats.objects.using(using).filter(category_id=category_id).update(**price_range)
+
+
+def _stats_rows(ads):
+    return (ads.order_by().values('category_id')
+            .annotate(ads_count=Count('id'), published_count=Count('id', filter=Q(is_published=True)),
+                      priced_count=Count('price'), price_sum=Coalesce(Sum('price'), 0),
+                      min_price=Min('price'), max_price=Max('price')))
+
+
+def _recompute_category_stats(category_id, using):
+    from advertisements.models import Advertisement
+
+    row = _stats_rows(Advertisement.objects.using(using).filter(category_id=category_id)).first()
+    values = {field: row[field] for field in row if field != 'category_id'} if row else {
+        'ads_count': 0, 'published_count': 0, 'priced_count': 0, 'price_sum': 0, 'min_price': None, 'max_price': None}
+    CategoryStats.objects.using(using).filter(category_id=category_id).update(**values)
+
+
+def rebuild_category_stats(category_ids=None, using='default'):
+    """
+    Пересоздаёт статистику указанных категорий (или всех) по таблице объявлений. Возвращает число строк.
+    Удаляет и вставляет строки заново, поэтому для команд и загрузок, а не для обработки отдельных изменений
+    """
+    from advertisements.models import Advertisement
+
+    ads = Advertisement.objects.using(using).exclude(category_id=None)
+    stats = CategoryStats.objects.using(using)
+    if category_ids is not None:
+        ads = ads.filter(category_id__in=category_ids)
+        stats = stats.filter(category_id__in=category_ids)
+
+    rows = _stats_rows(ads)
+    with transaction.atomic(using=using, savepoint=False):
+        stats.delete()
+        return len(CategoryStats.objects.using(using).bulk_create([CategoryStats(**row) for row in rows]))
@@ -1,3 +1,82 @@
+from unittest import mock
+
+from django.db.models import QuerySet
 from django.test import TestCase
 
-# Create your tests here.
+from advertisements.models import Advertisement
+from categories.models import Category, CategoryStats
+from categories.stats import rebuild_category_stats
+from users.models import User
+
+STATS_COLUMNS = ('category_id', 'ads_count', 'published_count', 'priced_count', 'price_sum', 'min_price', 'max_price')
+
+
+class CategoryStatsTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author', first_name='Автор')
+        self.category = Category.objects.create(name='Категория')
+        self.other = Category.objects.create(name='Другая')
+
+    def create_ad(self, price, category=None, is_published=False):
+        return Advertisement.objects.create(name='Объявление', author=self.author, price=price,
+                                            category=category or self.category, is_published=is_published)
+
+    def stats(self):
+        return set(CategoryStats.objects.exclude(ads_count=0).values_list(*STATS_COLUMNS))
+
+    def assertStatsExact(self):
+        """Поддерживаемая статистика совпадает с пересчитанной по таблице объявлений"""
+        maintained = self.stats()
+        rebuild_category_stats()
+        self.assertEqual(maintained, self.stats())
+
+    def test_first_ad_creates_stats(self):
+        self.assertFalse(CategoryStats.objects.filter(category=self.category).exists())
+        self.create_ad(100, is_published=True)
+        self.create_ad(300)
+
+        stats = CategoryStats.objects.get(category=self.category)
+        self.assertEqual((stats.ads_count, stats.published_count, stats.min_price, stats.max_price), (2, 1, 100, 300))
+        self.assertEqual(stats.avg_price, 200)
+
+    def test_changes_do_not_drift(self):
+        ads = [self.create_ad(price) for price in (10, 20, 30, None)]
+        ads[0].price = 5
+        ads[0].save()
+        ads[1].category = self.other
+        ads[1].save()
+        ads[2].delete()
+        Advertisement.objects.filter(price=5).update(is_published=True, category=self.other)
+        Advertisement.objects.bulk_create([Advertisement(name='Пакет', author=self.author, price=7,
+                                                         category=self.category)])
+
+        self.assertStatsExact()
+
+    def test_concurrent_first_save(self):
+        # Параллельная транзакция завела строку статистики между нашими UPDATE и INSERT
+        update = QuerySet.update
+        calls = []
+
+        def stale_update(queryset, **kwargs):
+            calls.append(queryset.model)
+            if queryset.model is CategoryStats and calls.count(CategoryStats) == 1:
+                CategoryStats.objects.create(category=self.category, ads_count=1, priced_count=1,
+                                             price_sum=50, min_price=50, max_price=50)
+                return 0
+            return update(queryset, **kwargs)
+
+        Advertisement.objects.create(name='Другой запрос', author=self.author, price=50, category=self.other)
+        with mock.patch.object(QuerySet, 'update', stale_update):
+            self.create_ad(70)
+
+        stats = CategoryStats.objects.get(category=self.category)
+        self.assertEqual((stats.ads_count, stats.price_sum, stats.min_price, stats.max_price), (2, 120, 50, 70))
+
+    def test_missing_stats_are_recomputed_on_delete(self):
+        ads = [self.create_ad(price) for price in (10, 20)]
+        CategoryStats.objects.all().delete()
+
+        ads[0].delete()
+
+        self.assertEqual(CategoryStats.objects.filter(category=self.category).values_list(*STATS_COLUMNS).get(),
+                         (self.category.id, 1, 0, 1, 20, 20, 20))
@@ -1,10 +1,12 @@
 from django.urls import path
 
+from ads.routing import select_view
 from categories.views import *
 
 urlpatterns = [
-    path('', CategoryListView.as_view(), name='categories'),
-    path('<int:pk>/', CategoryEntityView.as_view(), name='category'),
+    path('', select_view('categories', CategoryListView, AsyncCategoryListView), name='categories'),
+    path('stats/', CategoryStatsView.as_view(), name='category stats'),
+    path('<int:pk>/', select_view('category', CategoryEntityView, AsyncCategoryEntityView), name='category'),
     path('create/', CategoryCreateView.as_view(), name='create category'),
     path('<int:pk>/update/', CategoryUpdateView.as_view(), name='update category'),
     path('<int:pk>/delete/', CategoryDeleteView.as_view(), name='delete category'),
@@ -1,37 +1,68 @@
 import json
 
 from django.core.exceptions import ValidationError
-from django.core.paginator import Paginator
-from django.http import JsonResponse
+from django.http import Http404
 from django.shortcuts import render
 from django.utils.decorators import method_decorator
+from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 
 from ads import settings
+from ads.cache import CachedResponseMixin
+from ads.conditional import row_condition, tables_condition
+from ads.serializers import JsonResponse
 from categories.models import Category
+from categories.serializers import CATEGORY_FIELDSET, CATEGORY_STATS_FIELDSET
+from counters.pagination import apaginate, paginate, parse_count_mode
+
+
+# ETag и Last-Modified (ads/conditional.py); параметры проверяются до ответа 304
+CATEGORY_LIST_CONDITION = tables_condition(Category, parsers=(CATEGORY_FIELDSET.parse, parse_count_mode))
+CATEGORY_DETAIL_CONDITION = row_condition(Category, parsers=(CATEGORY_FIELDSET.parse,))
 
 
 @method_decorator(csrf_exempt, name='dispatch')
-class CategoryListView(ListView):
+class CategoryListView(CachedResponseMixin, ListView):
     model = Category
+    cache_tags = ('categories',)
 
+    @CATEGORY_LIST_CONDITION
     def get(self, request, *args, **kwargs):
         super().get(request, *args, **kwargs)
 
-        self.object_list = self.object_list.order_by('name')
+        try:
+            fields = CATEGORY_FIELDSET.parse(request.GET)
+            parse_count_mode(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        self.object_list = CATEGORY_FIELDSET.apply(self.object_list, fields).order_by('name')
 
-        paginator = Paginator(self.object_list, settings.TOTAL_ON_PAGE)
-        page_num = request.GET.get('page')
-        page = paginator.get_page(page_num)
+        page, total, num_pages = paginate(self.object_list, request.GET, settings.TOTAL_ON_PAGE,
+                                          model=Category)
 
-        result = [{'id': cat.id, "name": cat.name} for cat in page]
+        result = CATEGORY_FIELDSET.serialize(page, fields)
         response = {"items": result,
-                    "total": paginator.count,
-                    "page_num": paginator.num_pages}
+                    "total": total,
+                    "page_num": num_pages}
         return JsonResponse(response, safe=False, status=200)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
+class CategoryStatsView(CachedResponseMixin, View):
+    """Сводка по объявлениям всех категорий из CategoryStats, без обхода таблицы объявлений"""
+    # Статистика меняется вместе с объявлениями
+    cache_tags = ('categories', 'ads')
+
+    def get(self, request, *args, **kwargs):
+        try:
+            fields = CATEGORY_STATS_FIELDSET.parse(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        categories = CATEGORY_STATS_FIELDSET.apply(Category.objects.order_by('name'), fields)
+        return JsonResponse({'items': CATEGORY_STATS_FIELDSET.serialize(categories, fields)}, safe=False, status=200)
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class CategoryCreateView(CreateView):
     model = Category
@@ -43,20 +74,61 @@ class CategoryCreateView(CreateView):
 
         category = Category.objects.create(name=data.get('name'))
 
-        return JsonResponse({'id': category.id,
-                             "name": category.name}, status=200)
+        return JsonResponse(CATEGORY_FIELDSET.serialize_pk(Category.objects, category.pk), status=200)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
 class CategoryEntityView(DetailView):
     model = Category
 
+    @CATEGORY_DETAIL_CONDITION
     def get(self, request, *args, **kwargs):
-        super().get(request, *args, **kwargs)
-        self.object = self.get_object()
+        try:
+            fields = CATEGORY_FIELDSET.parse(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        self.object = self.get_object(CATEGORY_FIELDSET.apply(self.get_queryset(), fields))
+
+        return JsonResponse(CATEGORY_FIELDSET.serialize([self.object], fields)[0])
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncCategoryListView(View):
+    """Async-вариант CategoryListView для ASGI, без кэша ответов"""
+
+    @CATEGORY_LIST_CONDITION
+    async def get(self, request, *args, **kwargs):
+        try:
+            fields = CATEGORY_FIELDSET.parse(request.GET)
+            parse_count_mode(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        categories = CATEGORY_FIELDSET.apply(Category.objects, fields).order_by('name')
+        page, total, num_pages = await apaginate(categories, request.GET, settings.TOTAL_ON_PAGE, model=Category)
+
+        result = CATEGORY_FIELDSET.serialize(page, fields)
+        response = {"items": result,
+                    "total": total,
+                    "page_num": num_pages}
+        return JsonResponse(response, safe=False, status=200)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncCategoryEntityView(View):
+    """Async-вариант CategoryEntityView для ASGI"""
+
+    @CATEGORY_DETAIL_CONDITION
+    async def get(self, request, pk, *args, **kwargs):
+        try:
+            fields = CATEGORY_FIELDSET.parse(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        try:
+            category = await CATEGORY_FIELDSET.apply(Category.objects, fields).aget(pk=pk)
+        except Category.DoesNotExist:
+            raise Http404('No category found matching the query')
 
-        return JsonResponse({'id': self.object.id,
-                             "name": self.object.name})
+        return JsonResponse(CATEGORY_FIELDSET.serialize([category], fields)[0])
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -71,8 +143,7 @@ class CategoryUpdateView(UpdateView):
         self.object.name = data.get('name')
         self.object.save()
 
-        return JsonResponse({'id': self.object.id,
-                             "name": self.object.name}, status=200)
+        return JsonResponse(CATEGORY_FIELDSET.serialize_pk(Category.objects, self.object.pk), status=200)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
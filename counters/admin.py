@@ -0,0 +1,5 @@
+from django.contrib import admin
+
+from counters.models import RowCounter
+
+admin.site.register(RowCounter)
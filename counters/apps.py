@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class CountersConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'counters'
+
+    def ready(self):
+        from counters.signals import connect_signals
+        connect_signals()
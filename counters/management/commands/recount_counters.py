@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from counters.services import recount
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики строк, используемые в пагинации'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        result = recount(using=options['database'])
+        for key, value in sorted(result.items()):
+            self.stdout.write(f'{key}: {value}')
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано счётчиков: {len(result)}'))
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.13 on 2026-10-18 18:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('counters', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rowcounter',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
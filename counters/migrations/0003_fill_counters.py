@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def fill_counters(apps, schema_editor):
+    # Счётчики больше не заводятся при первом чтении: adjust_many() считает,
+    # что нет счётчика - нет строк, поэтому для существующих строк считаем их здесь
+    from counters.services import recount
+    recount(using=schema_editor.connection.alias, registry=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('counters', '0002_timestamps'),
+        ('advertisements', '0008_timestamps'),
+        ('categories', '0003_timestamps'),
+        ('users', '0005_timestamps'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+from django.db import models, router, transaction
+
+
+class RowCounter(models.Model):
+    key = models.CharField(max_length=255, unique=True)
+    value = models.BigIntegerField(default=0)
+    # Время последнего изменения значения: после удаления строк max(updated) таблицы не меняется
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.key} = {self.value}'
+
+    class Meta:
+        verbose_name = 'Счётчик строк'
+        verbose_name_plural = 'Счётчики строк'
+
+
+class CountedModelMixin:
+    """
+    Сохраняет модель и обновляет её счётчики (сигналы post_save) в одной транзакции.
+    Удаление и так выполняется Django внутри транзакции вместе с post_delete
+    """
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
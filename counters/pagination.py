@@ -0,0 +1,88 @@
+from asgiref.sync import sync_to_async
+from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.utils.functional import cached_property
+
+from counters.services import aget_count, estimate_count, get_count
+
+COUNT_MODES = ('exact', 'estimate', 'none')
+
+
+class CountedPaginator(Paginator):
+    """Paginator, которому общее число строк передаётся снаружи вместо SELECT COUNT(*)"""
+
+    def __init__(self, object_list, per_page, total=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._total = total
+
+    @cached_property
+    def count(self):
+        if self._total is not None:
+            return self._total
+        return super().count
+
+
+def parse_count_mode(params):
+    """Режим подсчёта из ?count=. При неизвестном режиме бросает ValueError"""
+    mode = params.get('count') or 'exact'
+    if mode not in COUNT_MODES:
+        raise ValueError(f'count must be one of: {", ".join(COUNT_MODES)}')
+    return mode
+
+
+def _uncounted_offset(params, per_page):
+    try:
+        number = max(int(params.get('page') or 1), 1)
+    except ValueError:
+        number = 1
+    return (number - 1) * per_page
+
+
+def paginate(queryset, params, per_page, model=None, filters=None):
+    """
+    Страница выборки и её итоги с учётом ?count=:
+    exact (по умолчанию) - поддерживаемый счётчик, если он ведётся для filters, иначе COUNT(*);
+    estimate - оценка планировщика PostgreSQL; none - без подсчёта, total и num_pages будут None.
+    Возвращает (page, total, num_pages); при неизвестном режиме бросает ValueError
+    """
+    mode = parse_count_mode(params)
+
+    if mode == 'none':
+        offset = _uncounted_offset(params, per_page)
+        return list(queryset[offset:offset + per_page]), None, None
+
+    total = None
+    if mode == 'estimate':
+        total = estimate_count(queryset)
+    if total is None and model is not None:
+        total = get_count(model, using=queryset.db, **(filters or {}))
+
+    paginator = CountedPaginator(queryset, per_page, total=total)
+    page = paginator.get_page(params.get('page'))
+    return page, paginator.count, paginator.num_pages
+
+
+async def apaginate(queryset, params, per_page, model=None, filters=None):
+    """Асинхронный вариант paginate; номер страницы проверяется так же, как в Paginator.get_page"""
+    mode = parse_count_mode(params)
+
+    if mode == 'none':
+        offset = _uncounted_offset(params, per_page)
+        return [obj async for obj in queryset[offset:offset + per_page]], None, None
+
+    total = None
+    if mode == 'estimate':
+        total = await sync_to_async(estimate_count)(queryset)
+    if total is None and model is not None:
+        total = await aget_count(model, using=queryset.db, **(filters or {}))
+    if total is None:
+        total = await queryset.acount()
+
+    paginator = CountedPaginator(queryset, per_page, total=total)
+    try:
+        number = paginator.validate_number(params.get('page') or 1)
+    except PageNotAnInteger:
+        number = 1
+    except EmptyPage:
+        number = paginator.num_pages
+    offset = (number - 1) * per_page
+    return [obj async for obj in queryset[offset:offset + per_page]], total, paginator.num_pages
@@ -0,0 +1,152 @@
+import json
+
+from django.apps import apps
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from counters.models import RowCounter
+
+# Для каких моделей и наборов полей ведутся счётчики.
+# Пустой набор - общее число строк модели
+COUNTED_MODELS = {
+    'advertisements.advertisement': [(), ('category_id',), ('is_published',), ('category_id', 'is_published')],
+    'users.user': [()],
+    'categories.category': [()],
+}
+
+
+def counter_key(label, **filters):
+    if not filters:
+        return label
+    return label + '?' + '&'.join(f'{field}={filters[field]}' for field in sorted(filters))
+
+
+def row_keys(label, values):
+    """Ключи всех счётчиков, в которые попадает строка с такими значениями полей"""
+    # Атрибуты объекта могут быть присвоены как есть из JSON ("1", "t" ...), а в ключ
+    # идёт значение, которое окажется в базе, - как у recount()
+    opts = apps.get_model(label)._meta
+    values = {field: opts.get_field(field).to_python(values[field]) for field in tracked_fields(label)}
+    return {counter_key(label, **{field: values[field] for field in fields})
+            for fields in COUNTED_MODELS[label]}
+
+
+def instance_keys(instance, values=None):
+    """Ключи всех счётчиков, в которые попадает объект. values - значения полей вместо атрибутов"""
+    label = instance._meta.label_lower
+    if values is None:
+        values = {field: getattr(instance, field) for field in tracked_fields(label)}
+    return row_keys(label, values)
+
+
+def tracked_fields(label):
+    return sorted({field for fields in COUNTED_MODELS[label] for field in fields})
+
+
+def adjust(keys, delta, using='default'):
+    """Сдвигает значения счётчиков keys на delta"""
+    adjust_many(dict.fromkeys(keys, delta), using)
+
+
+def adjust_many(deltas, using='default'):
+    """
+    Сдвигает счётчики на разные величины: deltas - {ключ: изменение}.
+    Отсутствующий счётчик создаётся со значением изменения: счётчики всех
+    строк заводят миграция и recount(), так что нет счётчика - нет и строк
+    """
+    # Порядок ключей постоянный, чтобы параллельные транзакции блокировали строки в одном порядке
+    rows = [(key, delta) for key, delta in sorted(deltas.items()) if delta]
+    if not rows:
+        return
+    connection = connections[using]
+    now = timezone.now()
+    if connection.features.supports_update_conflicts_with_target:
+        quote = connection.ops.quote_name
+        table = quote(RowCounter._meta.db_table)
+        key, value, updated = (quote(RowCounter._meta.get_field(name).column) for name in ('key', 'value', 'updated'))
+        sql = (f'INSERT INTO {table} ({key}, {value}, {updated}) VALUES (%s, %s, %s) '
+               f'ON CONFLICT ({key}) DO UPDATE '
+               f'SET {value} = {table}.{value} + EXCLUDED.{value}, {updated} = EXCLUDED.{updated}')
+        updated_at = connection.ops.adapt_datetimefield_value(now)
+        with connection.cursor() as cursor:
+            cursor.executemany(sql, [(key, delta, updated_at) for key, delta in rows])
+        return
+
+    counters = RowCounter.objects.using(using)
+    for key, delta in rows:
+        if counters.filter(key=key).update(value=F('value') + delta, updated=now):
+            continue
+        try:
+            with transaction.atomic(using=using):
+                counters.create(key=key, value=delta)
+        except IntegrityError:
+            # Счётчик успела создать параллельная транзакция
+            counters.filter(key=key).update(value=F('value') + delta, updated=now)
+
+
+def _is_counted(model, filters):
+    label = model._meta.label_lower
+    return tuple(sorted(filters)) in {tuple(sorted(fields)) for fields in COUNTED_MODELS.get(label, [])}
+
+
+def get_count(model, using='default', **filters):
+    """
+    Значение счётчика для модели и фильтров по равенству.
+    Возвращает None, если для такого набора полей счётчик не ведётся
+    """
+    if not _is_counted(model, filters):
+        return None
+    values = (RowCounter.objects.using(using).filter(key=counter_key(model._meta.label_lower, **filters))
+              .values_list('value', flat=True)[:1])
+    # Нет счётчика - нет строк с такими значениями, см. adjust_many()
+    return values[0] if values else 0
+
+
+async def aget_count(model, using='default', **filters):
+    """Асинхронный вариант get_count"""
+    if not _is_counted(model, filters):
+        return None
+    value = await (RowCounter.objects.using(using).filter(key=counter_key(model._meta.label_lower, **filters))
+                   .values_list('value', flat=True).afirst())
+    return value if value is not None else 0
+
+
+def recount(using='default', registry=apps):
+    """
+    Пересчитывает все счётчики с нуля. Возвращает {ключ: значение}.
+    registry - реестр моделей; миграция передаёт исторические модели
+    """
+    result = {}
+    for label, field_sets in COUNTED_MODELS.items():
+        model = registry.get_model(label)
+        for fields in field_sets:
+            if fields:
+                rows = model._default_manager.using(using).values(*fields).annotate(total=Count('pk'))
+                for row in rows.order_by():
+                    total = row.pop('total')
+                    result[counter_key(label, **row)] = total
+            else:
+                result[label] = model._default_manager.using(using).count()
+
+    counter_model = registry.get_model('counters', 'RowCounter')
+    with transaction.atomic(using=using):
+        counter_model._default_manager.using(using).all().delete()
+        counter_model._default_manager.using(using).bulk_create(
+            [counter_model(key=key, value=value) for key, value in result.items()])
+    return result
+
+
+def estimate_count(queryset):
+    """Оценка числа строк по плану запроса PostgreSQL. На других СУБД - None"""
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
@@ -0,0 +1,42 @@
+from django.apps import apps
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from counters.services import COUNTED_MODELS, adjust, instance_keys, tracked_fields
+
+
+def remember_old_keys(sender, instance, raw, using, **kwargs):
+    if instance._state.adding or raw:
+        return
+    fields = tracked_fields(sender._meta.label_lower)
+    if not fields:
+        return
+    old = sender._default_manager.using(using).filter(pk=instance.pk).values(*fields).first()
+    if old is not None:
+        instance._counter_old_keys = instance_keys(instance, old)
+
+
+def update_counters_on_save(sender, instance, created, raw, using, **kwargs):
+    if raw:
+        return
+    if created:
+        adjust(instance_keys(instance), 1, using)
+        return
+
+    old_keys = instance.__dict__.pop('_counter_old_keys', None)
+    if old_keys is None:
+        return
+    new_keys = instance_keys(instance)
+    adjust(old_keys - new_keys, -1, using)
+    adjust(new_keys - old_keys, 1, using)
+
+
+def update_counters_on_delete(sender, instance, using, **kwargs):
+    adjust(instance_keys(instance), -1, using)
+
+
+def connect_signals():
+    for label in COUNTED_MODELS:
+        model = apps.get_model(label)
+        pre_save.connect(remember_old_keys, sender=model, dispatch_uid=f'counters_{label}_pre_save')
+        post_save.connect(update_counters_on_save, sender=model, dispatch_uid=f'counters_{label}_save')
+        post_delete.connect(update_counters_on_delete, sender=model, dispatch_uid=f'counters_{label}_delete')
@@ -0,0 +1,154 @@
+from unittest import mock
+
+from django.db import connection
+from django.http import QueryDict
+from django.test import TestCase
+
+from advertisements.models import Advertisement
+from categories.models import Category
+from counters import services
+from counters.models import RowCounter
+from counters.pagination import apaginate, paginate
+from counters.services import adjust_many, counter_key, estimate_count, get_count, recount
+from users.models import User
+
+AD = 'advertisements.advertisement'
+
+
+class RowCounterTest(TestCase):
+    def setUp(self):
+        self.author = User.objects.create(username='author', first_name='Автор')
+        self.categories = [Category.objects.create(name=f'Категория {i}') for i in range(2)]
+
+    def create_ads(self, count, category=None, **kwargs):
+        return [Advertisement.objects.create(name=f'Объявление {i}', author=self.author, price=i,
+                                             category=category or self.categories[0], **kwargs)
+                for i in range(count)]
+
+    def counters(self):
+        return dict(RowCounter.objects.exclude(value=0).values_list('key', 'value'))
+
+    def assertCountersExact(self):
+        """Поддерживаемые счётчики совпадают с пересчитанными с нуля"""
+        maintained = self.counters()
+        recount()
+        self.assertEqual(maintained, self.counters())
+
+    def test_counts_follow_save_and_delete(self):
+        ads = self.create_ads(3)
+        ads[0].category = self.categories[1]
+        ads[0].save()
+        ads[1].delete()
+
+        self.assertEqual(get_count(Advertisement), 2)
+        self.assertEqual(get_count(Advertisement, category_id=self.categories[1].id), 1)
+        self.assertCountersExact()
+
+    def test_queryset_update_and_delete_do_not_drift(self):
+        self.create_ads(4)
+        Advertisement.objects.filter(price__lt=2).update(category=self.categories[1], is_published=True)
+        Advertisement.objects.filter(price=3).delete()
+
+        self.assertEqual(get_count(Advertisement, category_id=self.categories[1].id, is_published=True), 2)
+        self.assertCountersExact()
+
+    def test_bulk_create_does_not_drift(self):
+        Advertisement.objects.bulk_create(
+            [Advertisement(name='Пакет', author=self.author, category=category, price=1)
+             for category in self.categories * 3])
+
+        self.assertEqual(get_count(Advertisement, category_id=self.categories[0].id), 3)
+        self.assertCountersExact()
+
+    def test_raw_field_values_do_not_drift(self):
+        # create/ передаёт is_published из JSON как есть: в ключ должно попасть значение из базы
+        for is_published in ('1', 't', 1):
+            response = self.client.post('/ad/create/', {
+                'name': 'Объявление', 'author_id': self.author.id, 'price': 10,
+                'category_id': self.categories[0].id, 'is_published': is_published,
+            }, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+        Advertisement.objects.earliest('id').delete()
+
+        self.assertEqual(get_count(Advertisement, is_published=True), 2)
+        self.assertCountersExact()
+        response = self.client.get('/ad/?is_published=true')
+        self.assertEqual((response.status_code, response.json()['total']), (200, 2))
+
+    def test_missing_counter_is_created_by_first_row(self):
+        # Строка, вставленная после того, как счётчик мог бы быть посчитан, не теряется
+        RowCounter.objects.filter(key__startswith=AD).delete()
+        self.create_ads(2, category=self.categories[1])
+
+        self.assertEqual(get_count(Advertisement, category_id=self.categories[1].id), 2)
+        self.assertCountersExact()
+
+    def test_get_count_does_not_write(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(get_count(Advertisement, category_id=self.categories[1].id), 0)
+        self.assertFalse(RowCounter.objects.filter(key__startswith=AD + '?').exists())
+
+    def test_uncounted_filters(self):
+        self.assertIsNone(get_count(Advertisement, price=1))
+
+    def test_adjust_many_without_upsert(self):
+        key = counter_key(AD, category_id=self.categories[0].id)
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False):
+            adjust_many({key: 2, AD: 0})
+            adjust_many({key: -1})
+
+        self.assertEqual(RowCounter.objects.get(key=key).value, 1)
+        self.assertFalse(RowCounter.objects.filter(key=AD).exclude(value=0).exists())
+
+
+class PaginateTest(TestCase):
+    def setUp(self):
+        author = User.objects.create(username='author', first_name='Автор')
+        self.category = Category.objects.create(name='Категория')
+        Advertisement.objects.bulk_create([Advertisement(name=f'Объявление {i}', author=author, price=i,
+                                                         category=self.category) for i in range(25)])
+        self.ads = Advertisement.objects.order_by('-price')
+
+    def paginate(self, query, **kwargs):
+        page, total, num_pages = paginate(self.ads, QueryDict(query), 10, model=Advertisement, **kwargs)
+        return [ad.price for ad in page], total, num_pages
+
+    def test_exact_count_comes_from_counter(self):
+        # Только страница: итог берётся из RowCounter вместо COUNT(*)
+        with self.assertNumQueries(2):
+            prices, total, num_pages = self.paginate('page=3')
+        self.assertEqual((prices, total, num_pages), ([4, 3, 2, 1, 0], 25, 3))
+
+    def test_uncounted_filters_fall_back_to_count(self):
+        ads = self.ads.filter(price__lt=5)
+        with self.assertNumQueries(2):
+            page, total, _ = paginate(ads, QueryDict(), 10, model=Advertisement, filters={'price__lt': 5})
+            self.assertEqual((len(page), total), (5, 5))
+
+    def test_none_skips_count(self):
+        with self.assertNumQueries(1):
+            prices, total, num_pages = self.paginate('count=none&page=3')
+        self.assertEqual((prices, total, num_pages), ([4, 3, 2, 1, 0], None, None))
+
+    def test_estimate(self):
+        # На SQLite оценки нет - используется счётчик
+        self.assertIsNone(estimate_count(self.ads))
+        self.assertEqual(self.paginate('count=estimate')[1], 25)
+
+        cursor = mock.MagicMock()
+        cursor.__enter__.return_value.fetchone.return_value = ('[{"Plan": {"Plan Rows": 40}}]',)
+        postgresql = mock.Mock(vendor='postgresql', cursor=mock.Mock(return_value=cursor))
+        with mock.patch.object(services, 'connections', {'default': postgresql}):
+            self.assertEqual(self.paginate('count=estimate')[1:], (40, 4))
+        sql = cursor.__enter__.return_value.execute.call_args[0][0]
+        self.assertTrue(sql.startswith('EXPLAIN (FORMAT JSON) SELECT'))
+        self.assertNotIn('ORDER BY', sql)
+
+    def test_invalid_mode(self):
+        with self.assertRaisesMessage(ValueError, 'count must be one of: exact, estimate, none'):
+            self.paginate('count=all')
+        self.assertEqual(self.client.get('/ad/?count=all').status_code, 400)
+
+    async def test_async(self):
+        page, total, num_pages = await apaginate(self.ads, QueryDict('page=9'), 10, model=Advertisement)
+        self.assertEqual(([ad.price for ad in page], total, num_pages), ([4, 3, 2, 1, 0], 25, 3))
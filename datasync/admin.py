@@ -0,0 +1,5 @@
+from django.contrib import admin
+
+from datasync.models import SyncedRecord
+
+admin.site.register(SyncedRecord)
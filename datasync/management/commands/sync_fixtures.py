@@ -0,0 +1,38 @@
+import glob
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ads import settings
+from datasync.sync import sync_fixtures
+
+
+class Command(BaseCommand):
+    help = ('Инкрементально синхронизирует таблицы с JSON-фикстурами: '
+            'изменяются только новые, изменённые и удалённые записи')
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*',
+                            help='файлы фикстур (по умолчанию - все *.json из папки fixtures)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='только показать, что изменится')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or sorted(glob.glob(os.path.join(settings.BASE_DIR, 'fixtures', '*.json')))
+        start = time.perf_counter()
+        try:
+            result, read_stats = sync_fixtures(paths, options['batch_size'], options['dry_run'],
+                                               options['database'])
+        except ValueError as error:
+            raise CommandError(str(error))
+
+        for label, stats in result.items():
+            self.stdout.write(f"{label}: +{stats['inserted']} ~{stats['updated']} "
+                              f"-{stats['deleted']} ={stats['unchanged']}")
+        if read_stats['duplicates'] or read_stats['skipped']:
+            self.stdout.write(f"Повторов в фикстурах: {read_stats['duplicates']}, "
+                              f"записей без модели: {read_stats['skipped']}")
+        prefix = 'Проверка' if options['dry_run'] else 'Синхронизация'
+        self.stdout.write(self.style.SUCCESS(f'{prefix} завершена за {time.perf_counter() - start:.3f} с'))
@@ -0,0 +1,31 @@
+# Generated by Django 4.1.13 on 2026-10-18 18:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncedRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100)),
+                ('object_pk', models.CharField(max_length=64)),
+                ('digest', models.CharField(max_length=64)),
+            ],
+            options={
+                'verbose_name': 'Синхронизированная запись',
+                'verbose_name_plural': 'Синхронизированные записи',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='syncedrecord',
+            constraint=models.UniqueConstraint(fields=('model', 'object_pk'), name='synced_record_model_pk_unique'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import models
+
+
+class SyncedRecord(models.Model):
+    model = models.CharField(max_length=100)
+    object_pk = models.CharField(max_length=64)
+    digest = models.CharField(max_length=64)
+
+    def __str__(self):
+        return f'{self.model}:{self.object_pk}'
+
+    class Meta:
+        verbose_name = 'Синхронизированная запись'
+        verbose_name_plural = 'Синхронизированные записи'
+        constraints = [
+            models.UniqueConstraint(fields=['model', 'object_pk'], name='synced_record_model_pk_unique'),
+        ]
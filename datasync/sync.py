@@ -0,0 +1,224 @@
+"""
+Инкрементальная синхронизация таблиц с JSON-фикстурами из fixtures/.
+
+Для каждой записи фикстуры считается sha256 от её полей и сравнивается с
+хэшем, сохранённым в SyncedRecord при прошлой синхронизации. В базу пакетами
+уходят только новые, изменённые и исчезнувшие из фикстур записи.
+"""
+import hashlib
+import json
+from collections import Counter
+
+from django.apps import apps
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.color import no_style
+from django.db import connections, transaction
+from django.db.models import BooleanField, Q
+from django.utils import timezone
+
+from ads.cache import invalidate, invalidate_objects
+from categories.stats import rebuild_category_stats
+from counters.services import COUNTED_MODELS, adjust_many, instance_keys
+from datasync.models import SyncedRecord
+from users.geo import update_location_cells
+
+THROUGH_LABEL = 'users.user.location'
+
+# Порядок обработки соответствует зависимостям внешних ключей
+SYNC_ORDER = ['categories.category', 'users.location', 'users.user', THROUGH_LABEL,
+              'advertisements.advertisement']
+
+
+def resolve_model(label):
+    if label == THROUGH_LABEL:
+        return apps.get_model('users', 'User').location.through
+    return apps.get_model(label)
+
+
+def record_digest(fields):
+    return hashlib.sha256(json.dumps(fields, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+
+def read_fixtures(paths):
+    """
+    Собирает записи всех фикстур: {label: {pk: (digest, fields)}}.
+    Одинаковые записи из разных файлов учитываются один раз; записи без модели
+    (как в locs.json, копии locations.json) пропускаются
+    """
+    records = {}
+    stats = Counter()
+    for path in paths:
+        with open(path, encoding='utf-8') as fixture:
+            for record in json.load(fixture):
+                label = record.get('model')
+                if not label:
+                    stats['skipped'] += 1
+                    continue
+                if label not in SYNC_ORDER:
+                    raise ValueError(f'{path}: неизвестная модель {label}')
+
+                fields = {name.strip(): value for name, value in record['fields'].items() if name.strip()}
+                if label == THROUGH_LABEL:
+                    # Pk связи в фикстуре - это id пользователя, строку определяет сама пара
+                    pk = f"{int(fields['user_id'])}-{int(fields['location_id'])}"
+                else:
+                    pk = str(record['pk'])
+                digest = record_digest(fields)
+                known = records.setdefault(label, {}).get(pk)
+                if known is not None:
+                    if known[0] != digest:
+                        raise ValueError(f'{path}: запись {label}:{pk} расходится с другой фикстурой')
+                    stats['duplicates'] += 1
+                    continue
+                records[label][pk] = (digest, fields)
+    return records, stats
+
+
+def build_values(model, fields):
+    """Значения полей модели из фикстуры; поля, которых у модели нет, и many-to-many пропускаются"""
+    values = {}
+    for name, value in fields.items():
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            continue
+        if field.many_to_many or not field.concrete or field.primary_key:
+            continue
+        if field.is_relation:
+            value = field.target_field.to_python(value) if value not in (None, '') else None
+        elif isinstance(field, BooleanField) and isinstance(value, str):
+            # В фикстурах из csv встречаются 'true'/'false' в нижнем регистре
+            value = value.strip().lower() in ('true', 't', '1')
+        else:
+            value = field.to_python(value)
+        values[field.attname] = value
+    return values
+
+
+def _batches(items, size):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def sync_model(label, incoming, batch_size=1000, dry_run=False, using='default'):
+    model = resolve_model(label)
+    to_pk = model._meta.pk.to_python
+
+    stored = dict(SyncedRecord.objects.using(using).filter(model=label).values_list('object_pk', 'digest'))
+    new = [pk for pk in incoming if pk not in stored]
+    changed = [pk for pk in incoming if pk in stored and stored[pk] != incoming[pk][0]]
+    removed = [pk for pk in stored if pk not in incoming]
+
+    # Строки, загруженные раньше без синхронизации (loaddata, load_datasets), обновляем, а не вставляем
+    existing = set()
+    for batch in _batches(new, batch_size):
+        existing.update(str(pk) for pk in model._base_manager.using(using)
+                        .filter(pk__in=[to_pk(pk) for pk in batch]).values_list('pk', flat=True))
+    inserted = [pk for pk in new if pk not in existing]
+    updated = changed + [pk for pk in new if pk in existing]
+
+    stats = {'inserted': len(inserted), 'updated': len(updated), 'deleted': len(removed),
+             'unchanged': len(incoming) - len(new) - len(changed)}
+    if dry_run:
+        return stats
+
+    manager = model._default_manager.db_manager(using)
+    objects = [model(pk=to_pk(pk), **build_values(model, incoming[pk][1])) for pk in inserted]
+    manager.bulk_create(objects, batch_size=batch_size)
+    if label in COUNTED_MODELS and model._meta.label_lower != 'advertisements.advertisement':
+        # bulk_create объявлений сам поддерживает счётчики, для остальных моделей - здесь
+        adjust_many(Counter(key for obj in objects for key in instance_keys(obj)), using)
+
+    changed_values = {pk: build_values(model, incoming[pk][1]) for pk in updated}
+    # bulk_update не вызывает pre_save, поэтому поля auto_now заполняем сами
+    now = timezone.now()
+    auto_now = {field.attname: now for field in model._meta.concrete_fields if getattr(field, 'auto_now', False)}
+    for values in changed_values.values():
+        values.update(auto_now)
+    update_fields = sorted(set().union(*changed_values.values()))
+    if update_fields:
+        manager.bulk_update([model(pk=to_pk(pk), **values) for pk, values in changed_values.items()],
+                            update_fields, batch_size=batch_size)
+        if label == 'advertisements.advertisement':
+            # bulk_update обходит сигналы, статистику категорий собираем заново
+            rebuild_category_stats(using=using)
+
+    for batch in _batches(removed, batch_size):
+        manager.filter(pk__in=[to_pk(pk) for pk in batch]).delete()
+
+    records = SyncedRecord.objects.using(using)
+    for batch in _batches(removed + updated, batch_size):
+        records.filter(model=label, object_pk__in=batch).delete()
+    records.bulk_create([SyncedRecord(model=label, object_pk=pk, digest=incoming[pk][0])
+                         for pk in inserted + updated], batch_size=batch_size)
+
+    if inserted:
+        with connections[using].cursor() as cursor:
+            for sql in connections[using].ops.sequence_reset_sql(no_style(), [model]):
+                cursor.execute(sql)
+
+    if label == 'users.location' and inserted + updated:
+        # Ячейка сетки вычисляется в Location.save(), который bulk-операции не вызывают
+        for batch in _batches(inserted + updated, batch_size):
+            update_location_cells(model._base_manager.using(using).filter(pk__in=[to_pk(pk) for pk in batch]))
+
+    touched = inserted + updated + removed
+    if touched:
+        invalidate_objects(label, touched)
+    return stats
+
+
+def sync_user_locations(incoming, batch_size=1000, dry_run=False, using='default'):
+    """Синхронизация связей пользователь-локация: ключ записи - пара (user_id, location_id)"""
+    through = resolve_model(THROUGH_LABEL)
+    pair = lambda key: tuple(int(part) for part in key.split('-'))
+
+    stored = set(SyncedRecord.objects.using(using).filter(model=THROUGH_LABEL).values_list('object_pk', flat=True))
+    new = [key for key in incoming if key not in stored]
+    removed = [key for key in stored if key not in incoming]
+
+    existing = set()
+    for batch in _batches(new, batch_size):
+        pairs = [pair(key) for key in batch]
+        rows = through.objects.using(using).filter(user_id__in={user for user, _ in pairs},
+                                                  location_id__in={location for _, location in pairs})
+        existing.update(f'{user}-{location}' for user, location in rows.values_list('user_id', 'location_id'))
+    inserted = [key for key in new if key not in existing]
+
+    stats = {'inserted': len(inserted), 'updated': 0, 'deleted': len(removed),
+             'unchanged': len(incoming) - len(new)}
+    if dry_run:
+        return stats
+
+    through.objects.using(using).bulk_create(
+        [through(user_id=user, location_id=location) for user, location in map(pair, inserted)],
+        batch_size=batch_size, ignore_conflicts=True)
+    for batch in _batches(removed, batch_size):
+        condition = Q()
+        for user, location in map(pair, batch):
+            condition |= Q(user_id=user, location_id=location)
+        through.objects.using(using).filter(condition).delete()
+
+    records = SyncedRecord.objects.using(using)
+    for batch in _batches(removed, batch_size):
+        records.filter(model=THROUGH_LABEL, object_pk__in=batch).delete()
+    records.bulk_create([SyncedRecord(model=THROUGH_LABEL, object_pk=key, digest=incoming[key][0])
+                         for key in new], batch_size=batch_size)
+
+    if inserted or removed:
+        invalidate('users')
+    return stats
+
+
+def sync_fixtures(paths, batch_size=1000, dry_run=False, using='default'):
+    """Синхронизирует все модели из фикстур. Возвращает ({label: статистика}, статистика чтения)"""
+    records, read_stats = read_fixtures(paths)
+    result = {}
+    with transaction.atomic(using=using):
+        for label in SYNC_ORDER:
+            if label == THROUGH_LABEL and label in records:
+                result[label] = sync_user_locations(records[label], batch_size, dry_run, using)
+            elif label in records:
+                result[label] = sync_model(label, records[label], batch_size, dry_run, using)
+    return result, read_stats
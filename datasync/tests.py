@@ -0,0 +1,144 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import TestCase
+
+from advertisements.models import Advertisement
+from categories.models import CategoryStats
+from categories.stats import rebuild_category_stats
+from counters.models import RowCounter
+from counters.services import recount
+from datasync.models import SyncedRecord
+from datasync.sync import read_fixtures, sync_fixtures
+from users.geo import cell_id
+from users.models import Location, User
+
+AD = 'advertisements.advertisement'
+
+
+def category(pk, name):
+    return {'pk': pk, 'model': 'categories.category', 'fields': {'id': pk, 'name': name}}
+
+
+def location(pk, name, lat, lng):
+    return {'pk': pk, 'model': 'users.location', 'fields': {'id': pk, 'name': name, 'lat': lat, 'lng': lng}}
+
+
+def user(pk, username, **fields):
+    return {'pk': pk, 'model': 'users.user',
+            'fields': {'id': pk, 'username': username, 'first_name': 'Имя', 'role': 'member', 'age': 30,
+                       ' is_superuser': 'false', **fields}}
+
+
+def link(user_id, location_id):
+    return {'pk': user_id, 'model': 'users.user.location', 'fields': {'user_id': user_id, 'location_id': location_id}}
+
+
+def ad(pk, price, author_id=1, category_id=1, **fields):
+    return {'pk': pk, 'model': AD,
+            'fields': {'id': pk, 'name': f'Объявление {pk}', 'author_id': str(author_id), 'price': str(price),
+                       'description': '', 'is_published': 'False', 'category_id': str(category_id), **fields}}
+
+
+class FixtureSyncTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.fixtures = {
+            'category.json': [category(1, 'Котики'), category(2, 'Книги')],
+            'location.json': [location(1, 'Москва', 55.738472, 37.548188), location(2, 'Питер', 59.93, 30.31)],
+            'user.json': [user(1, 'first'), user(2, 'second')],
+            'locations.json': [link(1, 1), link(2, 2)],
+            'ad.json': [ad(1, 100), ad(2, 200, author_id=2), ad(3, 300, category_id=2, is_published='true')],
+        }
+
+    def write(self):
+        paths = []
+        for name, records in self.fixtures.items():
+            path = os.path.join(self.directory, name)
+            with open(path, 'w', encoding='utf-8') as fixture:
+                json.dump(records, fixture, ensure_ascii=False)
+            paths.append(path)
+        return paths
+
+    def sync(self, **kwargs):
+        """Статистика синхронизации только по моделям, где что-то изменилось"""
+        result, _ = sync_fixtures(self.write(), **kwargs)
+        return {label: stats for label, stats in result.items()
+                if stats['inserted'] or stats['updated'] or stats['deleted']}
+
+    def assertDenormalizedExact(self):
+        counters = dict(RowCounter.objects.exclude(value=0).values_list('key', 'value'))
+        stats = set(CategoryStats.objects.exclude(ads_count=0).values_list('category_id', 'ads_count', 'price_sum'))
+        recount()
+        rebuild_category_stats()
+        self.assertEqual(counters, dict(RowCounter.objects.exclude(value=0).values_list('key', 'value')))
+        self.assertEqual(stats, set(CategoryStats.objects.exclude(ads_count=0)
+                                    .values_list('category_id', 'ads_count', 'price_sum')))
+
+    def test_first_sync_loads_everything(self):
+        changes = self.sync()
+
+        self.assertEqual({label: stats['inserted'] for label, stats in changes.items()},
+                         {'categories.category': 2, 'users.location': 2, 'users.user': 2,
+                          'users.user.location': 2, AD: 3})
+        self.assertEqual(Advertisement.objects.get(pk=3).is_published, True)
+        self.assertEqual(list(User.objects.get(pk=2).location.values_list('id', flat=True)), [2])
+        self.assertEqual(Location.objects.get(pk=1).cell, cell_id(55.738472, 37.548188))
+        self.assertEqual(User.objects.get(pk=1).ads_count, 2)
+        self.assertDenormalizedExact()
+
+    def test_unchanged_fixtures_write_nothing(self):
+        self.sync()
+
+        # Только чтение хэшей по каждой модели, без записи
+        with self.assertNumQueries(7):
+            self.assertEqual(self.sync(), {})
+
+    def test_only_differences_are_applied(self):
+        self.sync()
+        self.fixtures['ad.json'] = [ad(1, 150), ad(2, 200, author_id=2), ad(4, 400, author_id=2, category_id=2)]
+        self.fixtures['locations.json'] = [link(1, 1), link(1, 2)]
+        self.fixtures['location.json'][1] = location(2, 'Питер', 59.95, 30.32)
+
+        changes = self.sync()
+
+        self.assertEqual({label: (stats['inserted'], stats['updated'], stats['deleted'])
+                          for label, stats in changes.items()},
+                         {'users.location': (0, 1, 0), 'users.user.location': (1, 0, 1), AD: (1, 1, 1)})
+        self.assertEqual(dict(Advertisement.objects.values_list('id', 'price')), {1: 150, 2: 200, 4: 400})
+        self.assertEqual(Location.objects.get(pk=2).cell, cell_id(59.95, 30.32))
+        self.assertEqual(sorted(User.objects.get(pk=1).location.values_list('id', flat=True)), [1, 2])
+        self.assertFalse(User.objects.get(pk=2).location.exists())
+        self.assertEqual(SyncedRecord.objects.filter(model=AD).count(), 3)
+        self.assertDenormalizedExact()
+
+    def test_dry_run_reports_without_writing(self):
+        self.sync()
+        self.fixtures['ad.json'] = [ad(1, 150)]
+
+        changes = self.sync(dry_run=True)
+
+        self.assertEqual(changes, {AD: {'inserted': 0, 'updated': 1, 'deleted': 2, 'unchanged': 0}})
+        self.assertEqual(Advertisement.objects.count(), 3)
+
+    def test_rows_loaded_without_sync_are_updated(self):
+        self.sync()
+        SyncedRecord.objects.filter(model=AD).delete()
+        self.fixtures['ad.json'][0] = ad(1, 150)
+
+        changes = self.sync()
+
+        self.assertEqual((changes[AD]['inserted'], changes[AD]['updated']), (0, 3))
+        self.assertEqual(Advertisement.objects.get(pk=1).price, 150)
+
+    def test_duplicate_records(self):
+        self.fixtures['copy.json'] = [category(1, 'Котики'), {'pk': 1, 'model': None, 'fields': {}}]
+        _, stats = read_fixtures(self.write())
+        self.assertEqual((stats['duplicates'], stats['skipped']), (1, 1))
+
+        self.fixtures['copy.json'] = [category(1, 'Собаки')]
+        with self.assertRaisesMessage(ValueError, 'расходится с другой фикстурой'):
+            read_fixtures(self.write())
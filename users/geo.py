@@ -0,0 +1,166 @@
+"""
+Поиск локаций в радиусе без PostGIS.
+
+Поверхность делится на сетку ячеек GEO_CELL_SIZE x GEO_CELL_SIZE градусов, номер
+ячейки хранится в индексированной колонке Location.cell. Запрос сначала отбирает
+локации из ячеек, покрывающих описанный вокруг круга прямоугольник (и по самому
+прямоугольнику), а затем точное расстояние по формуле гаверсинусов считается
+только для них - в самом SQL, поэтому выборку можно подставить подзапросом.
+"""
+import math
+
+from django.db.models import FloatField, Min, Q, Value
+from django.db.models.functions import ASin, Cast, Cos, Least, Power, Radians, Sin, Sqrt
+
+from ads import settings
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def _grid_columns():
+    return math.ceil(360 / settings.GEO_CELL_SIZE)
+
+
+def _row(lat):
+    return min(int((lat + 90) // settings.GEO_CELL_SIZE), math.ceil(180 / settings.GEO_CELL_SIZE) - 1)
+
+
+def _column(lng):
+    return min(int((lng + 180) // settings.GEO_CELL_SIZE), _grid_columns() - 1)
+
+
+def cell_id(lat, lng):
+    """Номер ячейки сетки для точки; None, если координат нет"""
+    if lat is None or lng is None:
+        return None
+    return _row(float(lat)) * _grid_columns() + _column(float(lng))
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat, lng, radius_km):
+    """
+    Прямоугольник (min_lat, max_lat, min_lng, max_lng), содержащий круг.
+    Если круг захватывает полюс или 180-й меридиан, долгота не ограничивается
+    """
+    delta_lat = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = lat - delta_lat, lat + delta_lat
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90), min(max_lat, 90), -180, 180
+
+    delta_lng = math.degrees(math.asin(min(1.0, math.sin(math.radians(delta_lat)) / math.cos(math.radians(lat)))))
+    min_lng, max_lng = lng - delta_lng, lng + delta_lng
+    if min_lng < -180 or max_lng > 180:
+        return min_lat, max_lat, -180, 180
+    return min_lat, max_lat, min_lng, max_lng
+
+
+def box_cells(box):
+    """Номера ячеек, покрывающих прямоугольник, или None, если их больше GEO_MAX_CELLS"""
+    min_lat, max_lat, min_lng, max_lng = box
+    rows = range(_row(min_lat), _row(max_lat) + 1)
+    columns = range(_column(min_lng), _column(max_lng) + 1)
+    if len(rows) * len(columns) > settings.GEO_MAX_CELLS:
+        return None
+    width = _grid_columns()
+    return [row * width + column for row in rows for column in columns]
+
+
+def _float_param(params, name, low, high):
+    value = params.get(name)
+    if value in (None, ''):
+        raise ValueError(f'{name} is required')
+    try:
+        value = float(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a number')
+    if not low <= value <= high or math.isnan(value):
+        raise ValueError(f'{name} must be between {low} and {high}')
+    return value
+
+
+def parse_point(params):
+    """
+    Разбирает ?lat=, ?lng= и ?radius_km= из query string.
+    Возвращает (lat, lng, radius_km); при некорректном значении бросает ValueError
+    """
+    lat = _float_param(params, 'lat', -90, 90)
+    lng = _float_param(params, 'lng', -180, 180)
+    radius_km = _float_param(params, 'radius_km', 0, settings.GEO_MAX_RADIUS_KM)
+    return lat, lng, radius_km
+
+
+def _within_box(lat, lng, radius_km, prefix=''):
+    """Условие на локации по пути prefix (например, 'location__'): прямоугольник вокруг круга и его ячейки"""
+    box = bounding_box(lat, lng, radius_km)
+    min_lat, max_lat, min_lng, max_lng = box
+    condition = Q(**{f'{prefix}lat__gte': min_lat, f'{prefix}lat__lte': max_lat})
+    if (min_lng, max_lng) != (-180, 180):
+        condition &= Q(**{f'{prefix}lng__gte': min_lng, f'{prefix}lng__lte': max_lng})
+    cells = box_cells(box)
+    if cells is not None:
+        # Отбор по индексу ячеек; условия по координатам отсекают края крайних ячеек
+        condition &= Q(**{f'{prefix}cell__in': cells})
+    return condition
+
+
+def distance_km(lat, lng, prefix=''):
+    """Выражение: расстояние в км от точки до локации по пути prefix, та же формула, что в haversine_km"""
+    location_lat = Radians(Cast(f'{prefix}lat', FloatField()))
+    location_lng = Radians(Cast(f'{prefix}lng', FloatField()))
+    a = (Power(Sin((location_lat - Value(math.radians(lat))) / 2), 2)
+         + Value(math.cos(math.radians(lat))) * Cos(location_lat)
+         * Power(Sin((location_lng - Value(math.radians(lng))) / 2), 2))
+    return Value(2 * EARTH_RADIUS_KM) * ASin(Least(Sqrt(a), Value(1.0)))
+
+
+def locations_within(lat, lng, radius_km, using=None):
+    """{id локации: расстояние в км} для локаций не дальше radius_km от точки"""
+    from users.models import Location
+
+    locations = (Location.objects.using(using).filter(_within_box(lat, lng, radius_km))
+                 .annotate(distance_km=distance_km(lat, lng)).filter(distance_km__lte=radius_km))
+    return dict(locations.values_list('id', 'distance_km').iterator())
+
+
+def update_location_cells(queryset, batch_size=1000):
+    """Пересчитывает Location.cell для выборки, например после загрузки в обход save(). Возвращает число изменённых"""
+    changed = []
+    for location in queryset.only('id', 'lat', 'lng', 'cell').iterator():
+        cell = cell_id(location.lat, location.lng)
+        if cell != location.cell:
+            location.cell = cell
+            changed.append(location)
+    queryset.model._base_manager.db_manager(queryset.db).bulk_update(changed, ['cell'], batch_size=batch_size)
+    return len(changed)
+
+
+def nearest_users(lat, lng, radius_km, using=None):
+    """
+    Пользователи, у которых есть локация не дальше radius_km от точки: выборка словарей
+    {'user_id', 'distance_km'} с расстоянием до ближайшей локации. Считается одним
+    запросом по таблице связей, поэтому годится как подзапрос: .values('user_id')
+    """
+    from users.models import User
+
+    return (User.location.through.objects.using(using)
+            .filter(_within_box(lat, lng, radius_km, 'location__'))
+            .values('user_id')
+            .annotate(distance_km=Min(distance_km(lat, lng, 'location__')))
+            .filter(distance_km__lte=radius_km))
+
+
+def users_within(lat, lng, radius_km, using=None):
+    """
+    Пользователи, у которых есть локация не дальше radius_km от точки: выборка
+    (id пользователя, расстояние до ближайшей его локации), от ближних к дальним.
+    Paginator считает и режет её в SQL
+    """
+    users = nearest_users(lat, lng, radius_km, using).order_by('distance_km', 'user_id')
+    return users.values_list('user_id', 'distance_km')
@@ -0,0 +1,37 @@
+from ads.cache import invalidate
+from users.models import Location, User
+
+
+def get_or_create_locations(names):
+    """
+    Возвращает {название: id} для всех названий, создавая недостающие локации.
+    Один запрос на поиск существующих и один bulk_create для новых; уникальность
+    Location.name делает параллельные вставки одного названия безопасными
+    """
+    names = list(dict.fromkeys(name for name in names if name))
+    if not names:
+        return {}
+
+    ids = dict(Location.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = [name for name in names if name not in ids]
+    if missing:
+        Location.objects.bulk_create([Location(name=name) for name in missing], ignore_conflicts=True)
+        # ignore_conflicts не возвращает id, а часть строк могла вставить параллельная транзакция
+        ids.update(Location.objects.filter(name__in=missing).values_list('name', 'id'))
+        invalidate('locations')
+    return {name: ids[name] for name in names}
+
+
+def add_user_locations(user, names):
+    """Привязывает к пользователю локации по названиям одной вставкой в промежуточную таблицу"""
+    location_ids = get_or_create_locations(names)
+    if not location_ids:
+        return location_ids
+
+    through = User.location.through
+    through.objects.bulk_create(
+        [through(user_id=user.pk, location_id=location_id) for location_id in location_ids.values()],
+        ignore_conflicts=True)
+    # bulk_create не отправляет m2m_changed
+    invalidate('users', f'user:{user.pk}')
+    return location_ids
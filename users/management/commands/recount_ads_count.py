@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from advertisements.author_counts import find_ads_count_mismatches, recount_ads_count
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает User.ads_count или, с --verify, только сообщает о расхождениях'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Только проверить, ничего не меняя')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        mismatches = find_ads_count_mismatches(using=options['database'])
+        for user_id, username, stored, actual in mismatches:
+            self.stdout.write(f'{user_id} {username}: ads_count={stored}, объявлений={actual}')
+
+        if options['verify']:
+            if mismatches:
+                raise CommandError(f'Расхождений: {len(mismatches)}')
+            self.stdout.write(self.style.SUCCESS('Расхождений нет'))
+            return
+
+        updated = recount_ads_count(using=options['database'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано пользователей: {updated}'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from users.geo import update_location_cells
+from users.models import Location
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает ячейки сетки локаций, например после смены GEO_CELL_SIZE'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        updated = update_location_cells(Location.objects.using(options['database']))
+        self.stdout.write(self.style.SUCCESS(f'Обновлено локаций: {updated}'))
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_ads_count(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    Advertisement = apps.get_model('advertisements', 'Advertisement')
+    db = schema_editor.connection.alias
+
+    total = Subquery(Advertisement.objects.using(db).filter(author=OuterRef('pk')).order_by()
+                     .values('author').annotate(total=Count('pk')).values('total'))
+    User.objects.using(db).update(ads_count=Coalesce(total, Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+        ('advertisements', '0005_ad_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='ads_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_ads_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.1.13 on 2026-10-18 18:05
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_locations(apps, schema_editor):
+    """Оставляет по одной локации на название и переносит на неё связи с пользователями"""
+    Location = apps.get_model('users', 'Location')
+    User = apps.get_model('users', 'User')
+    through = User.location.through
+    db = schema_editor.connection.alias
+
+    duplicates = (Location.objects.using(db).values('name').annotate(keep=Min('id'), total=Count('id'))
+                  .filter(total__gt=1).values_list('name', 'keep'))
+    for name, keep in duplicates:
+        # Остаётся самая старая локация с этим названием
+        extra = list(Location.objects.using(db).filter(name=name).exclude(id=keep).values_list('id', flat=True))
+
+        links = through.objects.using(db)
+        linked = set(links.filter(location_id=keep).values_list('user_id', flat=True))
+        users = set(links.filter(location_id__in=extra).values_list('user_id', flat=True)) - linked
+        links.filter(location_id__in=extra).delete()
+        links.bulk_create([through(user_id=user_id, location_id=keep) for user_id in users])
+        Location.objects.using(db).filter(id__in=extra).delete()
+
+    if schema_editor.connection.vendor == 'postgresql':
+        # Иначе PostgreSQL не даст изменить users_location: у неё остались отложенные проверки FK
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        schema_editor.execute('SET CONSTRAINTS ALL DEFERRED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_ads_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_locations, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='location',
+            name='lat',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=8, null=True),
+        ),
+        migrations.AlterField(
+            model_name='location',
+            name='lng',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=8, null=True),
+        ),
+        migrations.AlterField(
+            model_name='location',
+            name='name',
+            field=models.CharField(max_length=200, unique=True),
+        ),
+    ]
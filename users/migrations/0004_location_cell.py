@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+from users.geo import update_location_cells
+
+
+def fill_cells(apps, schema_editor):
+    Location = apps.get_model('users', 'Location')
+    update_location_cells(Location.objects.using(schema_editor.connection.alias).exclude(lat=None))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_location_name_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='location',
+            name='cell',
+            field=models.IntegerField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='location',
+            name='lng',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True),
+        ),
+        migrations.RunPython(fill_cells, migrations.RunPython.noop),
+    ]
@@ -1,21 +1,35 @@
 from django.contrib.auth.models import UserManager, AbstractUser
 from django.db import models
 
+from counters.models import CountedModelMixin
+
 
 class Location(models.Model):
-    name = models.CharField(max_length=200, blank=False)
-    lat = models.DecimalField(max_digits=8, decimal_places=6)
-    lng = models.DecimalField(max_digits=8, decimal_places=6)
+    name = models.CharField(max_length=200, blank=False, unique=True)
+    # Локации, созданные по одному названию при регистрации, приходят без координат
+    lat = models.DecimalField(max_digits=8, decimal_places=6, null=True, blank=True)
+    # Долгота до ±180, поэтому на разряд больше, чем у широты
+    lng = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True)
+    # Ячейка сетки для поиска по радиусу, вычисляется из lat/lng, см. users/geo.py
+    cell = models.IntegerField(null=True, blank=True, editable=False, db_index=True)
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        from users.geo import cell_id
+
+        self.cell = cell_id(self.lat, self.lng)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'cell'}
+        super().save(*args, **kwargs)
+
     class Meta:
         verbose_name = 'Местоположение'
         verbose_name_plural = 'Локации'
 
 
-class User(AbstractUser):
+class User(CountedModelMixin, AbstractUser):
     ROLES = [
         ('admin', 'Администратор ОПГ'),
         ('member', 'Участиник ОПГ'),
@@ -35,6 +49,11 @@ class User(AbstractUser):
     role = models.CharField(max_length=9, choices=ROLES, blank=False, default='member')
     age = models.PositiveSmallIntegerField(blank=True, null=True)
     location = models.ManyToManyField(Location)
+    # Число объявлений пользователя, поддерживается при изменениях Advertisement
+    ads_count = models.PositiveIntegerField(default=0, editable=False)
+    created = models.DateTimeField(auto_now_add=True)
+    # Не меняется при пересчёте ads_count, который идёт через update()
+    updated = models.DateTimeField(auto_now=True, db_index=True)
 
     #USERNAME_FIELD = 'username'
     #REQUIRED_FIELDS = []
@@ -0,0 +1,26 @@
+from collections import defaultdict
+
+from ads.fieldsets import Fieldset
+from users.models import User
+
+
+def user_locations(ids, using=None):
+    """{id пользователя: [названия локаций]} одним запросом на всю страницу"""
+    result = defaultdict(list)
+    links = User.location.through.objects.using(using).filter(user_id__in=ids).order_by('id')
+    for user_id, name in links.values_list('user_id', 'location__name'):
+        result[user_id].append(name)
+    return result
+
+
+USER_FIELDS = {
+    'id': 'id',
+    'username': 'username',
+    'first_name': 'first_name',
+    'last_name': 'last_name',
+    'role': 'role',
+    'age': 'age',
+}
+# Локации читаются отдельным запросом, только если их запросили
+USER_DETAIL_FIELDSET = Fieldset(USER_FIELDS, related={'locations': user_locations})
+USER_LIST_FIELDSET = Fieldset({**USER_FIELDS, 'total_ads': 'ads_count'}, related={'locations': user_locations})
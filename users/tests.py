@@ -1,3 +1,191 @@
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
 
-# Create your tests here.
+from ads import settings
+from advertisements.author_counts import find_ads_count_mismatches, recount_ads_count
+from advertisements.models import Advertisement
+from categories.models import Category
+from counters.services import recount
+from users.geo import haversine_km, locations_within, users_within
+from users.locations import add_user_locations
+from users.models import User, Location
+
+CENTER = (55.75, 37.62)
+
+
+class UserQueryCountTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def create_users(self, count):
+        for i in range(count):
+            user = User.objects.create(username=f'user_{i}', first_name='Имя')
+            user.location.add(Location.objects.create(name=f'Локация {i}', lat=55, lng=37))
+        recount()
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        self.create_users(settings.TOTAL_ON_PAGE)
+
+        # Счётчик пользователей, страница пользователей и одна выборка локаций
+        with self.assertNumQueries(3):
+            response = self.client.get('/user/')
+
+        items = response.json()['items']
+        self.assertEqual(len(items), settings.TOTAL_ON_PAGE)
+        self.assertTrue(all(len(item['locations']) == 1 for item in items))
+
+    def test_batch_queries_do_not_depend_on_ids(self):
+        self.create_users(5)
+        ids = ','.join(str(pk) for pk in User.objects.values_list('id', flat=True))
+
+        # Пользователи и одна выборка локаций
+        with self.assertNumQueries(2):
+            response = self.client.get('/user/batch/', {'ids': ids + ',999'})
+
+        self.assertEqual(len(response.json()['items']), 5)
+        self.assertEqual(response.json()['missing'], [999])
+
+    def test_detail_queries(self):
+        self.create_users(1)
+        user = User.objects.get()
+
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/user/{user.id}/')
+
+        self.assertEqual(response.json()['locations'], ['Локация 0'])
+
+
+class AdsCountTest(TestCase):
+    def setUp(self):
+        self.authors = [User.objects.create(username=f'author_{i}', first_name='Автор') for i in range(3)]
+        self.category = Category.objects.create(name='Категория')
+
+    def create_ad(self, author, price=1):
+        return Advertisement.objects.create(name='Объявление', author=author, price=price, category=self.category)
+
+    def ads_counts(self):
+        return list(User.objects.order_by('id').values_list('ads_count', flat=True))
+
+    def test_single_changes(self):
+        ads = [self.create_ad(self.authors[0]) for _ in range(3)]
+        ads[0].author = self.authors[1]
+        ads[0].save()
+        ads[1].delete()
+        # Сохранение без смены автора счётчик не трогает
+        ads[2].price = 5
+        ads[2].save()
+
+        self.assertEqual(self.ads_counts(), [1, 1, 0])
+        self.assertEqual(find_ads_count_mismatches(), [])
+
+    def test_bulk_changes(self):
+        Advertisement.objects.bulk_create([Advertisement(name='Пакет', author=author, price=1, category=self.category)
+                                           for author in self.authors * 2])
+        Advertisement.objects.filter(author=self.authors[0]).update(author=self.authors[2])
+        Advertisement.objects.filter(pk=Advertisement.objects.filter(author=self.authors[1]).earliest('id').pk).delete()
+
+        self.assertEqual(self.ads_counts(), [0, 1, 4])
+        self.assertEqual(find_ads_count_mismatches(), [])
+
+    def test_list_and_recount(self):
+        self.create_ad(self.authors[1])
+        User.objects.filter(pk=self.authors[1].pk).update(ads_count=7)
+        self.assertEqual(find_ads_count_mismatches(), [(self.authors[1].id, 'author_1', 7, 1)])
+
+        recount_ads_count()
+        recount()
+
+        self.assertEqual(find_ads_count_mismatches(), [])
+        items = self.client.get('/user/').json()['items']
+        self.assertEqual([item['total_ads'] for item in items], [0, 1, 0])
+
+
+class UserLocationsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='user', first_name='Имя')
+        self.existing = Location.objects.create(name='Москва')
+
+    def names(self):
+        return sorted(self.user.location.values_list('name', flat=True))
+
+    def test_queries_do_not_depend_on_number_of_names(self):
+        names = ['Москва'] + [f'Город {i}' for i in range(10)]
+        # Поиск существующих, вставка новых, их id и одна вставка связей
+        with self.assertNumQueries(4):
+            location_ids = add_user_locations(self.user, names)
+
+        self.assertEqual(list(location_ids), names)
+        self.assertEqual(location_ids['Москва'], self.existing.id)
+        self.assertEqual(self.names(), sorted(names))
+
+    def test_duplicate_names_and_links(self):
+        self.user.location.add(self.existing)
+
+        location_ids = add_user_locations(self.user, ['Москва', 'Питер', '', 'Питер', None])
+        add_user_locations(self.user, ['Питер'])
+
+        self.assertEqual(list(location_ids), ['Москва', 'Питер'])
+        self.assertEqual(Location.objects.filter(name='Питер').count(), 1)
+        self.assertEqual(self.names(), ['Москва', 'Питер'])
+
+    def test_location_inserted_concurrently(self):
+        bulk_create = Location.objects.bulk_create
+
+        def insert_first(objects, **kwargs):
+            # Параллельная транзакция успела вставить то же название после поиска существующих
+            Location.objects.create(name='Питер')
+            return bulk_create(objects, **kwargs)
+
+        with mock.patch.object(Location.objects, 'bulk_create', side_effect=insert_first):
+            location_ids = add_user_locations(self.user, ['Питер', 'Казань'])
+
+        self.assertEqual(Location.objects.filter(name='Питер').count(), 1)
+        self.assertEqual(location_ids['Питер'], Location.objects.get(name='Питер').id)
+        self.assertEqual(self.names(), ['Казань', 'Питер'])
+
+
+class GeoRadiusTest(TestCase):
+    def setUp(self):
+        # Расстояния от CENTER: ~5 км; ~11 км - в прямоугольнике для радиуса 10 км, но вне круга; ~635 км
+        self.near = Location.objects.create(name='Рядом', lat=55.738472, lng=37.548188)
+        self.corner = Location.objects.create(name='Угол', lat=55.82, lng=37.74)
+        self.far = Location.objects.create(name='Далеко', lat=59.93, lng=30.31)
+        self.users = [User.objects.create(username=f'user_{i}') for i in range(3)]
+        self.users[0].location.add(self.near, self.far)
+        self.users[1].location.add(self.corner)
+        self.users[2].location.add(self.far)
+
+    def test_locations_within_matches_haversine(self):
+        for radius_km in (1, 10, 15, 1000):
+            with self.subTest(radius_km=radius_km):
+                expected = {location.id: haversine_km(*CENTER, float(location.lat), float(location.lng))
+                            for location in Location.objects.all()}
+                expected = {pk: distance for pk, distance in expected.items() if distance <= radius_km}
+                found = locations_within(*CENTER, radius_km)
+
+                self.assertEqual(found.keys(), expected.keys())
+                for pk, distance in found.items():
+                    self.assertAlmostEqual(distance, expected[pk], places=6)
+
+    def test_users_within_use_nearest_location(self):
+        self.assertEqual([user_id for user_id, _ in users_within(*CENTER, 10)], [self.users[0].id])
+        self.assertEqual([user_id for user_id, _ in users_within(*CENTER, 1000)],
+                         [self.users[0].id, self.users[1].id, self.users[2].id])
+        self.assertLess(dict(users_within(*CENTER, 1000))[self.users[0].id], 5)
+
+    def test_nearby_views(self):
+        category = Category.objects.create(name='Категория')
+        for price, user in enumerate(self.users * 2):
+            Advertisement.objects.create(name='Объявление', author=user, price=price, category=category)
+        query = {'lat': CENTER[0], 'lng': CENTER[1], 'radius_km': 15}
+
+        users = self.client.get('/user/nearby/', query).json()
+        self.assertEqual([(item['id'], round(item['distance_km'])) for item in users['items']],
+                         [(self.users[0].id, 5), (self.users[1].id, 11)])
+
+        ads = self.client.get('/ad/nearby/', query).json()
+        self.assertEqual(ads['total'], 4)
+        self.assertEqual([(item['price'], round(item['distance_km'])) for item in ads['items']],
+                         [(4, 11), (3, 5), (1, 11), (0, 5)])
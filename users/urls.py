@@ -1,10 +1,13 @@
 from django.urls import path
 
+from ads.routing import select_view
 from users.views import *
 
 urlpatterns = [
-    path('', UserListView.as_view(), name='users'),
-    path('<int:pk>/', UserDetailView.as_view(), name='user'),
+    path('', select_view('users', UserListView, AsyncUserListView), name='users'),
+    path('nearby/', UserNearbyView.as_view(), name='nearby users'),
+    path('batch/', UserBatchView.as_view(), name='batch users'),
+    path('<int:pk>/', select_view('user', UserDetailView, AsyncUserDetailView), name='user'),
     path('create/', UserCreateView.as_view(), name='create user'),
     path('<int:pk>/update/', UserUpdateView.as_view(), name='update user'),
     path('<int:pk>/delete/', UserDeleteView.as_view(), name='delete user'),
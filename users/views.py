@@ -1,64 +1,154 @@
 import json
 from django.contrib.auth import get_user_model
 from django.core.paginator import Paginator
-from django.db.models import Count
-from django.http import JsonResponse
+from django.http import Http404
 from django.utils.decorators import method_decorator
+from django.views import View
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 
 from ads import settings
+from ads.cache import CachedResponseMixin
+from ads.fieldsets import parse_ids
+from ads.serializers import JsonResponse
 from advertisements.models import Advertisement
-from users.models import User, Location
+from counters.pagination import apaginate, paginate, parse_count_mode
+from users.geo import parse_point, users_within
+from users.locations import add_user_locations
+from users.models import User
+from users.serializers import USER_DETAIL_FIELDSET, USER_LIST_FIELDSET
 
 
 @method_decorator(csrf_exempt, name='dispatch')
-class UserListView(ListView):
+class UserListView(CachedResponseMixin, ListView):
     model = get_user_model()
+    # total_ads зависит от объявлений, locations - от локаций
+    cache_tags = ('users', 'locations', 'ads')
 
     def get(self, request, *args, **kwargs):
         super().get(request, *args, **kwargs)
 
-        self.object_list = self.object_list.order_by('username').annotate(total=Count('advertisement'))
+        try:
+            fields = USER_LIST_FIELDSET.parse(request.GET)
+            parse_count_mode(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        self.object_list = USER_LIST_FIELDSET.apply(self.object_list, fields).order_by('username')
 
-        paginator = Paginator(self.object_list, settings.TOTAL_ON_PAGE)
-        page_num: int = request.GET.get('page')
-        page = paginator.get_page(page_num)
+        page, total, num_pages = paginate(self.object_list, request.GET, settings.TOTAL_ON_PAGE,
+                                          model=get_user_model())
 
-        result: list = [{"id": user_page.id,
-                         "username": user_page.username,
-                         "first_name": user_page.first_name,
-                         "last_name": user_page.last_name,
-                         "role": user_page.role,
-                         "age": user_page.age,
-                         "locations": list(map(str, user_page.location.all())),
-                         "total_ads": user_page.total}
-                        for user_page in page]
+        result: list = self._serialize(page, fields, self.object_list.db)
 
         response: dict = {"items": result,
-                          "total": paginator.count,
-                          "num_pages": paginator.num_pages}
+                          "total": total,
+                          "num_pages": num_pages}
 
         return JsonResponse(response, safe=False, status=200)
 
+    @staticmethod
+    def _serialize(users, fields=None, using=None):
+        return USER_LIST_FIELDSET.serialize(users, fields or USER_LIST_FIELDSET.names, using)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class UserNearbyView(View):
+    """Пользователи в радиусе ?radius_km= от точки ?lat=&lng=, от ближних к дальним. ?fields= - как у UserListView"""
+
+    def get(self, request, *args, **kwargs):
+        try:
+            lat, lng, radius_km = parse_point(request.GET)
+            fields = USER_LIST_FIELDSET.parse(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+
+        paginator = Paginator(users_within(lat, lng, radius_km), settings.TOTAL_ON_PAGE)
+        page = paginator.get_page(request.GET.get('page'))
+        ids = [user_id for user_id, _ in page]
+        users = USER_LIST_FIELDSET.apply(get_user_model().objects.filter(pk__in=ids), fields, ('id',))
+        users = {user.id: user for user in users}
+        items = UserListView._serialize([users[user_id] for user_id in ids], fields)
+
+        result = [dict(item, distance_km=round(distance, 3)) for item, (_, distance) in zip(items, page)]
+        response = {"items": result,
+                    "total": paginator.count,
+                    "num_pages": paginator.num_pages}
+        return JsonResponse(response, safe=False, status=200)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class UserBatchView(CachedResponseMixin, View):
+    """
+    Несколько пользователей одним запросом: ?ids=1,2,3, ?fields= - как у UserListView.
+    Пользователи идут в порядке ids, ненайденные id перечислены в missing
+    """
+    cache_tags = ('users', 'locations', 'ads')
+
+    def get(self, request, *args, **kwargs):
+        try:
+            ids = parse_ids(request.GET)
+            fields = USER_LIST_FIELDSET.parse(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+
+        items, missing = USER_LIST_FIELDSET.batch(get_user_model().objects, ids, fields)
+        return JsonResponse({'items': items, 'missing': missing}, status=200)
+
 
 @method_decorator(csrf_exempt, name='dispatch')
 class UserDetailView(DetailView):
     model = get_user_model()
 
     def get(self, request, *args, **kwargs):
-        super().get(request, *args, **kwargs)
-        self.object = self.get_object()
+        try:
+            fields = USER_DETAIL_FIELDSET.parse(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        self.object = self.get_object(USER_DETAIL_FIELDSET.apply(self.get_queryset(), fields))
 
-        response = {"id": self.object.id,
-                    "username": self.object.username,
-                    "first_name": self.object.first_name,
-                    "last_name": self.object.last_name,
-                    "role": self.object.role,
-                    "age": self.object.age,
-                    "locations": list(map(str, self.object.location.all()))}
+        return JsonResponse(self._serialize(self.object, fields), status=200)
 
-        return JsonResponse(response, status=200)
+    @staticmethod
+    def _serialize(user, fields=None, using=None):
+        return USER_DETAIL_FIELDSET.serialize([user], fields or USER_DETAIL_FIELDSET.names, using)[0]
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncUserListView(View):
+    """Async-вариант UserListView для ASGI, без кэша ответов"""
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            fields = USER_LIST_FIELDSET.parse(request.GET)
+            parse_count_mode(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        users = USER_LIST_FIELDSET.apply(get_user_model().objects, fields).order_by('username')
+        page, total, num_pages = await apaginate(users, request.GET, settings.TOTAL_ON_PAGE,
+                                                 model=get_user_model())
+
+        response: dict = {"items": await USER_LIST_FIELDSET.aserialize(page, fields, users.db),
+                          "total": total,
+                          "num_pages": num_pages}
+
+        return JsonResponse(response, safe=False, status=200)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncUserDetailView(View):
+    """Async-вариант UserDetailView для ASGI"""
+
+    async def get(self, request, pk, *args, **kwargs):
+        try:
+            fields = USER_DETAIL_FIELDSET.parse(request.GET)
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+        try:
+            user = await USER_DETAIL_FIELDSET.apply(get_user_model().objects, fields).aget(pk=pk)
+        except get_user_model().DoesNotExist:
+            raise Http404('No user found matching the query')
+
+        return JsonResponse((await USER_DETAIL_FIELDSET.aserialize([user], fields))[0], status=200)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -85,21 +175,9 @@ class UserCreateView(CreateView):
             role=data.get('role'),
             age=data.get('age')
         )
-        for location in data.get('location'):
-            loc, _ = Location.objects.get_or_create(location=location, defaults={"_is_active": "True"})
-            new_user.location.add(loc)
-
-        new_user.save()
+        add_user_locations(new_user, data.get('location') or [])
 
-        response = {"id": new_user.id,
-                    "username": new_user.username,
-                    "first_name": new_user.first_name,
-                    "last_name": new_user.last_name,
-                    "role": new_user.role,
-                    "age": new_user.age,
-                    "locations": list(map(str, new_user.location.all()))}
-
-        return JsonResponse(response, status=200)
+        return JsonResponse(USER_DETAIL_FIELDSET.serialize_pk(get_user_model().objects, new_user.pk), status=200)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -125,21 +203,10 @@ class UserUpdateView(UpdateView):
         self.object.role = data.get('role')
         self.object.age = data.get('age')
 
-        for location in data.get('location'):
-            loc, _ = Location.objects.get_or_create(location=location, defaults={"_is_active": "True"})
-            get_user_model().location.add(loc)
-
         self.object.save()
+        add_user_locations(self.object, data.get('location') or [])
 
-        response = {"id": self.object.id,
-                    "username": self.object.username,
-                    "first_name": self.object.first_name,
-                    "last_name": self.object.last_name,
-                    "role": self.object.role,
-                    "age": self.object.age,
-                    "locations": list(map(str, self.object.location.all()))}
-
-        return JsonResponse(response, status=200)
+        return JsonResponse(USER_DETAIL_FIELDSET.serialize_pk(get_user_model().objects, self.object.pk), status=200)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
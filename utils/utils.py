@@ -1,10 +1,15 @@
-import json
+import argparse
 import csv
+import gzip
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, Any
 
-datasets_path = '..\datasets'
-fixtures_path = '..\\fixtures'
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+datasets_path = os.path.join(BASE_DIR, 'datasets')
+fixtures_path = os.path.join(BASE_DIR, 'fixtures')
 
 models = {'ad.csv': 'advertisements.advertisement',
           'category.csv': "categories.category",
@@ -13,11 +18,46 @@ models = {'ad.csv': 'advertisements.advertisement',
           }
 
 
-def csv_to_json(datasets_path, file_path):
-    result = []
-
-    # Читаем csv файл и получаем данные из него
-    with open(os.path.join(datasets_path, file_path), encoding='utf-8') as csv_file:
+class FixtureWriter:
+    """
+    Пишет JSON-массив фикстуры по одной записи, не накапливая их в памяти.
+    В обычном режиме результат совпадает с json.dump(..., indent=4), в compact - без отступов
+    """
+
+    def __init__(self, path, compact=False, use_gzip=False):
+        self.path = path + '.gz' if use_gzip else path
+        self.compact = compact
+        self.use_gzip = use_gzip
+        self.count = 0
+
+    def __enter__(self):
+        if self.use_gzip:
+            self.file = gzip.open(self.path, 'wt', encoding='utf-8')
+        else:
+            self.file = open(self.path, 'w', encoding='utf-8')
+        self.file.write('[')
+        return self
+
+    def write(self, record: Dict[str, Any]):
+        if self.compact:
+            self.file.write((',' if self.count else '') + json.dumps(record, ensure_ascii=False,
+                                                                      separators=(',', ':')))
+        else:
+            text = json.dumps(record, ensure_ascii=False, indent=4).replace('\n', '\n    ')
+            self.file.write((',\n    ' if self.count else '\n    ') + text)
+        self.count += 1
+
+    def __exit__(self, *exc_info):
+        self.file.write(']' if self.compact or not self.count else '\n]')
+        self.file.close()
+
+
+def csv_to_json(datasets_path, file_path, output_path=None, compact=False, use_gzip=False):
+    output_path = output_path or fixtures_path
+
+    # Читаем csv файл построчно и сразу пишем записи в json файл
+    with open(os.path.join(datasets_path, file_path), encoding='utf-8') as csv_file, \
+            FixtureWriter(os.path.join(output_path, file_path[:-4] + '.json'), compact, use_gzip) as writer:
         csv_reader = csv.DictReader(csv_file)
         for rows in csv_reader:
             data = {}
@@ -35,19 +75,17 @@ def csv_to_json(datasets_path, file_path):
             data['pk'] = int(rows['id'])
             data['model'] = models.get(file_path)
             data['fields'] = rows
-            result.append(data)
+            writer.write(data)
+    return writer.count
 
-    # Сохраняем данные в json файл
-    with open(os.path.join(fixtures_path, file_path[:-4] + '.json'), 'w', encoding='utf-8') as json_file:
-        json.dump(result, json_file, ensure_ascii=False, indent=4)
 
-
-def create_m2mtable(datasets_path, file_path):
-    loc_ids = []
+def create_m2mtable(datasets_path, file_path, output_path=None, compact=False, use_gzip=False):
+    output_path = output_path or fixtures_path
     model_data = {"user.csv": "users.user.location"}
 
-    # Читаем csv файл и получаем данные из него
-    with open(os.path.join(datasets_path, file_path), encoding='utf-8') as csv_file:
+    # Читаем csv файл построчно и сразу пишем записи в json файл
+    with open(os.path.join(datasets_path, file_path), encoding='utf-8') as csv_file, \
+            FixtureWriter(os.path.join(output_path, 'locations.json'), compact, use_gzip) as writer:
         csv_reader = csv.DictReader(csv_file)
         for rows in csv_reader:
             result = {}
@@ -58,10 +96,8 @@ def create_m2mtable(datasets_path, file_path):
             data['pk'] = int(rows['id'])
             data['model'] = model_data.get(file_path)
             data['fields'] = result
-            loc_ids.append(data)
-    # Сохраняем данные в json файл
-    with open(os.path.join(fixtures_path, 'locations.json'), 'w', encoding='utf-8') as json_file:
-        json.dump(loc_ids, json_file, ensure_ascii=False, indent=4)
+            writer.write(data)
+    return writer.count
 
 
 def csv_locations_create(datasets_path, file_path):
@@ -77,13 +113,52 @@ def csv_locations_create(datasets_path, file_path):
         writer = csv.writer(new_file)
         writer.writerow(result)
 
-if __name__ == '__main__':
-    for filename in os.listdir(datasets_path):
-        csv_to_json(datasets_path, filename)
+
+def convert_file(task):
+    """Одна задача для пула процессов. Возвращает (имя, число записей, секунды, размер csv)"""
+    converter, input_path, file_path, output_path, compact, use_gzip = task
+    start = time.perf_counter()
+    count = converter(input_path, file_path, output_path, compact, use_gzip)
+    size = os.path.getsize(os.path.join(input_path, file_path))
+    return converter.__name__ + ':' + file_path, count, time.perf_counter() - start, size
+
+
+def convert_all(input_path, output_path, compact=False, use_gzip=False, workers=None):
+    os.makedirs(output_path, exist_ok=True)
+    tasks = []
+    for filename in sorted(os.listdir(input_path)):
+        if filename not in models:
+            continue
+        tasks.append((csv_to_json, input_path, filename, output_path, compact, use_gzip))
         if filename == 'user.csv':
-            create_m2mtable(datasets_path, filename)
-    csv_locations_create(datasets_path, 'user.csv')
+            tasks.append((create_m2mtable, input_path, filename, output_path, compact, use_gzip))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(convert_file, tasks))
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Преобразование csv датасетов в json фикстуры')
+    parser.add_argument('--input', default=datasets_path, help='папка с csv файлами')
+    parser.add_argument('--output', default=fixtures_path, help='папка для json фикстур')
+    parser.add_argument('--compact', action='store_true', help='писать json без отступов')
+    parser.add_argument('--gzip', action='store_true', help='сжимать фикстуры в .json.gz')
+    parser.add_argument('--workers', type=int, default=None, help='число процессов (по умолчанию - по числу CPU)')
+    args = parser.parse_args(argv)
 
+    start = time.perf_counter()
+    results = convert_all(args.input, args.output, args.compact, args.gzip, args.workers)
+    elapsed = time.perf_counter() - start
 
+    total_rows = 0
+    total_bytes = 0
+    for name, count, seconds, size in results:
+        total_rows += count
+        total_bytes += size
+        print(f'{name}: {count} записей за {seconds:.3f} с ({count / max(seconds, 1e-9):.0f} записей/с)')
+    print(f'Всего: {total_rows} записей, {total_bytes / 2 ** 20:.2f} МБ csv за {elapsed:.3f} с '
+          f'({total_rows / max(elapsed, 1e-9):.0f} записей/с)')
+
+
+if __name__ == '__main__':
+    main()